@@ -0,0 +1,40 @@
+"""Benchmarks of the overhead of the math, cmath and numpy API modules"""
+import sympy
+import eqpy.cmath
+import eqpy.math
+import eqpy.numpy
+
+modules = {'sympy': sympy, 'math': eqpy.math, 'cmath': eqpy.cmath,
+           'numpy': eqpy.numpy}
+
+
+class Calls(object):
+    """One call of a function of a module, with sympy as the baseline"""
+    params = [['sympy', 'math', 'cmath', 'numpy'],
+              ['sin', 'exp', 'sqrt', 'log']]
+    param_names = ['module', 'function']
+
+    def setup(self, module, function):
+        self.func = getattr(modules[module], function)
+        self.symbol = sympy.Symbol('x')
+        self.number = sympy.Float(0.5)
+
+    def time_symbol(self, module, function):
+        self.func(self.symbol)
+
+    def time_number(self, module, function):
+        self.func(self.number)
+
+
+class BinaryCalls(object):
+    params = [['math.atan2', 'math.hypot', 'numpy.arctan2', 'numpy.hypot',
+               'numpy.maximum']]
+    param_names = ['function']
+
+    def setup(self, function):
+        module, name = function.split('.')
+        self.func = getattr(modules[module], name)
+        self.x, self.y = sympy.symbols('x y')
+
+    def time_symbols(self, function):
+        self.func(self.x, self.y)
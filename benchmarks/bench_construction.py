@@ -0,0 +1,114 @@
+"""Benchmarks of building systems: symbols, equations and iteration"""
+import subprocess
+import sys
+import numpy
+import eqpy
+
+
+class Symbols(object):
+    params = [100, 10000]
+    param_names = ['n']
+    number = 1
+
+    def setup(self, n):
+        self.system = eqpy.System()
+        self.names = ['x%d' % i for i in range(n)]
+
+    def time_getattr(self, n):
+        system = self.system
+        for name in self.names:
+            getattr(system, name)
+
+    def time_integer_keys(self, n):
+        system = self.system
+        for i in range(n):
+            system[i]
+
+    def time_slice(self, n):
+        list(self.system[0:n])
+
+
+class CachedSymbols(object):
+    def setup(self):
+        self.system = eqpy.System()
+        self.system.x
+        self.system[1]
+
+    def time_getattr(self):
+        self.system.x
+
+    def time_integer_key(self):
+        self.system[1]
+
+
+class Equations(object):
+    params = [100, 2000]
+    param_names = ['n']
+    number = 1
+
+    def setup(self, n):
+        self.system = eqpy.System()
+        self.coeffs = numpy.eye(n, k=1) / 2
+
+    def time_assign(self, n):
+        system = self.system
+        for i in range(n):
+            system[i] = system[i + 1] / 2 + system.r
+
+    def time_assign_attributes(self, n):
+        system = self.system
+        for i in range(n):
+            setattr(system, 'x%d' % i, system.r * i)
+
+    def time_slice_values(self, n):
+        system = self.system
+        system[0:n] = [system.r * i for i in range(n)]
+
+    def time_template(self, n):
+        system = self.system
+        system[0:n] = lambda i: system[i + 1] / 2 + system.r
+
+    def time_linear(self, n):
+        system = self.system
+        system[0:n] = eqpy.Linear(self.coeffs, system[0:n], 1.0)
+
+
+class Iteration(object):
+    params = [100, 2000]
+    param_names = ['n']
+
+    def setup(self, n):
+        self.system = eqpy.System()
+        for i in range(n):
+            self.system[i] = self.system[i + 1] / 2 + self.system.r
+
+    def time_iterate(self, n):
+        list(self.system)
+
+    def time_equations(self, n):
+        for eqs in self.system[...].equations.values():
+            pass
+
+    def time_freesymbols(self, n):
+        self.system[...].freesymbols()
+
+
+class Import(object):
+    number = 1
+    repeat = 3
+
+    def setup(self):
+        for name in list(sys.modules):
+            if name == 'eqpy' or name.startswith('eqpy.'):
+                del sys.modules[name]
+
+    def teardown(self):
+        __import__('eqpy')
+
+    def time_import(self):
+        """Import eqpy when sympy and numpy are already imported"""
+        __import__('eqpy')
+
+    def time_import_process(self):
+        """Start Python and import eqpy with its dependencies"""
+        subprocess.check_call([sys.executable, '-c', 'import eqpy'])
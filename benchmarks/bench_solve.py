@@ -0,0 +1,107 @@
+"""Benchmarks of solving linear and nonlinear systems of growing size
+
+The ``cold`` benchmarks solve new systems, including decomposition and
+compilation, and the ``warm`` ones solve again with new values.
+"""
+import numpy
+import sympy
+import eqpy
+
+
+def chain(n):
+    """Explicit chain of linear equations"""
+    A = eqpy.System()
+    for i in range(n - 1):
+        A[i] = A[i + 1] / 2 + A.r
+    A[n - 1] = A.r
+    return A
+
+
+def cycle(n):
+    """Linear equations that are solved together"""
+    A = eqpy.System()
+    for i in range(n):
+        A[i] = A[(i + 1) % n] / 2 + A.r * i
+    return A
+
+
+def nonlinear(n):
+    """Pairs of nonlinear equations, coupled along a chain"""
+    A = eqpy.System()
+    for i in range(n):
+        prev = A.r if i == 0 else A[2 * i - 2]
+        A[2 * i] = sympy.exp(-A[2 * i + 1]) + prev / 2
+        A[2 * i + 1] = A[2 * i]**3 / 10 + A.r
+    return A
+
+
+def leontief(n):
+    """Dense linear system from arrays"""
+    numpy.random.seed(0)
+    A = eqpy.System()
+    A[0:n] = eqpy.Linear(numpy.random.rand(n, n) / n, A[0:n],
+                         numpy.random.rand(n))
+    return A
+
+
+systems = {'chain': chain, 'cycle': cycle, 'nonlinear': nonlinear,
+           'leontief': leontief}
+
+
+class NumericCold(object):
+    params = [['chain', 'cycle', 'nonlinear', 'leontief'], [10, 100, 1000]]
+    param_names = ['system', 'n']
+    number = 1
+    repeat = 3
+
+    def setup(self, system, n):
+        if system == 'nonlinear' and n > 100:
+            # compiling takes many seconds
+            raise NotImplementedError
+        self.system = systems[system](n)
+
+    def time_nsolve(self, system, n):
+        self.system[...].nsolve({self.system.r: 0.5})
+
+
+class NumericWarm(NumericCold):
+    number = 0
+    repeat = 5
+
+    def setup(self, system, n):
+        NumericCold.setup(self, system, n)
+        self.value = 0.5
+        self.system[...].nsolve({self.system.r: self.value})
+
+    def time_nsolve(self, system, n):
+        self.value += 1e-3
+        self.system[...].nsolve({self.system.r: self.value})
+
+
+class Batch(object):
+    params = [['chain', 'nonlinear'], [10, 100]]
+    param_names = ['system', 'n']
+
+    def setup(self, system, n):
+        self.system = systems[system](n)
+        self.values = numpy.linspace(0.1, 1.0, 1000)
+        self.system[...].nsolve_batch({self.system.r: self.values[:2]})
+
+    def time_nsolve_batch(self, system, n):
+        self.system[...].nsolve_batch({self.system.r: self.values})
+
+
+class Symbolic(object):
+    params = [['chain', 'cycle'], [10, 50]]
+    param_names = ['system', 'n']
+    number = 1
+    repeat = 3
+
+    def setup(self, system, n):
+        self.system = systems[system](n)
+
+    def time_solve(self, system, n):
+        self.system[...].solve({self.system.r: sympy.Rational(1, 2)})
+
+    def time_solve_parametric(self, system, n):
+        self.system[...].solve(unknowns=self.system[0:n])
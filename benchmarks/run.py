@@ -0,0 +1,157 @@
+"""Run the benchmarks without airspeed velocity and write JSON results
+
+The benchmark modules follow the conventions of airspeed velocity: every
+``time_*`` method of a class in a ``bench_*`` module is a benchmark, and
+classes may define ``setup``, ``teardown``, ``params``, ``param_names``,
+``number`` and ``repeat``.  ``setup`` runs before every sample of
+``number`` calls, and raising ``NotImplementedError`` in it skips the
+parameter combination.
+
+Usage::
+
+    python -m benchmarks.run [-b REGEX] [-o FILE] [--quick]
+    python -m benchmarks.run --compare OLD.json NEW.json
+
+Results map every benchmark (``module.Class.time_name``, with parameters
+in brackets) to the minimum and median seconds per call of its samples.
+"""
+import argparse
+import importlib
+import itertools
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import time
+
+clock = getattr(time, 'perf_counter', time.time)
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def modules():
+    for filename in sorted(os.listdir(HERE)):
+        if filename.startswith('bench_') and filename.endswith('.py'):
+            yield importlib.import_module('benchmarks.' + filename[:-3])
+
+
+def benchmarks(pattern=None):
+    """Yield ``(name, class, method name, params)`` of every benchmark"""
+    for module in modules():
+        for classname in sorted(vars(module)):
+            cls = getattr(module, classname)
+            if not isinstance(cls, type) or cls.__module__ != module.__name__:
+                continue
+            params = getattr(cls, 'params', [])
+            if params and not isinstance(params[0], (list, tuple)):
+                params = [params]
+            for method in sorted(vars(cls)):
+                if not method.startswith('time_'):
+                    continue
+                for args in itertools.product(*params):
+                    name = '%s.%s.%s' % (module.__name__.split('.')[-1],
+                                         classname, method)
+                    if args:
+                        name += '(%s)' % ', '.join(repr(arg) for arg in args)
+                    if pattern is None or re.search(pattern, name):
+                        yield name, cls, method, args
+
+
+def sample(cls, method, args, number):
+    """Return the seconds per call of one sample of `number` calls"""
+    bench = cls()
+    if hasattr(bench, 'setup'):
+        bench.setup(*args)
+    func = getattr(bench, method)
+    try:
+        start = clock()
+        for _ in range(number):
+            func(*args)
+        return (clock() - start) / number
+    finally:
+        if hasattr(bench, 'teardown'):
+            bench.teardown(*args)
+
+
+def measure(cls, method, args, quick=False):
+    """Return the statistics of the samples of a benchmark, or None if it
+    is skipped"""
+    try:
+        first = sample(cls, method, args, 1)
+    except NotImplementedError:
+        return None
+    number = getattr(cls, 'number', 0)
+    if not number:
+        # enough calls for samples of about 20 ms
+        number = max(1, min(10**6, int(0.02 / max(first, 1e-9))))
+    repeat = 1 if quick else getattr(cls, 'repeat', 5)
+    times = sorted(sample(cls, method, args, number) for _ in range(repeat))
+    return {'min': times[0], 'median': times[len(times) // 2],
+            'number': number, 'repeat': repeat}
+
+
+def environment():
+    import eqpy
+    import numpy
+    import sympy
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=HERE,
+            stderr=subprocess.STDOUT).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'eqpy': eqpy.__version__, 'commit': commit,
+            'python': platform.python_version(),
+            'numpy': numpy.__version__, 'sympy': sympy.__version__,
+            'machine': platform.machine(), 'platform': platform.platform(),
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def run(pattern=None, quick=False, out=sys.stdout):
+    results = {}
+    for name, cls, method, args in benchmarks(pattern):
+        result = measure(cls, method, args, quick)
+        if result is None:
+            out.write('%-60s skipped\n' % name)
+        else:
+            results[name] = result
+            out.write('%-60s %10.3g s\n' % (name, result['min']))
+        out.flush()
+    return {'environment': environment(), 'results': results}
+
+
+def compare(old, new, out=sys.stdout):
+    """Print the ratio of the new to the old minimum of every benchmark"""
+    old, new = old['results'], new['results']
+    for name in sorted(set(old) & set(new)):
+        ratio = new[name]['min'] / old[name]['min']
+        flag = ' slower' if ratio > 1.1 else ' faster' if ratio < 0.9 else ''
+        out.write('%-60s %10.3g %10.3g %6.2f%s\n' % (
+            name, old[name]['min'], new[name]['min'], ratio, flag))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-b', '--bench', help='regex of benchmarks to run')
+    parser.add_argument('-o', '--output', help='file for the JSON results')
+    parser.add_argument('--quick', action='store_true',
+                        help='take a single sample of every benchmark')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help='compare two result files instead')
+    args = parser.parse_args(argv)
+    if args.compare:
+        with open(args.compare[0]) as f:
+            old = json.load(f)
+        with open(args.compare[1]) as f:
+            new = json.load(f)
+        compare(old, new)
+        return
+    results = run(args.bench, args.quick)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,6 @@
-from ._systems import BaseSystem, System
+from ._cache import SolveCache
+from ._storage import Linear
+from ._systems import BaseSystem, System, load
 from . import cmath
 from . import dummies
 from . import funcs
@@ -0,0 +1,108 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import sympy
+
+
+class SolveCache(object):
+    """Persistent cache of symbolic solutions, stored in a directory
+
+    Entries are keyed by a structural hash of the equations and unknowns,
+    so equal systems built in different processes share entries.  `Dummy`
+    symbols are identified by their names, assumptions and order of
+    appearance instead of their process-specific counters.  When the
+    entries take more than `maxsize` bytes, the least recently used ones
+    are removed.
+    """
+    def __init__(self, path, maxsize=256 * 2**20):
+        self.path = path
+        self.maxsize = maxsize
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def canonical(self, equations, unknowns):
+        """Return the hash of a problem and its canonical symbols
+
+        The second item maps every `Dummy` to the `Symbol` that replaces it
+        in stored entries.
+        """
+        equations = sorted(equations, key=str)
+        names = {}
+        replace = {}
+        for expr in equations + [sympy.Tuple(*unknowns)]:
+            for sym in sorted(expr.atoms(sympy.Dummy), key=str):
+                if sym not in replace:
+                    count = names.get(sym.name, 0)
+                    names[sym.name] = count + 1
+                    replace[sym] = sympy.Symbol(
+                        '_Dummy_%s_%d' % (sym.name, count), **sym.assumptions0)
+        text = sympy.srepr((
+            sorted(sympy.srepr(eq.xreplace(replace)) for eq in equations),
+            sorted(sympy.srepr(sym.xreplace(replace)) for sym in unknowns)))
+        return hashlib.sha256(text.encode('utf-8')).hexdigest(), replace
+
+    def filename(self, key):
+        return os.path.join(self.path, key + '.pickle')
+
+    def get(self, key):
+        """Return the entry stored under `key`, or None"""
+        filename = self.filename(key)
+        try:
+            with open(filename, 'rb') as f:
+                value = pickle.load(f)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return None
+        try:
+            os.utime(filename, None)
+        except OSError:
+            pass
+        return value
+
+    def set(self, key, value):
+        """Store `value` under `key` and evict old entries if needed"""
+        fd, tmpname = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(value, f, protocol=2)
+        os.rename(tmpname, self.filename(key))
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until under `maxsize`"""
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.endswith('.pickle'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.path, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, name in sorted(entries):
+            if total <= self.maxsize:
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                pass
+            total -= size
+
+    def solve(self, equations, unknowns, solve):
+        """Return ``solve(equations, unknowns)``, cached on disk
+
+        `solve` must return a list of dicts mapping unknowns to solutions.
+        """
+        key, replace = self.canonical(equations, unknowns)
+        solutions = self.get(key)
+        inverse = dict((val, sym) for sym, val in replace.items())
+        if solutions is None:
+            solutions = solve(equations, unknowns)
+            self.set(key, [
+                dict((sym.xreplace(replace), sympy.sympify(val).xreplace(
+                    replace)) for sym, val in solution.items())
+                for solution in solutions])
+            return solutions
+        return [dict((sym.xreplace(inverse), val.xreplace(inverse))
+                     for sym, val in solution.items())
+                for solution in solutions]
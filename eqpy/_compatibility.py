@@ -15,3 +15,13 @@ else:
     from itertools import imap as map
     from itertools import ifilter as filter
     from itertools import izip as zip
+
+try:
+    from collections.abc import Mapping, MutableMapping
+except ImportError:  # Python < 3.3
+    from collections import Mapping, MutableMapping
+
+try:
+    from math import gcd
+except ImportError:  # Python < 3.5
+    from fractions import gcd
@@ -0,0 +1,190 @@
+import numpy
+import sympy
+from sympy.printing.numpy import NumPyPrinter
+
+from ._compatibility import zip
+from ._profile import active, size, timed
+
+
+class Kernel(object):
+    """Vectorized numeric function of several sympy expressions
+
+    Calling a kernel with one array (or scalar) per symbol in `symbols`
+    evaluates every expression with NumPy broadcasting and returns the
+    results stacked along the first axis.
+
+    `assignments` is an optional sequence of ``(symbol, expr)`` pairs that
+    are evaluated in order before `exprs`, which may refer to them.
+    `original` gives the expressions before common subexpressions were
+    moved into `assignments`, and is used by ``count_ops``.
+    """
+    def __init__(self, exprs, symbols, assignments=(), original=None):
+        profiler = active()
+        with timed(profiler, 'compile'):
+            self.compile(exprs, symbols, assignments, original)
+        if profiler is not None:
+            profiler.count('kernel.exprs', len(self.exprs))
+            profiler.count('kernel.nodes', sum(size(expr)
+                                               for expr in self.exprs))
+
+    def compile(self, exprs, symbols, assignments, original):
+        self.exprs = tuple(exprs)
+        self.symbols = tuple(symbols)
+        self.assignments = tuple(assignments)
+        self.original = self.exprs if original is None else tuple(original)
+        # every symbol is renamed to a plain identifier, so the generated
+        # code needs no dummification of `Dummy` symbols or invalid names
+        names = dict((sym, sympy.Symbol('_a%d' % i))
+                     for i, sym in enumerate(self.symbols))
+        names.update((sym, sympy.Symbol('_t%d' % i))
+                     for i, (sym, _) in enumerate(self.assignments))
+        replacements = [(names[sym], expr.xreplace(names))
+                        for sym, expr in self.assignments]
+        exprs = [expr.xreplace(names) for expr in self.exprs]
+
+        def cse(exprs):
+            return replacements, exprs
+        # terms are printed in their stored order, which avoids sorting
+        # every Add and makes compiling large systems several times faster
+        printer = NumPyPrinter({'order': 'none', 'inline': True,
+                                'fully_qualified_modules': False,
+                                'allow_unknown_functions': True})
+        self.func = sympy.lambdify([names[sym] for sym in self.symbols],
+                                   exprs, modules='numpy', printer=printer,
+                                   cse=cse, dummify=False)
+
+    def __len__(self):
+        return len(self.exprs)
+
+    def count_ops(self):
+        """Return the operation counts without and with the assignments"""
+        before = sum(sympy.count_ops(expr) for expr in self.original)
+        after = sum(sympy.count_ops(expr) for expr in self.exprs)
+        after += sum(sympy.count_ops(expr) for _, expr in self.assignments)
+        return before, after
+
+    def __call__(self, *args):
+        if len(args) != len(self.symbols):
+            raise TypeError('expected %d arguments, got %d'
+                            % (len(self.symbols), len(args)))
+        args = [numpy.asarray(arg) for arg in args]
+        return stack(self.func(*args), args)
+
+
+def stack(values, args):
+    """Stack the values returned by a kernel into one array
+
+    Constant expressions evaluate to scalars, so every value is broadcast
+    to the common shape of the arguments.
+    """
+    shape = numpy.broadcast_shapes(*[arg.shape for arg in args])
+    values = [numpy.asarray(value) for value in values]
+    if any(numpy.iscomplexobj(value) for value in values):
+        dtype = complex
+    else:
+        dtype = float
+    out = numpy.empty((len(values),) + shape, dtype=dtype)
+    for i, value in enumerate(values):
+        out[i] = value
+    return out
+
+
+class Jacobian(object):
+    """Sparse Jacobian matrix evaluated from a kernel of its entries
+
+    `kernel` computes the structurally nonzero entries at positions `rows`
+    and `cols`.  Calling the Jacobian takes the arguments of the kernel and
+    returns dense matrices with shape ``broadcast_shape + shape``.
+    """
+    def __init__(self, rows, cols, shape, kernel):
+        self.rows = numpy.array(rows, dtype=int)
+        self.cols = numpy.array(cols, dtype=int)
+        self.shape = tuple(shape)
+        self.kernel = kernel
+
+    def __call__(self, *args):
+        values = self.kernel(*args)
+        out = numpy.zeros(values.shape[1:] + self.shape, dtype=values.dtype)
+        out[..., self.rows, self.cols] = numpy.moveaxis(values, 0, -1)
+        return out
+
+
+def derivatives(exprs, unknowns):
+    """Return the rows, columns and values of the nonzero derivatives"""
+    with timed(active(), 'derive'):
+        return differentiate(exprs, unknowns)
+
+
+def differentiate(exprs, unknowns):
+    rows = []
+    cols = []
+    entries = []
+    for i, expr in enumerate(exprs):
+        free = expr.free_symbols
+        for j, unknown in enumerate(unknowns):
+            if unknown in free:
+                entry = sympy.diff(expr, unknown)
+                if entry != 0:
+                    rows.append(i)
+                    cols.append(j)
+                    entries.append(entry)
+    return rows, cols, entries
+
+
+def common(groups):
+    """Eliminate common subexpressions across groups of expressions
+
+    Return the replacements found by ``sympy.cse`` and the reduced groups.
+    """
+    flat = [expr for exprs in groups for expr in exprs]
+    with timed(active(), 'cse'):
+        replacements, reduced = sympy.cse(
+            flat, symbols=sympy.numbered_symbols('cse', cls=sympy.Dummy),
+            order='none')
+    out = []
+    for exprs in groups:
+        out.append(reduced[:len(exprs)])
+        reduced = reduced[len(exprs):]
+    return replacements, out
+
+
+def needed(replacements, exprs, done=()):
+    """Return the replacements that `exprs` depend on, in order
+
+    Replacements whose symbols are in `done` are left out.
+    """
+    required = set()
+    for expr in exprs:
+        required.update(expr.free_symbols)
+    out = []
+    for sym, expr in reversed(replacements):
+        if sym in required and sym not in done:
+            out.append((sym, expr))
+            required.update(expr.free_symbols)
+    out.reverse()
+    return out
+
+
+def kernels(groups, symbols, cse=False):
+    """Compile one ``Kernel`` for each group of expressions
+
+    With `cse`, common subexpressions are eliminated across all groups
+    together, and every kernel computes the ones it needs.
+    """
+    if not cse:
+        return [Kernel(exprs, symbols) for exprs in groups]
+    replacements, reduced = common(groups)
+    return [Kernel(exprs, symbols, needed(replacements, exprs), original)
+            for exprs, original in zip(reduced, groups)]
+
+
+def newton_kernels(exprs, unknowns, symbols, cse=False):
+    """Compile residuals and their sparse Jacobian for Newton iterations
+
+    Return a ``Kernel`` of `exprs` and a ``Jacobian`` with respect to
+    `unknowns`, both taking `symbols`.
+    """
+    rows, cols, entries = derivatives(exprs, unknowns)
+    residuals, values = kernels([exprs, entries], symbols, cse)
+    return residuals, Jacobian(rows, cols, (len(exprs), len(unknowns)),
+                               values)
@@ -0,0 +1,163 @@
+import sympy
+from fractions import Fraction
+
+from ._compatibility import gcd, range, zip
+from ._structure import decompose
+
+
+def affine(exprs, unknowns):
+    """Split expressions that are affine in `unknowns` into coefficients
+
+    Return ``(rows, cols, coeffs, constants)`` such that ``exprs[i]`` is
+    the sum of ``coeffs[k] * unknowns[cols[k]]`` over all ``k`` with
+    ``rows[k] == i``, plus ``constants[i]``.  Entries are sorted by row and
+    column.  Equations in `exprs` stand for ``lhs - rhs``, which is not
+    built.  Return None if any expression is not affine in `unknowns`.
+    """
+    column = dict((sym, j) for j, sym in enumerate(unknowns))
+
+    def depends(expr):
+        if expr.is_Atom:
+            return expr in column
+        return any(sym in column for sym in expr.free_symbols)
+
+    entries = {}
+    constants = []
+    one = sympy.S.One
+    for i, expr in enumerate(exprs):
+        constant = []
+        # (term, factor) pairs; factors that do not involve the unknowns
+        # are distributed over sums instead of expanding the products
+        if isinstance(expr, sympy.Equality):
+            terms = [(expr.lhs, one), (expr.rhs, -one)]
+        else:
+            terms = [(expr, one)]
+        expanded = set()
+        while terms:
+            term, factor = terms.pop()
+            if term in column:
+                entries.setdefault((i, column[term]), []).append(factor)
+                continue
+            if term.is_Add:
+                terms.extend((arg, factor) for arg in term.args)
+                continue
+            if term.is_Mul:
+                dep = [arg for arg in term.args if depends(arg)]
+                if len(dep) == 1:
+                    rest = sympy.Mul(*[arg for arg in term.args
+                                       if arg is not dep[0]])
+                    terms.append((dep[0], rest if factor is one
+                                  else factor * rest))
+                    continue
+            else:
+                dep = depends(term)
+            if not dep:
+                constant.append(term if factor is one else factor * term)
+                continue
+            if term in expanded:
+                return None
+            # other products and powers may be linear once expanded
+            more = sympy.Add.make_args(sympy.expand(term))
+            expanded.update(more)
+            terms.extend((arg, factor) for arg in more)
+        constants.append(sympy.Add(*constant))
+    keys = sorted(entries)
+    rows = [i for i, j in keys]
+    cols = [j for i, j in keys]
+    coeffs = [sympy.Add(*entries[key]) for key in keys]
+    return rows, cols, coeffs, constants
+
+
+def bareiss(matrix):
+    """Solve an integer linear system by fraction-free elimination
+
+    `matrix` is a list of rows of Python ints, augmented with the
+    right-hand side as last column, and is modified in place.  Every
+    division in Bareiss' algorithm is exact, so intermediate values stay as
+    small as the minors of the matrix.  Return the solution as a list of
+    Fractions, or None if the matrix is singular.
+    """
+    n = len(matrix)
+    prev = 1
+    for k in range(n):
+        pivot = k
+        while pivot < n and matrix[pivot][k] == 0:
+            pivot += 1
+        if pivot == n:
+            return None
+        matrix[k], matrix[pivot] = matrix[pivot], matrix[k]
+        top = matrix[k]
+        akk = top[k]
+        for i in range(k + 1, n):
+            row = matrix[i]
+            aik = row[k]
+            if aik:
+                for j in range(k + 1, n + 1):
+                    row[j] = (row[j] * akk - aik * top[j]) // prev
+            elif akk != prev:
+                for j in range(k + 1, n + 1):
+                    if row[j]:
+                        row[j] = row[j] * akk // prev
+            row[k] = 0
+        prev = akk
+    x = [None] * n
+    for i in reversed(range(n)):
+        row = matrix[i]
+        total = Fraction(row[n])
+        for j in range(i + 1, n):
+            if row[j]:
+                total -= row[j] * x[j]
+        x[i] = total / row[i]
+    return x
+
+
+def exact_solve(equations, unknowns):
+    """Solve linear equations with rational coefficients exactly
+
+    The equations are split into the blocks of their block-triangular
+    decomposition, and each block is solved with ``bareiss`` on Python
+    ints.  Return a dict mapping unknowns to sympy Rationals, or None if
+    the equations are not square, linear and rational, or are singular.
+    """
+    if len(equations) != len(unknowns):
+        return None
+    terms = affine(equations, unknowns)
+    if terms is None:
+        return None
+    rows, cols, coeffs, constants = terms
+    if not all(val.is_Rational for val in coeffs + constants):
+        return None
+    entries = [[] for _ in equations]
+    for i, j, coeff in zip(rows, cols, coeffs):
+        entries[i].append((j, Fraction(int(coeff.p), int(coeff.q))))
+    try:
+        blocks = decompose([[j for j, _ in row] for row in entries],
+                           len(unknowns))
+    except ValueError:
+        return None
+    x = [None] * len(unknowns)
+    for block_rows, block_cols in blocks:
+        position = dict((j, k) for k, j in enumerate(block_cols))
+        matrix = []
+        for i in block_rows:
+            const = constants[i]
+            rhs = -Fraction(int(const.p), int(const.q))
+            row = [Fraction(0)] * len(block_cols)
+            for j, coeff in entries[i]:
+                if j in position:
+                    row[position[j]] = coeff
+                else:
+                    rhs -= coeff * x[j]
+            row.append(rhs)
+            # scale the row to integers
+            scale = 1
+            for val in row:
+                scale = scale * val.denominator // gcd(scale, val.denominator)
+            matrix.append([int(val * scale) for val in row])
+        solution = bareiss(matrix)
+        if solution is None:
+            return None
+        for j, val in zip(block_cols, solution):
+            x[j] = val
+    return dict((sym, sympy.Rational(val.numerator, val.denominator))
+                for sym, val in zip(unknowns, x))
@@ -0,0 +1,332 @@
+import math
+from collections import namedtuple
+import sympy
+
+from ._compatibility import range
+
+inf = float('inf')
+
+
+class Interval(namedtuple('Interval', ['lo', 'hi'])):
+    """Closed interval of real numbers, which may be unbounded"""
+    __slots__ = ()
+
+    def isempty(self):
+        return not self.lo <= self.hi
+
+    def intersect(self, other):
+        return Interval(max(self.lo, other.lo), min(self.hi, other.hi))
+
+    def contains(self, value, tol=0.0):
+        """Return whether `value` lies within `tol` (relative) of the
+        interval"""
+        scale = tol * max(1.0, abs(value))
+        return self.lo - scale <= value <= self.hi + scale
+
+    def choose(self, default=1.0):
+        """Return `default` if it is in the interval, or else a point that
+        is well inside"""
+        if self.lo <= default <= self.hi:
+            return default
+        if self.lo > -inf and self.hi < inf:
+            return 0.5 * (self.lo + self.hi)
+        if self.lo > -inf:
+            return self.lo + max(1.0, abs(self.lo))
+        return self.hi - max(1.0, abs(self.hi))
+
+
+EVERYTHING = Interval(-inf, inf)
+ZERO = Interval(0.0, 0.0)
+EPSILON = 2.0**-50
+
+
+def point(value):
+    return Interval(value, value)
+
+
+def outward(lo, hi):
+    """Interval from computed bounds, widened by a few units in the last
+    place so that rounding errors cannot exclude the true values
+
+    Bounds that are NaN after ``inf - inf`` become unbounded.
+    """
+    if lo != lo:
+        lo = -inf
+    elif -inf < lo < inf:
+        lo -= abs(lo) * EPSILON
+    if hi != hi:
+        hi = inf
+    elif -inf < hi < inf:
+        hi += abs(hi) * EPSILON
+    return Interval(lo, hi)
+
+
+def add(a, b):
+    return outward(a.lo + b.lo, a.hi + b.hi)
+
+
+def sub(a, b):
+    return outward(a.lo - b.hi, a.hi - b.lo)
+
+
+def mul(a, b):
+    # 0 * inf is NaN, but 0 times an unbounded value is still 0
+    products = [x * y if x and y else 0.0
+                for x in (a.lo, a.hi) for y in (b.lo, b.hi)]
+    return outward(min(products), max(products))
+
+
+def div(a, b):
+    if b.lo > 0 or b.hi < 0:
+        return mul(a, Interval(1.0 / b.hi, 1.0 / b.lo))
+    return EVERYTHING
+
+
+def power(value, exponent):
+    try:
+        return value ** exponent
+    except OverflowError:
+        return inf if value > 0 or exponent % 2 == 0 else -inf
+    except ZeroDivisionError:
+        return inf
+
+
+def integer_power(a, n):
+    """Return the interval of ``x**n`` for `x` in `a` and integer `n`"""
+    if n < 0:
+        return div(point(1.0), integer_power(a, -n))
+    lo, hi = power(a.lo, n), power(a.hi, n)
+    if n % 2 or a.lo >= 0:
+        return outward(lo, hi)
+    if a.hi <= 0:
+        return outward(hi, lo)
+    return outward(0.0, max(lo, hi))
+
+
+def real_power(a, p):
+    """Return the interval of ``x**p`` for `x` in `a` and real `p`
+
+    Only nonnegative `x` give real powers.
+    """
+    if a.hi < 0:
+        return Interval(inf, -inf)
+    lo = max(a.lo, 0.0)
+    if p > 0:
+        return outward(power(lo, p), power(a.hi, p))
+    return outward(power(a.hi, p), power(lo, p))
+
+
+def root(a, n):
+    """Return the `n`-th root of the nonnegative part of `a`"""
+    return real_power(a, 1.0 / n)
+
+
+def signed_root(value, n):
+    """Return the real `n`-th root of `value`, for odd `n`"""
+    return math.copysign(power(abs(value), 1.0 / n), value)
+
+
+def exp(a):
+    return outward(math.exp(min(a.lo, 700.0)) if a.lo > -inf else 0.0,
+                   math.exp(a.hi) if a.hi < 700.0 else inf)
+
+
+def log(a):
+    if a.hi <= 0:
+        return Interval(inf, -inf)
+    return outward(math.log(a.lo) if a.lo > 0 else -inf,
+                   math.log(a.hi) if a.hi < inf else inf)
+
+
+class Empty(Exception):
+    pass
+
+
+def forward(expr, domains, nodes):
+    """Evaluate the interval of `expr`, storing the intervals of all
+    subexpressions in `nodes`"""
+    if expr in nodes:
+        return nodes[expr]
+    if expr.is_Symbol:
+        result = domains.get(expr, EVERYTHING)
+    elif expr.is_Number or expr.is_NumberSymbol:
+        result = point(float(expr)) if expr.is_real else EVERYTHING
+    elif expr.is_Add:
+        result = ZERO
+        for arg in expr.args:
+            result = add(result, forward(arg, domains, nodes))
+    elif expr.is_Mul:
+        result = point(1.0)
+        for arg in expr.args:
+            result = mul(result, forward(arg, domains, nodes))
+    elif expr.is_Pow and expr.exp.is_Number and expr.exp.is_real:
+        base = forward(expr.base, domains, nodes)
+        if expr.exp.is_Integer:
+            result = integer_power(base, int(expr.exp))
+        else:
+            result = real_power(base, float(expr.exp))
+    elif isinstance(expr, sympy.exp):
+        result = exp(forward(expr.args[0], domains, nodes))
+    elif isinstance(expr, sympy.log) and len(expr.args) == 1:
+        result = log(forward(expr.args[0], domains, nodes))
+    else:
+        for arg in expr.args:
+            forward(arg, domains, nodes)
+        result = EVERYTHING
+    nodes[expr] = result
+    return result
+
+
+def backward(expr, target, domains, nodes, changed):
+    """Narrow the domains of the symbols in `expr` so that its value can
+    lie in `target`
+
+    Symbols whose domains were narrowed are added to `changed`.  Raise
+    ``Empty`` if no values are left.
+    """
+    current = nodes[expr]
+    narrowed = current.intersect(target)
+    if narrowed.isempty():
+        raise Empty
+    if narrowed == current and expr.is_Symbol:
+        return
+    nodes[expr] = narrowed
+    if expr.is_Symbol:
+        domains[expr] = narrowed
+        changed.append((expr, current))
+    elif expr.is_Add or expr.is_Mul:
+        args = expr.args
+        combine, unit = (add, ZERO) if expr.is_Add else (mul, point(1.0))
+        # combined intervals of the arguments before and after each one
+        before = [unit]
+        for arg in args[:-1]:
+            before.append(combine(before[-1], nodes[arg]))
+        after = unit
+        for i in reversed(range(len(args))):
+            others = combine(before[i], after)
+            if expr.is_Add:
+                backward(args[i], sub(narrowed, others), domains, nodes,
+                         changed)
+            elif not others.lo <= 0 <= others.hi:
+                backward(args[i], div(narrowed, others), domains, nodes,
+                         changed)
+            after = combine(nodes[args[i]], after)
+    elif expr.is_Pow and expr.exp.is_Number and expr.exp.is_real:
+        base = nodes[expr.base]
+        if expr.exp.is_Integer and expr.exp > 0:
+            n = int(expr.exp)
+            if n % 2:
+                target = outward(signed_root(narrowed.lo, n),
+                                 signed_root(narrowed.hi, n))
+            else:
+                inner, outer = root(Interval(max(narrowed.lo, 0.0),
+                                             narrowed.hi), n)
+                if base.lo >= 0:
+                    target = Interval(inner, outer)
+                elif base.hi <= 0:
+                    target = Interval(-outer, -inner)
+                else:
+                    target = Interval(-outer, outer)
+            backward(expr.base, target, domains, nodes, changed)
+        elif not expr.exp.is_Integer and expr.exp > 0:
+            target = real_power(Interval(max(narrowed.lo, 0.0), narrowed.hi),
+                                1.0 / float(expr.exp))
+            backward(expr.base, target, domains, nodes, changed)
+    elif isinstance(expr, sympy.exp):
+        backward(expr.args[0], log(narrowed), domains, nodes, changed)
+    elif isinstance(expr, sympy.log) and len(expr.args) == 1:
+        backward(expr.args[0], exp(narrowed), domains, nodes, changed)
+
+
+def constraint(relation):
+    """Return ``(expr, interval)`` such that `relation` requires the value
+    of `expr` to be in `interval`, or None for other relations
+
+    Strict inequalities give closed intervals.
+    """
+    expr = relation.lhs - relation.rhs
+    if isinstance(relation, sympy.Equality):
+        return expr, ZERO
+    if isinstance(relation, (sympy.GreaterThan, sympy.StrictGreaterThan)):
+        return expr, Interval(0.0, inf)
+    if isinstance(relation, (sympy.LessThan, sympy.StrictLessThan)):
+        return expr, Interval(-inf, 0.0)
+    return None
+
+
+def narrowed(old, new, ratio):
+    """Return whether `new` is narrower than `old` by more than `ratio`"""
+    if (old.lo == -inf) != (new.lo == -inf):
+        return True
+    if (old.hi == inf) != (new.hi == inf):
+        return True
+    width = old.hi - old.lo
+    return width < inf and new.hi - new.lo < (1 - ratio) * width
+
+
+def propagate(constraints, domains, ratio=1e-3, maxrevisions=None):
+    """Tighten the `domains` of symbols with interval constraint propagation
+
+    Each constraint is a pair ``(expr, interval)``.  The constraints are
+    revised one at a time, HC4-style, with a forward evaluation of the
+    intervals of all subexpressions and a backward projection onto the
+    symbols.  Constraints are revised again when the domain of one of their
+    symbols shrinks by more than `ratio`, at most `maxrevisions` times in
+    total.  `domains` maps symbols to intervals and is updated in place.
+    Return False if the constraints cannot be satisfied, and True
+    otherwise.
+    """
+    if maxrevisions is None:
+        maxrevisions = 50 * len(constraints) + 100
+    index = {}
+    for k, (expr, interval) in enumerate(constraints):
+        for sym in expr.free_symbols:
+            index.setdefault(sym, []).append(k)
+    queue = list(range(len(constraints)))
+    queued = set(queue)
+    revisions = 0
+    while queue and revisions < maxrevisions:
+        k = queue.pop(0)
+        queued.discard(k)
+        revisions += 1
+        expr, interval = constraints[k]
+        nodes = {}
+        changed = []
+        try:
+            forward(expr, domains, nodes)
+            backward(expr, interval, domains, nodes, changed)
+        except Empty:
+            return False
+        for sym, old in changed:
+            if not narrowed(old, domains[sym], ratio):
+                continue
+            for other in index[sym]:
+                if other != k and other not in queued:
+                    queue.append(other)
+                    queued.add(other)
+    return True
+
+
+def assumptions(interval):
+    """Return sympy assumptions for a symbol with values in `interval`"""
+    if interval.lo > 0:
+        return {'positive': True}
+    if interval.lo >= 0:
+        return {'nonnegative': True}
+    if interval.hi < 0:
+        return {'negative': True}
+    if interval.hi <= 0:
+        return {'nonpositive': True}
+    return {'real': True}
+
+
+def signs(keyword, symbols):
+    """Return relations for a keyword assumption, like ``positive=[x]``"""
+    relations = {'positive': lambda sym: sym > 0,
+                 'nonnegative': lambda sym: sym >= 0,
+                 'negative': lambda sym: sym < 0,
+                 'nonpositive': lambda sym: sym <= 0}
+    if keyword not in relations:
+        raise ValueError('unknown assumption %r; expected one of %s'
+                         % (keyword, ', '.join(sorted(relations))))
+    return [relations[keyword](sym) for sym in symbols]
@@ -0,0 +1,258 @@
+import warnings
+import numpy
+import sympy
+
+from ._compile import Kernel
+from ._compatibility import range, zip
+
+try:
+    import scipy.sparse
+    import scipy.sparse.linalg  # pragma: no cover
+except ImportError:  # pragma: no cover
+    scipy = None
+
+# matrices with more entries than this are not solved densely without SciPy
+DENSE = 2**22
+
+
+class LinearSolver(object):
+    """Solver for equations that are linear in their unknowns
+
+    The coefficients are extracted once into sparse (CSR-ordered) triplets
+    and compiled as functions of the parameters.  Each solve evaluates them
+    and runs a sparse LU factorization with SciPy, if it is installed.
+    Otherwise small systems are solved densely with NumPy, and large ones
+    by ``sparse_solve``.  The interface matches ``NewtonSolver``,
+    but no iteration or guess is needed.
+    """
+    def __init__(self, equations, unknowns, params, terms):
+        rows, cols, coeffs, constants = terms
+        if len(equations) != len(unknowns):
+            raise ValueError('cannot solve %d equations for %d unknowns'
+                             % (len(equations), len(unknowns)))
+        self.unknowns = tuple(unknowns)
+        self.params = tuple(params)
+        self.rows = numpy.array(rows, dtype=int)
+        self.cols = numpy.array(cols, dtype=int)
+        self.indptr = numpy.searchsorted(self.rows,
+                                         numpy.arange(len(equations) + 1))
+        # numbers are stored directly, and only distinct expressions of the
+        # parameters are compiled, which keeps large networks cheap
+        exprs = list(coeffs) + [-expr for expr in constants]
+        self.values = numpy.zeros(len(exprs))
+        self.positions = []
+        unique = {}
+        for i, expr in enumerate(exprs):
+            if expr.is_Number:
+                self.values[i] = float(expr)
+            else:
+                self.positions.append(i)
+                unique.setdefault(expr, len(unique))
+        self.index = numpy.array([unique[exprs[i]] for i in self.positions],
+                                 dtype=int)
+        self.positions = numpy.array(self.positions, dtype=int)
+        self.kernel = Kernel(sorted(unique, key=unique.get), self.params)
+
+    def count_ops(self):
+        return self.kernel.count_ops()
+
+    def evaluate(self, args, shape=()):
+        """Return the matrix entries and right-hand sides for `args`"""
+        values = numpy.empty((len(self.values),) + shape)
+        values[...] = self.values.reshape((-1,) + (1,) * len(shape))
+        if len(self.kernel):
+            values[self.positions] = self.kernel(*args).real[self.index]
+        return values[:len(self.rows)], values[len(self.rows):]
+
+    def linsolve(self, data, rhs):
+        """Solve one linear system given its matrix entries"""
+        n = len(self.unknowns)
+        with numpy.errstate(all='ignore'):
+            if scipy is not None:  # pragma: no cover
+                matrix = scipy.sparse.csc_matrix(
+                    scipy.sparse.csr_matrix((data, self.cols, self.indptr),
+                                            shape=(n, n)))
+                with warnings.catch_warnings():
+                    # singular matrices give NaN, reported as unconverged
+                    warnings.simplefilter('ignore')
+                    return numpy.atleast_1d(
+                        scipy.sparse.linalg.spsolve(matrix, rhs))
+            if n * n > DENSE:
+                return sparse_solve(n, self.rows, self.cols, data, rhs)
+            matrix = numpy.zeros((n, n))
+            matrix[self.rows, self.cols] = data
+            try:
+                return numpy.linalg.solve(matrix, rhs)
+            except numpy.linalg.LinAlgError:
+                return numpy.full(n, numpy.nan)
+
+    def solve(self, guess, args=(), tol=None, maxiter=None):
+        data, rhs = self.evaluate(args)
+        x = self.linsolve(data, rhs)
+        return x, bool(numpy.isfinite(x).all()), 0
+
+    def solve_batch(self, guess, args=(), tol=None, maxiter=None):
+        args = [numpy.asarray(arg, dtype=float) for arg in args]
+        shape = numpy.broadcast_shapes(*[arg.shape for arg in args])
+        if len(shape) > 1:
+            raise ValueError('batched values must be one-dimensional')
+        count = shape[0] if shape else 1
+        data, rhs = self.evaluate(args, (count,))
+        n = len(self.unknowns)
+        x = None
+        if n <= 64 or scipy is None and count * n * n <= DENSE:
+            # small systems are solved together as stacked dense matrices
+            matrices = numpy.zeros((count, n, n))
+            matrices[:, self.rows, self.cols] = data.T
+            try:
+                x = numpy.linalg.solve(matrices, rhs.T[..., None])[..., 0]
+            except numpy.linalg.LinAlgError:
+                pass
+        if x is None:
+            x = numpy.empty((count, n))
+            for i in range(count):
+                x[i] = self.linsolve(data[:, i], rhs[:, i])
+        converged = numpy.isfinite(x).all(axis=1)
+        return x, converged, numpy.zeros(count, dtype=int)
+
+
+class RowSolver(LinearSolver):
+    """``LinearSolver`` for rows of ``LinearBlock``s
+
+    The matrix, the right-hand sides and their dependence on parameters are
+    gathered from the arrays of the blocks with NumPy, without building
+    any sympy expressions.
+    """
+    def __init__(self, rows, unknowns, params):
+        if len(rows) != len(unknowns):
+            raise ValueError('cannot solve %d equations for %d unknowns'
+                             % (len(rows), len(unknowns)))
+        n = len(unknowns)
+        self.unknowns = tuple(unknowns)
+        self.params = tuple(params)
+        column = dict((sym, j) for j, sym in enumerate(self.unknowns))
+        param = dict((sym, k) for k, sym in enumerate(self.params))
+        # residuals ``name - offset - coeffs @ symbols`` are split into
+        # terms of unknowns (matrix) and of parameters
+        entries = ([], [], [])
+        terms = ([], [], [])
+        self.offsets = numpy.zeros(n)
+        groups = {}
+        for r, row in enumerate(rows):
+            groups.setdefault(id(row.block), (row.block, [], []))
+            block, positions, indices = groups[id(row.block)]
+            positions.append(r)
+            indices.append(row.index)
+            if row.lhs in column:
+                for out, val in zip(entries, (r, column[row.lhs], 1.0)):
+                    out.append(numpy.array([val]))
+            else:
+                for out, val in zip(terms, (r, param[row.lhs], 1.0)):
+                    out.append(numpy.array([val]))
+        for block, positions, indices in groups.values():
+            positions = numpy.array(positions, dtype=int)
+            indices = numpy.array(indices, dtype=int)
+            self.offsets[positions] = block.offsets[indices]
+            starts = block.indptr[indices]
+            counts = block.indptr[indices + 1] - starts
+            # positions of the entries of all selected rows in the CSR arrays
+            offsets = numpy.repeat(starts - numpy.cumsum(counts) + counts,
+                                   counts)
+            flat = offsets + numpy.arange(counts.sum())
+            where = numpy.repeat(positions, counts)
+            symbols = block.indices[flat]
+            values = -block.data[flat].astype(float)
+            cols = numpy.array([column.get(sym, -1) for sym in block.symbols],
+                               dtype=int)[symbols]
+            known = cols >= 0
+            for out, val in zip(entries, (where, cols, values)):
+                out.append(val[known])
+            pcols = numpy.array([param.get(sym, -1) for sym in block.symbols],
+                                dtype=int)[symbols]
+            for out, val in zip(terms, (where, pcols, values)):
+                out.append(val[~known])
+        rows, cols, data = [numpy.concatenate(out) if out else numpy.zeros(0)
+                            for out in entries]
+        # duplicate entries are summed, in CSR order
+        keys, inverse = numpy.unique(rows.astype(int) * n + cols.astype(int),
+                                     return_inverse=True)
+        self.data = numpy.bincount(inverse, weights=data,
+                                   minlength=len(keys))
+        self.rows = keys // n if n else keys
+        self.cols = keys % n if n else keys
+        self.indptr = numpy.searchsorted(self.rows, numpy.arange(n + 1))
+        prows, pcols, pdata = [numpy.concatenate(out) if out
+                               else numpy.zeros(0) for out in terms]
+        self.prows = prows.astype(int)
+        self.pcols = pcols.astype(int)
+        self.pdata = pdata
+
+    def count_ops(self):
+        return 0, 0
+
+    def evaluate(self, args, shape=()):
+        axes = (1,) * len(shape)
+        data = numpy.empty((len(self.data),) + shape)
+        data[...] = self.data.reshape((-1,) + axes)
+        rhs = numpy.empty((len(self.offsets),) + shape)
+        rhs[...] = self.offsets.reshape((-1,) + axes)
+        if len(self.pdata):
+            args = numpy.array([numpy.broadcast_to(arg, shape)
+                                for arg in args], dtype=float)
+            numpy.add.at(rhs, self.prows,
+                         -self.pdata.reshape((-1,) + axes) * args[self.pcols])
+        return data, rhs
+
+
+def sparse_solve(n, rows, cols, data, rhs):
+    """Solve a sparse square system by Gaussian elimination
+
+    The matrix has the entries `data` at `rows` and `cols`, and is
+    eliminated in place as dicts of rows, so memory only grows with the
+    entries and their fill-in, not with ``n**2``.  Columns are eliminated
+    from the sparsest, and each pivot is the sparsest row whose entry is
+    within a factor of 10 of the largest one of its column.  Return the
+    solution, or NaNs if the matrix is singular.
+    """
+    matrix = [{} for _ in range(n)]
+    for i, j, val in zip(rows.tolist(), cols.tolist(), data.tolist()):
+        matrix[i][j] = matrix[i].get(j, 0.0) + val
+    b = [float(val) for val in rhs]
+    # users[j] holds the rows that are not pivots yet and have column j
+    users = [set() for _ in range(n)]
+    for i, row in enumerate(matrix):
+        for j in row:
+            users[j].add(i)
+    pivots = []
+    for k in sorted(range(n), key=lambda j: len(users[j])):
+        candidates = users[k]
+        largest = max([abs(matrix[i][k]) for i in candidates] or [0.0])
+        if not largest > 0:
+            return numpy.full(n, numpy.nan)
+        p = min((i for i in candidates if abs(matrix[i][k]) >= 0.1 * largest),
+                key=lambda i: len(matrix[i]))
+        prow = matrix[p]
+        for j in prow:
+            users[j].discard(p)
+        pivot = prow[k]
+        for i in list(candidates):
+            row = matrix[i]
+            factor = row.pop(k) / pivot
+            candidates.discard(i)
+            for j, val in prow.items():
+                if j in row:
+                    row[j] -= factor * val
+                elif j != k:
+                    row[j] = -factor * val
+                    users[j].add(i)
+            b[i] -= factor * b[p]
+        pivots.append((k, p))
+    x = [0.0] * n
+    for k, p in reversed(pivots):
+        prow = matrix[p]
+        total = b[p]
+        for j, val in prow.items():
+            if j != k:
+                total -= val * x[j]
+        x[k] = total / prow[k]
+    return numpy.array(x)
@@ -0,0 +1,322 @@
+import numpy
+import sympy
+
+from ._compile import Kernel, common, derivatives, needed, newton_kernels
+from ._compatibility import range, zip
+from ._profile import active, timed
+
+
+def isconverged(residuals, tol):
+    return not residuals.size or bool(numpy.abs(residuals).max() <= tol)
+
+
+def linsolve(matrix, vector):
+    try:
+        return numpy.linalg.solve(matrix, vector)
+    except numpy.linalg.LinAlgError:
+        return numpy.linalg.lstsq(matrix, vector, rcond=None)[0]
+
+
+class NewtonSolver(object):
+    """Damped Newton solver for a square system of equations
+
+    The residuals and their analytic Jacobian are derived and compiled once
+    when the solver is created, so each call to ``solve`` only evaluates
+    NumPy code.  Both take the values of `unknowns` followed by the values
+    of `params`.
+    """
+    def __init__(self, equations, unknowns, params=(), cse=False):
+        exprs = [eq.lhs - eq.rhs for eq in equations]
+        if len(exprs) != len(unknowns):
+            raise ValueError('cannot solve %d equations for %d unknowns'
+                             % (len(exprs), len(unknowns)))
+        self.unknowns = tuple(unknowns)
+        self.params = tuple(params)
+        self.exprs = tuple(exprs)
+        self.residuals, self.jacobian = newton_kernels(
+            exprs, self.unknowns, self.unknowns + self.params, cse)
+        self.precise = None
+
+    def count_ops(self):
+        """Return the operation counts of the kernels without and with CSE"""
+        before, after = self.residuals.count_ops()
+        jacobian = self.jacobian.kernel.count_ops()
+        return before + jacobian[0], after + jacobian[1]
+
+    def solve(self, guess, args=(), tol=1e-10, maxiter=50):
+        """Iterate from `guess` until the residuals are below `tol`
+
+        Every Newton step is halved until it decreases the norm of the
+        residuals.  Return ``(x, converged, iterations)``.
+        """
+        args = list(args)
+        x = numpy.array(guess, dtype=float)
+        f = self.residuals(*(list(x) + args))
+        norm = numpy.linalg.norm(f)
+        for iteration in range(maxiter):
+            if isconverged(f, tol):
+                return x, True, iteration
+            dx = linsolve(self.jacobian(*(list(x) + args)), -f)
+            step = 1.0
+            while True:
+                xnew = x + step * dx
+                fnew = self.residuals(*(list(xnew) + args))
+                newnorm = numpy.linalg.norm(fnew)
+                if newnorm <= (1 - 1e-4 * step) * norm or step < 1e-8:
+                    break
+                step *= 0.5
+            x, f, norm = xnew, fnew, newnorm
+        return x, isconverged(f, tol), maxiter
+
+    def refine(self, guess, args=(), tol=1e-10, maxiter=50, precision=50):
+        """Iterate from `guess` like ``solve``, in multiprecision
+
+        Residuals and the Jacobian are evaluated by mpmath, which is
+        compiled on the first call.  The iterations start with the 16
+        digits of a float plus the digits that the condition number of the
+        Jacobian at `guess` loses, and the number of digits doubles every
+        time a step cannot decrease the residuals, or when the residuals
+        of a solution do not stay below `tol` with twice the digits, up to
+        `precision`.  Return ``(x, converged, iterations)`` with `x` as floats.
+        """
+        import mpmath
+        if self.precise is None:
+            self.precise = Precise(self.exprs, self.unknowns, self.params)
+        try:
+            cond = numpy.linalg.cond(self.jacobian(*(list(guess) +
+                                                     list(args))))
+        except numpy.linalg.LinAlgError:
+            cond = numpy.inf
+        # a singular Jacobian gets twice the digits of a float
+        lost = numpy.log10(cond) if numpy.isfinite(cond) else 16
+        digits = min(precision, 16 + max(0, int(numpy.ceil(lost))))
+        x = list(guess)
+        iterations = 0
+        while True:
+            with mpmath.workdps(digits):
+                x, converged, steps = self.precise.solve(
+                    x, args, tol, maxiter - iterations)
+            iterations += steps
+            if digits >= precision:
+                break
+            more = min(precision, 2 * digits)
+            if converged:
+                # cancellation can make residuals vanish at a precision
+                # that is too low, so they are checked with more digits
+                with mpmath.workdps(more):
+                    if self.precise.isconverged(x, args, tol):
+                        break
+            elif iterations >= maxiter:
+                break
+            digits = more
+        return numpy.array([float(val) for val in x]), converged, iterations
+
+    def evaluate(self, kernel, x, args, rows):
+        """Evaluate `kernel` for the selected `rows` of a batch"""
+        return kernel(*(list(x[rows].T) + [arg[rows] for arg in args]))
+
+    def solve_batch(self, guess, args=(), tol=1e-10, maxiter=50):
+        """Solve many instances of the system at once
+
+        `guess` holds one value per unknown and `args` one value per
+        parameter; each may be a scalar or a 1-d array over the instances.
+        All unfinished instances take one Newton step per iteration as
+        stacked arrays, and converged instances are masked out.
+
+        Return ``(x, converged, iterations)`` with one row per instance.
+        """
+        guess = [numpy.asarray(val, dtype=float) for val in guess]
+        args = [numpy.asarray(arg, dtype=float) for arg in args]
+        shape = numpy.broadcast_shapes(*[val.shape for val in guess + args])
+        if len(shape) > 1:
+            raise ValueError('batched values must be one-dimensional')
+        count = shape[0] if shape else 1
+        x = numpy.empty((count, len(self.unknowns)))
+        for j, val in enumerate(guess):
+            x[:, j] = val
+        args = [numpy.broadcast_to(arg, (count,)) for arg in args]
+        converged = numpy.zeros(count, dtype=bool)
+        iterations = numpy.zeros(count, dtype=int)
+        active = numpy.arange(count)
+        f = self.evaluate(self.residuals, x, args, active)
+        for iteration in range(maxiter + 1):
+            done = (numpy.abs(f) <= tol).all(axis=0)
+            converged[active[done]] = True
+            iterations[active] = iteration
+            active = active[~done]
+            if not active.size or iteration == maxiter:
+                break
+            f = f[:, ~done]
+            J = self.jacobian(*(list(x[active].T) +
+                                [arg[active] for arg in args]))
+            try:
+                dx = numpy.linalg.solve(J, -f.T[..., None])[..., 0]
+            except numpy.linalg.LinAlgError:
+                dx = numpy.matmul(numpy.linalg.pinv(J), -f.T[..., None])
+                dx = dx[..., 0]
+            x0 = x[active]
+            norm = numpy.sqrt((f * f).sum(axis=0))
+            step = numpy.ones(active.size)
+            pending = numpy.arange(active.size)
+            while pending.size:
+                x[active[pending]] = (x0[pending] +
+                                      step[pending, None] * dx[pending])
+                fnew = self.evaluate(self.residuals, x, args,
+                                     active[pending])
+                f[:, pending] = fnew
+                newnorm = numpy.sqrt((fnew * fnew).sum(axis=0))
+                bad = ~(newnorm <= (1 - 1e-4 * step[pending]) *
+                        norm[pending])
+                bad &= step[pending] >= 1e-8
+                pending = pending[bad]
+                step[pending] *= 0.5
+        return x, converged, iterations
+
+
+class Precise(object):
+    """Residuals and Jacobian of a square system evaluated with mpmath
+
+    The expressions are compiled for mpmath, so they are evaluated at the
+    working precision of ``mpmath.mp`` when they are called.  Both take the
+    values of `unknowns` followed by the values of `params`.
+    """
+    def __init__(self, exprs, unknowns, params=()):
+        symbols = tuple(unknowns) + tuple(params)
+        names = dict((sym, sympy.Symbol('_a%d' % i))
+                     for i, sym in enumerate(symbols))
+        self.size = len(unknowns)
+        self.rows, self.cols, entries = derivatives(exprs, unknowns)
+        args = [names[sym] for sym in symbols]
+        with timed(active(), 'compile'):
+            self.func = sympy.lambdify(
+                args, [expr.xreplace(names) for expr in exprs],
+                modules='mpmath', dummify=False)
+            self.entries = sympy.lambdify(
+                args, [entry.xreplace(names) for entry in entries],
+                modules='mpmath', dummify=False)
+
+    def residuals(self, args):
+        import mpmath
+        return mpmath.matrix(self.func(*args))
+
+    def jacobian(self, args):
+        import mpmath
+        out = mpmath.zeros(self.size)
+        for i, j, val in zip(self.rows, self.cols, self.entries(*args)):
+            out[i, j] = val
+        return out
+
+    def isconverged(self, x, args, tol):
+        import mpmath
+        f = self.residuals([mpmath.mpf(val) for val in list(x) + list(args)])
+        return max(abs(val) for val in f) <= tol
+
+    def solve(self, guess, args, tol, maxiter):
+        """Iterate at the working precision like ``NewtonSolver.solve``
+
+        Stop early when a step cannot decrease the residuals or the
+        Jacobian is singular, which means that more precision is needed.
+        Return ``(x, converged, iterations)`` with `x` as mpmath numbers.
+        """
+        import mpmath
+        args = [mpmath.mpf(arg) for arg in args]
+        x = mpmath.matrix([mpmath.mpf(val) for val in guess])
+        f = self.residuals(list(x) + args)
+        norm = mpmath.norm(f)
+        for iteration in range(maxiter):
+            if max(abs(val) for val in f) <= tol:
+                return list(x), True, iteration
+            J = self.jacobian(list(x) + args)
+            try:
+                dx = mpmath.lu_solve(J, -f)
+            except ZeroDivisionError:
+                try:
+                    dx = mpmath.qr_solve(J, -f)[0]
+                except ValueError:
+                    # no least-squares step either at this precision
+                    return list(x), False, iteration + 1
+            step = 1.0
+            while True:
+                xnew = x + step * dx
+                fnew = self.residuals(list(xnew) + args)
+                newnorm = mpmath.norm(fnew)
+                if newnorm <= (1 - 1e-4 * step) * norm:
+                    break
+                if step < 1e-8:
+                    return list(x), False, iteration + 1
+                step *= 0.5
+            x, f, norm = xnew, fnew, newnorm
+        return list(x), max(abs(val) for val in f) <= tol, maxiter
+
+
+class ExplicitSolver(object):
+    """Solver for equations that directly define their unknowns
+
+    Every equation ``Eq(unknown, expr)`` of a run of explicit blocks is
+    compiled into one kernel that assigns the unknowns in order, so later
+    expressions may use earlier unknowns.  The interface matches
+    ``NewtonSolver``, but no iteration or guess is needed.
+    """
+    def __init__(self, equations, cse=False):
+        self.unknowns = tuple(eq.lhs for eq in equations)
+        params = set()
+        for eq in equations:
+            params.update(eq.rhs.free_symbols)
+        params.difference_update(self.unknowns)
+        self.params = tuple(sorted(params, key=sympy.default_sort_key))
+        exprs = [eq.rhs for eq in equations]
+        if cse:
+            # each common subexpression is assigned right before the first
+            # unknown that needs it, after the unknowns it depends on
+            replacements, (reduced,) = common([exprs])
+            assignments = []
+            done = set()
+            for unknown, expr in zip(self.unknowns, reduced):
+                for sym, value in needed(replacements, [expr], done):
+                    assignments.append((sym, value))
+                    done.add(sym)
+                assignments.append((unknown, expr))
+        else:
+            assignments = list(zip(self.unknowns, exprs))
+        self.kernel = Kernel(self.unknowns, self.params, assignments, exprs)
+
+    def count_ops(self):
+        """Return the operation counts of the kernel without and with CSE"""
+        return self.kernel.count_ops()
+
+    def solve(self, guess, args=(), tol=None, maxiter=None):
+        x = self.kernel(*args)
+        converged = bool(numpy.isfinite(x).all() and (x.imag == 0).all())
+        return x.real, converged, 0
+
+    def solve_batch(self, guess, args=(), tol=None, maxiter=None):
+        args = [numpy.asarray(arg, dtype=float) for arg in args]
+        shape = numpy.broadcast_shapes(*[arg.shape for arg in args])
+        if len(shape) > 1:
+            raise ValueError('batched values must be one-dimensional')
+        count = shape[0] if shape else 1
+        x = numpy.empty((count, len(self.unknowns)), dtype=complex)
+        x[...] = self.kernel(*args).T
+        converged = (numpy.isfinite(x) & (x.imag == 0)).all(axis=1)
+        return x.real, converged, numpy.zeros(count, dtype=int)
+
+
+def isexplicit(block):
+    """Whether a block is one equation that directly defines its unknown"""
+    if len(block.equations) != 1:
+        return False
+    eq, = block.equations
+    return eq.lhs == block.unknowns[0] and eq.lhs not in eq.rhs.free_symbols
+
+
+def records(symbols, columns, count=0):
+    """Return a structured array with one field per symbol
+
+    The array has `count` rows if there are no columns.
+    """
+    columns = numpy.broadcast_arrays(*columns)
+    out = numpy.empty(len(columns[0]) if columns else count,
+                      dtype=[(str(sym), float) for sym in symbols])
+    for sym, column in zip(symbols, columns):
+        out[str(sym)] = column
+    return out
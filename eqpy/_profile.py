@@ -0,0 +1,117 @@
+import threading
+import time
+
+clock = getattr(time, 'perf_counter', time.time)
+state = threading.local()
+
+
+class Profiler(object):
+    """Timings and counters of the phases of work done for a system
+
+    Every phase collects its total time in seconds and its number of
+    calls, and counters collect integers such as cache hits or Newton
+    iterations.  `callback`, if given, is called with the name of a phase
+    and its duration whenever a phase ends.  Phases may nest, so the times
+    of a phase include the times of the phases within it.
+    """
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.reset()
+
+    def reset(self):
+        self.times = {}
+        self.calls = {}
+        self.counts = {}
+
+    def add(self, phase, seconds):
+        self.times[phase] = self.times.get(phase, 0.0) + seconds
+        self.calls[phase] = self.calls.get(phase, 0) + 1
+        if self.callback is not None:
+            self.callback(phase, seconds)
+
+    def count(self, name, n=1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def stats(self):
+        """Return a copy of the timings and counters as a dict"""
+        return {'time': dict(self.times), 'calls': dict(self.calls),
+                'counts': dict(self.counts)}
+
+
+class Phase(object):
+    """Context manager that adds its duration to a phase of a profiler"""
+    __slots__ = ['profiler', 'name', 'start']
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.add(self.name, clock() - self.start)
+
+
+class Nothing(object):
+    """Context manager that does nothing, for disabled profiling"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+nothing = Nothing()
+
+
+def timed(profiler, name):
+    """Return a context manager that times phase `name` of `profiler`,
+    which may be None"""
+    if profiler is None:
+        return nothing
+    return Phase(profiler, name)
+
+
+def count(profiler, name, n=1):
+    if profiler is not None:
+        profiler.count(name, n)
+
+
+def active():
+    """Return the profiler activated in this thread, or None
+
+    Code that does not know the system it works for, like the compilation
+    of kernels, reports to this profiler.
+    """
+    return getattr(state, 'profiler', None)
+
+
+class activate(object):
+    """Context manager that makes `profiler` active in this thread"""
+    __slots__ = ['profiler', 'previous']
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    def __enter__(self):
+        self.previous = active()
+        state.profiler = self.profiler
+        return self
+
+    def __exit__(self, *exc_info):
+        state.profiler = self.previous
+
+
+def size(expr):
+    """Return the number of nodes of the tree of `expr`"""
+    stack = [expr]
+    total = 0
+    while stack:
+        expr = stack.pop()
+        total += 1
+        stack.extend(expr.args)
+    return total
@@ -0,0 +1,571 @@
+import os
+import pickle
+import struct
+import tempfile
+import threading
+import numpy
+import sympy
+from sympy.core.function import AppliedUndef
+
+from ._compatibility import Mapping, range, zip
+
+MAGIC = b'EQPY\x00\x01\x00\x00'
+ALIGN = 8
+INT64 = (-2**63, 2**63)
+
+
+def compact(values):
+    """Return `values` as an array of the smallest integer type"""
+    values = numpy.array(values, dtype=numpy.int64)
+    for dtype in [numpy.int8, numpy.int16, numpy.int32]:
+        info = numpy.iinfo(dtype)
+        if not len(values) or (info.min <= values.min() and
+                               values.max() <= info.max):
+            return values.astype(dtype)
+    return values
+
+
+class Writer(object):
+    """Flatten sympy expressions into a DAG of nodes stored in arrays
+
+    Equal subexpressions share one node.  Every node has a head, which is
+    an index into the table ``heads`` of node kinds, a 64-bit `data` field
+    and the list of its argument nodes.  Symbols are interned in a table
+    whose index is the `data` of their nodes, and floats are kept in an
+    array indexed the same way.
+    """
+    def __init__(self):
+        self.nodes = {}
+        self.heads = []
+        self.headindex = {}
+        self.head = []
+        self.data = []
+        self.args = []
+        self.texts = []
+        self.floats = []
+        self.symbols = []
+        self.symbolindex = {}
+
+    def symbol(self, sym):
+        if sym not in self.symbolindex:
+            self.symbolindex[sym] = len(self.symbols)
+            self.symbols.append(sym)
+        return self.symbolindex[sym]
+
+    def text(self, value):
+        self.texts.append(value)
+        return len(self.texts) - 1
+
+    def describe(self, expr):
+        """Return the head, data and arguments of the node of `expr`"""
+        if isinstance(expr, (sympy.Symbol, sympy.Dummy)):
+            return 'Symbol', self.symbol(expr), ()
+        if expr.is_Integer:
+            value = int(expr)
+            if INT64[0] <= value < INT64[1]:
+                return 'Integer', value, ()
+            return 'BigInteger', self.text(str(value)), ()
+        if expr.is_Rational:
+            return 'Rational', 0, (sympy.Integer(expr.p),
+                                   sympy.Integer(expr.q))
+        if expr.is_Float:
+            if expr._prec == 53:
+                self.floats.append(float(expr))
+                return 'Float', len(self.floats) - 1, ()
+            return 'BigFloat', self.text((str(expr), expr._prec)), ()
+        name = type(expr).__name__
+        if not expr.args and getattr(sympy.S, name, None) is expr:
+            return 'S:' + name, 0, ()
+        if isinstance(expr, AppliedUndef):
+            return 'Function:' + name, 0, expr.args
+        if getattr(sympy, name, None) is type(expr) and all(
+                isinstance(arg, sympy.Basic) for arg in expr.args):
+            return name, 0, expr.args
+        return 'Pickle', self.text(expr), ()
+
+    def add(self, expr):
+        """Add `expr` and its subexpressions and return its node
+
+        The tree is walked without recursion, so deeply nested expressions
+        cannot exceed the recursion limit.
+        """
+        nodes = self.nodes
+        stack = [(expr, None)]
+        while stack:
+            expr, described = stack.pop()
+            if expr in nodes:
+                continue
+            if described is None:
+                described = self.describe(expr)
+                missing = [arg for arg in described[2] if arg not in nodes]
+                if missing:
+                    stack.append((expr, described))
+                    stack.extend((arg, None) for arg in missing)
+                    continue
+            head, data, args = described
+            if head not in self.headindex:
+                self.headindex[head] = len(self.heads)
+                self.heads.append(head)
+            nodes[expr] = len(self.head)
+            self.head.append(self.headindex[head])
+            self.data.append(data)
+            self.args.append([nodes[arg] for arg in args])
+        return nodes[expr]
+
+    def arrays(self):
+        """Return the arrays of the nodes, with the number of arguments of
+        every node and their concatenated lists"""
+        return {'head': compact(self.head),
+                'data': compact(self.data),
+                'nargs': compact([len(args) for args in self.args]),
+                'indices': compact([node for args in self.args
+                                    for node in args]),
+                'floats': numpy.array(self.floats, dtype=float)}
+
+
+class Graph(object):
+    """Expressions stored by a ``Writer``, built from the arrays on access
+
+    Built nodes are kept, so shared subexpressions are built once and give
+    the same objects.
+    """
+    def __init__(self, heads, head, data, nargs, indices, floats, texts,
+                 symbols):
+        self.heads = [self.builder(name) for name in heads]
+        self.head = head
+        self.data = data
+        self.indptr = numpy.zeros(len(nargs) + 1, dtype=numpy.int64)
+        numpy.cumsum(nargs, out=self.indptr[1:])
+        self.indices = indices
+        self.floats = floats
+        self.texts = texts
+        self.symbols = symbols
+        self.built = {}
+
+    def builder(self, name):
+        """Return a function of the node data and built arguments"""
+        kind, _, name = name.rpartition(':')
+        if name == 'Symbol':
+            return lambda data, args: self.symbols[data]
+        if name == 'Integer':
+            return lambda data, args: sympy.Integer(data)
+        if name == 'BigInteger':
+            return lambda data, args: sympy.Integer(int(self.texts[data]))
+        if name == 'Rational':
+            return lambda data, args: sympy.Rational(*args)
+        if name == 'Float':
+            return lambda data, args: sympy.Float(float(self.floats[data]))
+        if name == 'BigFloat':
+            def build(data, args):
+                text, precision = self.texts[data]
+                return sympy.Float(text, precision=precision)
+            return build
+        if name == 'Pickle':
+            return lambda data, args: self.texts[data]
+        if kind == 'S':
+            value = getattr(sympy.S, name)
+            return lambda data, args: value
+        if kind == 'Function':
+            cls = sympy.Function(name)
+            return lambda data, args: cls(*args)
+        cls = getattr(sympy, name)
+
+        def build(data, args):
+            # the arguments are already in canonical form
+            try:
+                return cls(*args, evaluate=False)
+            except TypeError:
+                return cls(*args)
+        return build
+
+    def arguments(self, node):
+        return self.indices[self.indptr[node]:self.indptr[node + 1]]
+
+    def build(self, node):
+        """Return the expression of `node`"""
+        built = self.built
+        stack = [node]
+        while stack:
+            current = stack[-1]
+            if current in built:
+                stack.pop()
+                continue
+            args = self.arguments(current).tolist()
+            missing = [arg for arg in args if arg not in built]
+            if missing:
+                stack.extend(missing)
+                continue
+            stack.pop()
+            built[current] = self.heads[self.head[current]](
+                int(self.data[current]), [built[arg] for arg in args])
+        return built[node]
+
+
+def write(path, header, arrays):
+    """Write a pickled `header` and raw `arrays` so they can be mapped
+
+    The file starts with ``MAGIC`` and the length of the header, and every
+    array is aligned to 8 bytes.  Their layout is added to the header.
+    """
+    layout = {}
+    offset = 0
+    for name, array in sorted(arrays.items()):
+        array = numpy.ascontiguousarray(array)
+        arrays[name] = array
+        layout[name] = (array.dtype.str, array.shape, offset)
+        offset += -(-array.nbytes // ALIGN) * ALIGN
+    header = dict(header, layout=layout)
+    text = pickle.dumps(header, protocol=2)
+    start = len(MAGIC) + 8 + len(text)
+    start += -start % ALIGN
+    # the file is replaced at once, since systems loaded from it may still
+    # map it, and the arrays may even come from it
+    fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                                   suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(text)))
+        f.write(text)
+        f.write(b'\0' * (start - f.tell()))
+        for name, array in sorted(arrays.items()):
+            f.write(array.tobytes())
+            f.write(b'\0' * (-array.nbytes % ALIGN))
+    os.rename(tmpname, path)
+
+
+def read(path):
+    """Return the header and the arrays of a file, mapped into memory"""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('%r is not a saved system' % path)
+        size, = struct.unpack('<Q', f.read(8))
+        header = pickle.loads(f.read(size))
+    start = len(MAGIC) + 8 + size
+    start += -start % ALIGN
+    arrays = {}
+    if header['layout']:
+        mapped = numpy.memmap(path, dtype=numpy.uint8, mode='r')
+        for name, (dtype, shape, offset) in header['layout'].items():
+            dtype = numpy.dtype(dtype)
+            count = int(numpy.prod(shape)) * dtype.itemsize
+            begin = start + offset
+            arrays[name] = mapped[begin:begin + count].view(dtype).reshape(
+                shape)
+    return header, arrays
+
+
+OPTIONS = ['prefix', 'prefix_include', 'prefix_exclude', 'suffix',
+           'suffix_include', 'suffix_exclude', 'dummies', 'solve_cache',
+           'cse']
+
+
+def save(system, path):
+    """Save a ``BaseSystem`` to the file `path` (see ``BaseSystem.save``)"""
+    from ._storage import LinearBlock
+    writer = Writer()
+    for sym in system.symbols.values():
+        writer.symbol(sym)
+    names = []
+    eqptr = [0]
+    roots = []
+    blockof = []
+    blocks = []
+    blockindex = {}
+    arrays = {}
+    for name, entry in system.equations.entries.items():
+        names.append(writer.symbol(name))
+        if isinstance(entry, LinearBlock):
+            if id(entry) not in blockindex:
+                k = blockindex[id(entry)] = len(blocks)
+                blocks.append((entry.start, entry.step))
+                arrays['block%d_symbols' % k] = compact(
+                    [writer.symbol(sym) for sym in entry.symbols])
+                for field in ['indptr', 'indices', 'data', 'offsets']:
+                    arrays['block%d_%s' % (k, field)] = getattr(entry, field)
+            blockof.append(blockindex[id(entry)])
+        else:
+            roots.extend(system.equations.materialize(name, entry))
+            blockof.append(-1)
+        eqptr.append(len(roots))
+    roots = [writer.add(eq) for eq in roots]
+    assumptions = [writer.add(rel) for rel in system.assumptions]
+    refptr = [0]
+    refs = []
+    for name in system.equations:
+        refs.extend(writer.symbol(sym) for sym in system.references[name])
+        refptr.append(len(refs))
+    keys = dict((sym, key) for key, sym in system.symbols.items())
+    # the class and assumptions of symbols are stored once per kind
+    kinds = []
+    kindindex = {}
+    kindof = []
+    for sym in writer.symbols:
+        kind = (isinstance(sym, sympy.Dummy),
+                tuple(sorted(sym.assumptions0.items())))
+        if kind not in kindindex:
+            kindindex[kind] = len(kinds)
+            kinds.append(kind)
+        kindof.append(kindindex[kind])
+    arrays['kindof'] = compact(kindof)
+    arrays.update(writer.arrays())
+    arrays.update(
+        names=compact(names),
+        eqptr=compact(eqptr),
+        roots=compact(roots),
+        blockof=compact(blockof),
+        refptr=compact(refptr),
+        refs=compact(refs),
+        assumptions=compact(assumptions))
+    header = {
+        'options': dict((option, getattr(system, option))
+                        for option in OPTIONS),
+        'keys': [keys.get(sym) for sym in writer.symbols],
+        'names': [sym.name for sym in writer.symbols],
+        'kinds': kinds,
+        'heads': writer.heads,
+        'texts': writer.texts,
+        'blocks': blocks,
+        'userdict': system.userdict,
+    }
+    write(path, header, arrays)
+
+
+class Table(object):
+    """Symbols of a loaded file, created when they are first used
+
+    Each symbol is created once, so `Dummy` symbols keep their identity
+    within the loaded system.
+    """
+    def __init__(self, names, kindof, kinds):
+        self.names = names
+        self.kindof = kindof
+        self.kinds = [(sympy.Dummy if dummy else sympy.Symbol,
+                       dict(assumptions)) for dummy, assumptions in kinds]
+        self.created = [None] * len(names)
+        self.positions = {}  # created symbol -> position in the table
+        self.named = None  # name -> positions of symbols, built on demand
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, i):
+        sym = self.created[i]
+        if sym is None:
+            with self.lock:
+                sym = self.created[i]
+                if sym is None:
+                    cls, assumptions = self.kinds[self.kindof[i]]
+                    sym = cls(self.names[i], **assumptions)
+                    self.positions[sym] = i
+                    self.created[i] = sym
+        return sym
+
+    def find(self, sym):
+        """Return the position of `sym` in the table, or None"""
+        i = self.positions.get(sym)
+        if (i is not None or not isinstance(sym, sympy.Symbol) or
+                isinstance(sym, sympy.Dummy)):
+            return i
+        # an equal symbol may exist outside before it is created here
+        if self.named is None:
+            named = {}
+            for i, name in enumerate(self.names):
+                named.setdefault(name, []).append(i)
+            self.named = named
+        for i in self.named.get(sym.name, ()):
+            if self[i] == sym:
+                return i
+        return None
+
+
+class Lazy(Mapping):
+    """Read-only mapping whose entries are built from a file on access
+
+    `find` gives the position of a key, or None if it has no entry, and
+    `key` and `value` give the key and the value at a position.
+    `positions` gives the positions of all entries in order.
+    """
+    def __init__(self, find, key, value, positions):
+        self.find = find
+        self.key = key
+        self.value = value
+        self.positions = positions
+
+    def __getitem__(self, key):
+        i = self.find(key)
+        if i is None:
+            raise KeyError(key)
+        return self.value(i)
+
+    def __contains__(self, key):
+        return self.find(key) is not None
+
+    def __iter__(self):
+        for i in self.positions():
+            yield self.key(i)
+
+    def __len__(self):
+        return len(self.positions())
+
+    def copy(self):
+        return dict(self.items())
+
+
+class Loaded(object):
+    """Symbols, equations and indices of a file read with ``read``
+
+    Nothing is built up front: symbols come from a ``Table``, equations
+    from a ``Graph``, and the mappings of a ``BaseSystem`` are ``Lazy``
+    views of the arrays.  The reverse index of `users` is computed from
+    the `refs` arrays the first time it is used.
+    """
+    def __init__(self, header, arrays):
+        self.header = header
+        self.arrays = arrays
+        self.table = Table(header['names'], arrays['kindof'].tolist(),
+                           header['kinds'])
+        self.graph = Graph(header['heads'], arrays['head'], arrays['data'],
+                           arrays['nargs'], arrays['indices'],
+                           arrays['floats'], header['texts'], self.table)
+        self.keys = header['keys']
+        self.names = arrays['names'].tolist()
+        self.blockof = arrays['blockof'].tolist()
+        self.eqptr = arrays['eqptr'].tolist()
+        self.refptr = arrays['refptr'].tolist()
+        self.cache = {}
+
+    def cached(self, name, func):
+        """Return the value of `func` computed once under `name`"""
+        value = self.cache.get(name)
+        if value is None:
+            # threads that race compute equal values
+            value = self.cache.setdefault(name, func())
+        return value
+
+    def keyed(self):
+        return self.cached('keyed', lambda: [
+            i for i, key in enumerate(self.keys) if key is not None])
+
+    def locate(self, key):
+        """Return the table position of the symbol of `key`, or None"""
+        keypos = self.cached('keypos', lambda: dict(
+            (key, i) for i, key in enumerate(self.keys) if key is not None))
+        return keypos.get(key)
+
+    def named(self, sym):
+        """Return the table position of a symbol that has a key, or None"""
+        i = self.table.find(sym)
+        if i is not None and self.keys[i] is not None:
+            return i
+        return None
+
+    def equation(self, name):
+        """Return the index of the equations of the symbol `name`, or
+        None"""
+        i = self.table.find(name)
+        if i is None:
+            return None
+        eqof = self.cached('eqof', lambda: dict(
+            (j, k) for k, j in enumerate(self.names)))
+        return eqof.get(i)
+
+    def block(self, k):
+        """Return the ``LinearBlock`` `k`, built the first time"""
+        from ._storage import LinearBlock
+
+        def build():
+            block = LinearBlock.__new__(LinearBlock)
+            block.start, block.step = self.header['blocks'][k]
+            block.symbols = tuple(
+                self.table[i]
+                for i in self.arrays['block%d_symbols' % k].tolist())
+            for field in ['indptr', 'indices', 'data', 'offsets']:
+                setattr(block, field, self.arrays['block%d_%s' % (k, field)])
+            return block
+        return self.cached(('block', k), build)
+
+    def entry(self, k):
+        from ._storage import Stored
+        if self.blockof[k] >= 0:
+            return self.block(self.blockof[k])
+        return Stored(self.graph,
+                      self.arrays['roots'][self.eqptr[k]:self.eqptr[k + 1]])
+
+    def references(self, k):
+        refs = self.arrays['refs'][self.refptr[k]:self.refptr[k + 1]]
+        return tuple(self.table[i] for i in refs.tolist())
+
+    def index(self):
+        """Return the equations that use each symbol, as CSR arrays"""
+        def transpose():
+            refs = self.arrays['refs']
+            equations = numpy.repeat(numpy.arange(len(self.names)),
+                                     numpy.diff(self.arrays['refptr']))
+            userptr = numpy.zeros(len(self.table) + 1, dtype=numpy.int64)
+            numpy.cumsum(numpy.bincount(refs, minlength=len(self.table)),
+                         out=userptr[1:])
+            order = numpy.argsort(refs, kind='mergesort')
+            return userptr.tolist(), equations[order]
+        return self.cached('index', transpose)
+
+    def user(self, sym):
+        """Return the table position of a symbol with users, or None"""
+        i = self.table.find(sym)
+        if i is None:
+            return None
+        userptr, _ = self.index()
+        return i if userptr[i + 1] > userptr[i] else None
+
+    def users(self, i):
+        userptr, equations = self.index()
+        return set(self.table[self.names[k]]
+                   for k in equations[userptr[i]:userptr[i + 1]].tolist())
+
+    def used(self):
+        userptr, _ = self.index()
+        return numpy.flatnonzero(numpy.diff(userptr)).tolist()
+
+    def mappings(self):
+        """Return the ``Lazy`` mappings of `symbols`, `symbolnames`,
+        equation entries, `references` and `users`"""
+        table = self.table
+        names = self.names
+
+        def equations():
+            return range(len(names))
+        return (
+            Lazy(self.locate, self.keys.__getitem__, table.__getitem__,
+                 self.keyed),
+            Lazy(self.named, table.__getitem__, self.keys.__getitem__,
+                 self.keyed),
+            Lazy(self.equation, lambda k: table[names[k]], self.entry,
+                 equations),
+            Lazy(self.equation, lambda k: table[names[k]], self.references,
+                 equations),
+            Lazy(self.user, table.__getitem__, self.users, self.used))
+
+
+def load(path):
+    """Load a ``BaseSystem`` saved with ``save``
+
+    The arrays stay mapped from the file.  Symbols are created, equations
+    built and the indices of the system filled from the arrays only when
+    they are first accessed (see ``Loaded``).
+    """
+    from ._storage import Equations, Overlay
+    from ._systems import BaseSystem
+    header, arrays = read(path)
+    system = BaseSystem(**header['options'])
+    loaded = Loaded(header, arrays)
+    symbols, symbolnames, entries, references, users = loaded.mappings()
+    system.symbols = Overlay(symbols)
+    system.symbolnames = Overlay(symbolnames)
+    system.equations = Equations(system.symbolnames.__getitem__)
+    system.equations.entries = Overlay(entries)
+    system.references = Overlay(references)
+    system.users = Overlay(users, set)
+    for node in arrays['assumptions'].tolist():
+        system.assumption(loaded.graph.build(node))
+    system.userdict.update(header['userdict'])
+    return system
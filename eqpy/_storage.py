@@ -0,0 +1,441 @@
+import sympy
+
+from ._compatibility import MutableMapping, range, zip
+from ._utils import isiterable
+
+
+def decided(lhs, rhs):
+    """Return whether ``equality(lhs, rhs)`` is decided structurally"""
+    return (lhs == rhs or lhs.is_Number and rhs.is_Number or
+            rhs.is_Add and rhs.as_coeff_Add()[1] == lhs or
+            lhs.is_Add and lhs.as_coeff_Add()[1] == rhs)
+
+
+def equality(lhs, rhs):
+    """Return ``sympy.Eq(lhs, rhs)`` without sympy's slow evaluation
+
+    ``sympy.Eq`` asks the assumptions system whether the sides are equal,
+    which takes milliseconds for every equation.  Only the cases that are
+    decided structurally are evaluated here: equal sides give true, and
+    sides that differ by a nonzero number give false.
+    """
+    rhs = sympy.sympify(rhs)
+    if lhs == rhs:
+        return sympy.true
+    if decided(lhs, rhs):
+        return sympy.false
+    return sympy.Eq(lhs, rhs, evaluate=False)
+
+
+def sides(expr):
+    """Return the right-hand sides of the equations that define a name as
+    `expr`"""
+    if isinstance(expr, sympy.Equality):
+        return [expr.lhs, expr.rhs]
+    elif isiterable(expr):
+        return list(expr)
+    return [expr]
+
+
+def build(name, expr):
+    """Return the list of equations that define `name` as `expr`
+
+    An equality gives two equations, an iterable gives one equation per
+    item, and anything else gives a single equation.
+    """
+    return [equality(name, side) for side in sides(expr)]
+
+
+def involved(name, expr):
+    """Return the free symbols of ``build(name, expr)`` without building
+    the equations"""
+    symbols = set()
+    for side in sides(expr):
+        side = sympy.sympify(side)
+        if not decided(name, side):
+            symbols.add(name)
+            symbols.update(side.free_symbols)
+    return symbols
+
+
+class Template(object):
+    """Function of an index that gives the definition of a name
+
+    One template is shared by all names of the range it was assigned to.
+    """
+    __slots__ = ['func']
+
+    def __init__(self, func):
+        self.func = func
+
+
+class Stored(object):
+    """Equations of a name in a ``Graph`` loaded from a file"""
+    __slots__ = ['graph', 'roots']
+
+    def __init__(self, graph, roots):
+        self.graph = graph
+        self.roots = roots
+
+
+class Linear(object):
+    """Affine definition of a range of names from arrays
+
+    Assigning ``Linear(coeffs, symbols, offsets)`` to ``A[start:stop]``
+    defines the name of the ``i``-th key as ``offsets[i] + sum(coeffs[i, j]
+    * symbols[j])``.  `coeffs` is a 2-d NumPy array or SciPy sparse matrix,
+    or a 1-d array if `symbols` is a single symbol, and `offsets` is a
+    scalar or 1-d array.
+    """
+    def __init__(self, coeffs, symbols, offsets=0):
+        self.coeffs = coeffs
+        self.symbols = symbols
+        self.offsets = offsets
+
+
+class LinearBlock(object):
+    """Names of a range of integer keys defined by one ``Linear``
+
+    The coefficients are kept in CSR arrays and the symbols in a tuple, so
+    no sympy expressions are built until an equation is accessed.
+    """
+    __slots__ = ['start', 'step', 'symbols', 'indptr', 'indices', 'data',
+                 'offsets']
+
+    def __init__(self, start, step, coeffs, symbols, offsets):
+        import numpy
+        if isinstance(symbols, sympy.Basic):
+            symbols = [symbols]
+            coeffs = numpy.reshape(coeffs, (-1, 1))
+        self.start = start
+        self.step = step
+        self.symbols = tuple(symbols)
+        if hasattr(coeffs, 'tocsr'):  # pragma: no cover
+            coeffs = coeffs.tocsr()
+            coeffs.sort_indices()
+            self.indptr = numpy.asarray(coeffs.indptr, dtype=int)
+            self.indices = numpy.asarray(coeffs.indices, dtype=int)
+            self.data = numpy.asarray(coeffs.data)
+        else:
+            coeffs = numpy.asarray(coeffs)
+            if coeffs.ndim != 2:
+                raise ValueError('coefficients must be a 2-d array')
+            rows, self.indices = numpy.nonzero(coeffs)
+            self.data = coeffs[rows, self.indices]
+            self.indptr = numpy.searchsorted(
+                rows, numpy.arange(coeffs.shape[0] + 1))
+        if coeffs.shape[1] != len(self.symbols):
+            raise ValueError('%d coefficients per row for %d symbols'
+                             % (coeffs.shape[1], len(self.symbols)))
+        self.offsets = numpy.empty(coeffs.shape[0], dtype=numpy.result_type(
+            numpy.asarray(offsets), self.data))
+        self.offsets[...] = offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def row(self, key):
+        return (key - self.start) // self.step
+
+    def columns(self, i):
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def expr(self, i):
+        """Build the defining expression of row `i`"""
+        lo, hi = self.indptr[i], self.indptr[i + 1]
+        terms = [sympy.sympify(coeff) * self.symbols[j] for j, coeff in
+                 zip(self.indices[lo:hi].tolist(), self.data[lo:hi].tolist())]
+        return sympy.Add(sympy.sympify(self.offsets[i].item()), *terms)
+
+
+class LinearRow(object):
+    """Equation of one row of a ``LinearBlock``
+
+    Decompositions hold these instead of equations, so that linear blocks
+    are solved from their arrays.  ``expand`` builds the sympy equation.
+    """
+    __slots__ = ['block', 'index', 'lhs']
+
+    def __init__(self, block, index, lhs):
+        self.block = block
+        self.index = index
+        self.lhs = lhs
+
+    def __eq__(self, other):
+        return (isinstance(other, LinearRow) and self.block is other.block
+                and self.index == other.index)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((id(self.block), self.index))
+
+    @property
+    def free_symbols(self):
+        symbols = self.block.symbols
+        return frozenset([symbols[j] for j in
+                          self.block.columns(self.index).tolist()] +
+                         [self.lhs])
+
+    def equation(self):
+        return equality(self.lhs, self.block.expr(self.index))
+
+
+def expand(eq):
+    """Return `eq` as a sympy equation, building it for a ``LinearRow``"""
+    if isinstance(eq, LinearRow):
+        return eq.equation()
+    return eq
+
+
+class Equations(object):
+    """Mapping of names to the lists of equations that define them
+
+    Equations are built when they are accessed instead of being stored.
+    Names defined by a single expression only keep the expression, and
+    names assigned from a ``Template`` or a ``LinearBlock`` only keep the
+    shared object, which gives the definition of the integer key of the
+    name that `key` gives.  Names of a loaded system keep their nodes in
+    the file (see ``Stored``).  Names keep the order in which they were first
+    defined.
+    """
+    def __init__(self, key):
+        self.key = key
+        self.entries = {}
+
+    def define(self, name, expr):
+        """Define `name` as `expr`, which may be a ``Template`` or a
+        ``LinearBlock``"""
+        if isinstance(expr, (Template, LinearBlock)):
+            self.entries[name] = expr
+        elif isinstance(expr, sympy.Equality) or isiterable(expr):
+            self.entries[name] = build(name, expr)
+        else:
+            self.entries[name] = sympy.sympify(expr)
+
+    def materialize(self, name, entry):
+        if isinstance(entry, list):
+            return entry
+        if isinstance(entry, Template):
+            return build(name, entry.func(self.key(name)))
+        if isinstance(entry, LinearBlock):
+            return [equality(name, entry.expr(entry.row(self.key(name))))]
+        if isinstance(entry, Stored):
+            return [entry.graph.build(root) for root in entry.roots.tolist()]
+        return [equality(name, entry)]
+
+    def rows(self):
+        """Yield the equations of every name like ``values``, except that
+        names of a ``LinearBlock`` give a ``LinearRow``"""
+        for name, entry in self.entries.items():
+            if isinstance(entry, LinearBlock):
+                yield [LinearRow(entry, entry.row(self.key(name)), name)]
+            else:
+                yield self.materialize(name, entry)
+
+    def __setitem__(self, name, equations):
+        self.entries[name] = list(equations)
+
+    def __getitem__(self, name):
+        return self.materialize(name, self.entries[name])
+
+    def get(self, name, default=None):
+        entry = self.entries.get(name)
+        if entry is None:
+            return default
+        return self.materialize(name, entry)
+
+    def pop(self, name, *default):
+        if name not in self.entries:
+            if default:
+                return default[0]
+            raise KeyError(name)
+        return self.materialize(name, self.entries.pop(name))
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def keys(self):
+        return self.entries.keys()
+
+    def values(self):
+        for name, entry in self.entries.items():
+            yield self.materialize(name, entry)
+
+    def items(self):
+        for name, entry in self.entries.items():
+            yield name, self.materialize(name, entry)
+
+
+class SymbolRange(object):
+    """Lazy sequence of the symbols of a range of integer keys
+
+    Slicing a ``System`` gives a ``SymbolRange`` instead of a tuple.  Only
+    the bounds are stored.  Single symbols are created when they are
+    accessed, and iterating creates all missing symbols in one batch.
+    Slicing gives another range, and NumPy sees an object array.  Like
+    the tuple it replaces, it compares equal to tuples and lists of the
+    same symbols, and can be added to tuples and other ranges.
+    """
+    __slots__ = ['system', 'start', 'stop', 'step']
+
+    def __init__(self, system, start, stop, step=1):
+        if step == 0:
+            raise ValueError('step must not be zero')
+        self.system = system
+        self.start = start
+        self.step = step
+        # normalize the stop to the key after the last one
+        self.stop = start + len(range(start, stop, step)) * step
+
+    def keys(self):
+        return range(self.start, self.stop, self.step)
+
+    def __len__(self):
+        return (self.stop - self.start) // self.step
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            return SymbolRange(self.system, self.start + start * self.step,
+                               self.start + stop * self.step,
+                               self.step * step)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('SymbolRange index out of range')
+        return self.system.symbol(self.start + index * self.step)
+
+    def __iter__(self):
+        keys = self.keys()
+        self.system.allocate(keys)
+        symbols = self.system.symbols
+        return (symbols[key] for key in keys)
+
+    def __array__(self, dtype=None, copy=None):
+        import numpy
+        out = numpy.empty(len(self), dtype=object)
+        out[:] = list(self)
+        return out
+
+    def __eq__(self, other):
+        if not isinstance(other, (SymbolRange, tuple, list)):
+            return NotImplemented
+        return len(self) == len(other) and tuple(self) == tuple(other)
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __add__(self, other):
+        if not isinstance(other, (SymbolRange, tuple)):
+            return NotImplemented
+        return tuple(self) + tuple(other)
+
+    def __radd__(self, other):
+        if not isinstance(other, tuple):
+            return NotImplemented
+        return other + tuple(self)
+
+    def __repr__(self):
+        return 'SymbolRange(%d, %d, %d)' % (self.start, self.stop, self.step)
+
+
+class Overlay(MutableMapping):
+    """Mapping that keeps its changes on top of a shared `base` dict
+
+    The `base` is never modified, so any number of overlays can share it.
+    Changed entries are kept in `local` and removed ones in `removed`.  If
+    `copy` is given, values of the base are copied into `local` when they
+    are accessed, so mutable values such as sets can be changed in place.
+    Keys are iterated in the order of the base, followed by new keys.
+    """
+    def __init__(self, base, copy=None):
+        self.base = base
+        self.copy = copy
+        self.local = {}
+        self.removed = set()
+
+    def __getitem__(self, key):
+        local = self.local
+        if key in local:
+            return local[key]
+        if key in self.removed:
+            raise KeyError(key)
+        value = self.base[key]
+        if self.copy is not None:
+            # the first copy wins if several threads copy at once
+            value = local.setdefault(key, self.copy(value))
+        return value
+
+    def __setitem__(self, key, value):
+        self.local[key] = value
+        if self.removed:
+            self.removed.discard(key)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.local.pop(key, None)
+        if key in self.base:
+            self.removed.add(key)
+
+    def __contains__(self, key):
+        return key in self.local or (key in self.base and
+                                     key not in self.removed)
+
+    def __iter__(self):
+        removed = self.removed
+        for key in self.base:
+            if key not in removed:
+                yield key
+        base = self.base
+        for key in list(self.local):
+            if key not in base:
+                yield key
+
+    def __len__(self):
+        added = sum(1 for key in self.local if key not in self.base)
+        return len(self.base) - len(self.removed) + added
+
+    def clear(self):
+        self.base = {}
+        self.local = {}
+        self.removed = set()
+
+    def changed(self):
+        """Return whether any entry differs from the base"""
+        return bool(self.local or self.removed)
+
+    def flatten(self):
+        """Return a new dict with the entries of the overlay"""
+        if not self.removed:
+            out = self.base.copy()
+            out.update(self.local)
+            return out
+        return dict((key, self.local.get(key, self.base.get(key)))
+                    for key in self)
+
+
+def share(mapping, copy=None):
+    """Return two overlays that share the entries of `mapping`
+
+    One replaces `mapping` in its owner and the other goes to a fork, so
+    neither sees the changes of the other.  Unchanged overlays share their
+    base again instead of stacking another layer.
+    """
+    if isinstance(mapping, Overlay):
+        base = mapping.flatten() if mapping.changed() else mapping.base
+    else:
+        base = mapping
+    return Overlay(base, copy), Overlay(base, copy)
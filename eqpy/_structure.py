@@ -0,0 +1,163 @@
+from collections import namedtuple
+
+from ._compatibility import range, zip
+
+Block = namedtuple('Block', ['equations', 'unknowns'])
+
+
+def match(incidence, ncols):
+    """Match each row to a distinct column it is incident to
+
+    `incidence` lists the columns of every row.  Rows are matched greedily
+    first, then with augmenting paths.  Return a list that gives the column
+    of every row, or None for rows that could not be matched.
+    """
+    rowof = [None] * ncols
+    colof = [None] * len(incidence)
+    for row, cols in enumerate(incidence):
+        for col in cols:
+            if rowof[col] is None:
+                rowof[col] = row
+                colof[row] = col
+                break
+    visited = [-1] * ncols
+    for root in range(len(incidence)):
+        if colof[root] is not None:
+            continue
+        # depth-first search for an augmenting path, kept iterative so
+        # long chains of equations cannot exceed the recursion limit
+        stack = [(root, iter(incidence[root]))]
+        via = []  # via[k] leads from the row of stack[k] to stack[k + 1]
+        while stack:
+            row, cols = stack[-1]
+            for col in cols:
+                if visited[col] == root:
+                    continue
+                visited[col] = root
+                if rowof[col] is None:
+                    via.append(col)
+                    for (row, _), col in zip(stack, via):
+                        rowof[col] = row
+                        colof[row] = col
+                    stack = []
+                else:
+                    via.append(col)
+                    stack.append((rowof[col], iter(incidence[rowof[col]])))
+                break
+            else:
+                stack.pop()
+                if via:
+                    via.pop()
+    return colof
+
+
+def tarjan(graph):
+    """Return the strongly connected components of a directed graph
+
+    `graph` lists the successors of every node.  Components are returned
+    in reverse topological order, so every component comes after all of
+    the components it can reach.
+    """
+    index = [None] * len(graph)
+    lowlink = [0] * len(graph)
+    onstack = [False] * len(graph)
+    stack = []
+    components = []
+    counter = 0
+    for root in range(len(graph)):
+        if index[root] is not None:
+            continue
+        work = [(root, iter(graph[root]))]
+        index[root] = lowlink[root] = counter
+        counter += 1
+        stack.append(root)
+        onstack[root] = True
+        while work:
+            node, succs = work[-1]
+            for succ in succs:
+                if index[succ] is None:
+                    index[succ] = lowlink[succ] = counter
+                    counter += 1
+                    stack.append(succ)
+                    onstack[succ] = True
+                    work.append((succ, iter(graph[succ])))
+                    break
+                elif onstack[succ]:
+                    lowlink[node] = min(lowlink[node], index[succ])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        onstack[member] = False
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(sorted(component))
+    return components
+
+
+def decompose(incidence, ncols):
+    """Block-triangular decomposition of a square sparse structure
+
+    Rows are equations and columns are unknowns.  Return a list of
+    ``(rows, cols)`` pairs in the order they can be solved: each block only
+    involves its own columns and columns of earlier blocks.  Raise
+    ValueError if the structure is not square or is structurally singular.
+    """
+    if len(incidence) != ncols:
+        raise ValueError('cannot solve %d equations for %d unknowns'
+                         % (len(incidence), ncols))
+    colof = match(incidence, ncols)
+    if None in colof:
+        raise ValueError('system of equations is structurally singular')
+    rowof = [None] * ncols
+    for row, col in enumerate(colof):
+        rowof[col] = row
+    graph = [[rowof[col] for col in cols if rowof[col] != row]
+             for row, cols in enumerate(incidence)]
+    return [(rows, [colof[row] for row in rows]) for rows in tarjan(graph)]
+
+
+def components(incidence, ncols):
+    """Group rows that share columns, directly or indirectly
+
+    Return a list of lists of rows.  Rows in different groups have no
+    columns in common, so they can be solved independently.
+    """
+    parent = list(range(ncols))
+
+    def find(col):
+        while parent[col] != col:
+            parent[col] = parent[parent[col]]
+            col = parent[col]
+        return col
+
+    for cols in incidence:
+        for col in cols[1:]:
+            root, other = find(cols[0]), find(col)
+            if root != other:
+                parent[other] = root
+    groups = {}
+    isolated = []
+    for row, cols in enumerate(incidence):
+        if cols:
+            groups.setdefault(find(cols[0]), []).append(row)
+        else:
+            isolated.append([row])
+    return sorted(groups.values()) + isolated
+
+
+def partition(groups, count):
+    """Pack `groups` into at most `count` bins of similar total size"""
+    bins = [[] for _ in range(min(count, len(groups)))]
+    sizes = [0] * len(bins)
+    for group in sorted(groups, key=len, reverse=True):
+        i = sizes.index(min(sizes))
+        bins[i].extend(group)
+        sizes[i] += len(group)
+    return bins
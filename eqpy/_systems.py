@@ -1,8 +1,13 @@
 import itertools
+import multiprocessing
+import sys
+import threading
 import types
 import sympy
 
-from ._compatibility import range, integer_types, ellipsis_type
+from ._compatibility import range, integer_types, ellipsis_type, zip
+from ._profile import activate, active, count, timed
+from ._storage import Equations, Linear
 from ._utils import isiterable
 
 
@@ -18,6 +23,9 @@ class BaseSystem(object):
             suffix_include
             suffix_exclude
             dummies
+            solve_cache
+            cse
+            profile (True or a callback, see ``profile``)
         """
         self.prefix = kwargs.get('prefix', '')
         self.prefix_include = kwargs.get('prefix_include', [])
@@ -31,8 +39,26 @@ class BaseSystem(object):
         self.symbols = {}
         self.symbolnames = {}  # XXX necessary?
         self.userdict = {}
-        self.equations = {}
+        self.equations = Equations(self.symbolnames.__getitem__)
         self.assumptions = set()
+        self.solve_cache = kwargs.get('solve_cache')
+        self.cse = kwargs.get('cse', False)
+        self.profiler = None
+        if kwargs.get('profile'):
+            # a callable is the callback of the profiler
+            self.profile(kwargs['profile'])
+        self.decompositions = {}
+        self.plans = {}
+        self.solvers = {}
+        self.solutions = {}
+        self.dependents = {}
+        self.references = {}  # name -> tuple of symbols its equations use
+        self.users = {}  # symbol -> names of equations that involve it
+        self.restrictions = {}  # symbol -> assumptions that involve it
+        self.pools = {}  # workers -> process pool kept for nsolve
+        # taken to create symbols and to define equations; symbols that
+        # exist are looked up without it
+        self.lock = threading.RLock()
         # error if both include and exclude are defined
         if self.prefix_include and self.prefix_exclude:
             raise ValueError('"prefix_include" and "prefix_exclude" may not '
@@ -41,10 +67,39 @@ class BaseSystem(object):
             raise ValueError('"suffix_include" and "suffix_exclude" may not '
                              'both be specified')
 
-    def symbol(self, name):
-        if name in self.symbols:
-            return self.symbols[name]
+    def linear(self, keys, coeffs, symbols, offsets=0):
+        """Define the names of integer `keys` from arrays
+
+        The name of the ``i``-th key is defined as ``offsets[i] +
+        sum(coeffs[i, j] * symbols[j])`` (see ``Linear``).  The arrays are
+        stored as one ``LinearBlock``, whose equations are only built in
+        sympy when they are accessed, and ``nsolve`` solves blocks of such
+        names directly from the arrays.  The `keys` must be evenly spaced,
+        like a ``range``.
+        """
+        from ._storage import LinearBlock, LinearRow
+        keys = list(keys)
+        start = keys[0] if keys else 0
+        step = keys[1] - keys[0] if len(keys) > 1 else 1
+        if step == 0 or keys != list(range(start, start + len(keys) * step,
+                                           step)):
+            raise ValueError('keys of linear names must be evenly spaced')
+        block = LinearBlock(start, step, coeffs, symbols, offsets)
+        if len(block) != len(keys):
+            raise ValueError('%d rows of coefficients for %d keys'
+                             % (len(block), len(keys)))
+        self.allocate(keys)
+        with self.lock, timed(self.profiler, 'equation'):
+            for i, key in enumerate(keys):
+                name = self.symbols[key]
+                rows = [LinearRow(block, i, name)]
+                self.equations.define(name, block)
+                self.index(name, rows)
+                # whatever was cached for the old equations is dropped
+                self.invalidate(name, None, rows)
 
+    def fixes(self, name):
+        """Return the prefix and suffix for the symbol of `name`"""
         prefix = (
             not self.prefix_exclude and name in self.prefix_include or
             not self.prefix_include and name not in self.prefix_exclude
@@ -53,33 +108,1088 @@ class BaseSystem(object):
             not self.suffix_exclude and name in self.suffix_include or
             not self.suffix_include and name not in self.suffix_exclude
         ) and self.suffix or ''
+        return prefix, suffix
 
-        if isinstance(name, integer_types):
-            # all integers are currently treated as dummy variables
-            fullname = prefix + str(name) + suffix
-            symbol = sympy.Dummy(fullname)
-        else:
-            fullname = prefix + name + suffix
-            if self.dummies is True or name in self.dummies:
-                symbol = sympy.Dummy(fullname)
-            else:
-                symbol = sympy.Symbol(fullname)
+    def symbol(self, name):
+        """Return the symbol of `name`, creating it the first time
 
-        self.symbols[name] = symbol
-        self.symbolnames[symbol] = name  # XXX needed?
+        Symbols are interned: every thread gets the same symbol for a name.
+        """
+        symbol = self.symbols.get(name)
+        if symbol is not None:
+            return symbol
+        with self.lock:
+            # another thread may have created it in the meantime
+            symbol = self.symbols.get(name)
+            if symbol is not None:
+                return symbol
+            with timed(self.profiler, 'symbol'):
+                prefix, suffix = self.fixes(name)
+                if isinstance(name, integer_types):
+                    # all integers are currently treated as dummy variables
+                    fullname = prefix + str(name) + suffix
+                    symbol = sympy.Dummy(fullname)
+                else:
+                    fullname = prefix + name + suffix
+                    if self.dummies is True or name in self.dummies:
+                        symbol = sympy.Dummy(fullname)
+                    else:
+                        symbol = sympy.Symbol(fullname)
+            # the name is in place before other threads can see the symbol
+            self.symbolnames[symbol] = name  # XXX needed?
+            self.symbols[name] = symbol
         return symbol
 
+    def allocate(self, keys):
+        """Create the symbols of the integer `keys` that do not exist yet
+
+        The prefix and suffix rules are resolved once for all keys that
+        they do not list, instead of once for every key.
+        """
+        listed = set().union(self.prefix_include, self.prefix_exclude,
+                             self.suffix_include, self.suffix_exclude)
+        prefix, suffix = self.fixes(object())
+        symbols = self.symbols
+        symbolnames = self.symbolnames
+        with self.lock, timed(self.profiler, 'symbol'):
+            for key in keys:
+                if key in symbols:
+                    continue
+                if key in listed:
+                    symbol = self.symbol(key)
+                else:
+                    symbol = sympy.Dummy(prefix + str(key) + suffix)
+                    symbolnames[symbol] = key
+                    symbols[key] = symbol
+
+    def symbol_range(self, start, stop, step=1):
+        """Return a lazy ``SymbolRange`` of the symbols of integer keys"""
+        from ._storage import SymbolRange
+        return SymbolRange(self, start, stop, step)
+
     def equation(self, name, expr):
-        if isinstance(expr, sympy.Equality):
-            self.equations[name] = [sympy.Eq(name, expr.lhs),
-                                    sympy.Eq(name, expr.rhs)]
-        elif isiterable(expr):
-            self.equations[name] = list(sympy.Eq(name, ex) for ex in expr)
-        else:
-            self.equations[name] = [sympy.Eq(name, expr)]
+        from ._storage import LinearBlock
+        with self.lock, timed(self.profiler, 'equation'):
+            old = self.equations.get(name)
+            if isinstance(self.equations.entries.get(name), LinearBlock):
+                # decompositions hold rows of the block, not its equations
+                old = None
+            self.equations.define(name, expr)
+            new = self.equations[name]
+            self.index(name, new)
+            self.invalidate(name, old, new)
+
+    def template(self, keys, func):
+        """Define the names of integer `keys` with one shared template
+
+        ``func(key)`` gives the definition of the name of every key, like
+        an assignment to ``A[key]`` does.  Only the template is stored, and
+        the equations are built again from it whenever they are accessed.
+        New names are indexed from the symbols of ``func(key)`` without
+        building their equations, but `func` is still called once per key,
+        so defining them takes as long as building their expressions.
+        """
+        from ._storage import Template, involved
+        shared = Template(func)
+        self.allocate(keys)
+        with self.lock:
+            fresh = []
+            for key in keys:
+                name = self.symbols[key]
+                if name in self.equations:
+                    # what was cached for the old equations is dropped
+                    self.equation(name, shared)
+                else:
+                    fresh.append((key, name))
+            if not fresh:
+                return
+            with timed(self.profiler, 'equation'):
+                for key, name in fresh:
+                    self.equations.define(name, shared)
+                    self.reference(name, involved(name, func(key)))
+                # no cached step involves the equations of new names
+                self.plans.clear()
+                self.decompositions.clear()
+
+    def index(self, name, equations):
+        """Update the symbol indices for the equations of `name`"""
+        self.reference(name, frozenset().union(
+            *(eq.free_symbols for eq in equations)))
+
+    def reference(self, name, symbols):
+        """Update the symbol indices for `name`, whose equations involve
+        `symbols`"""
+        old = frozenset(self.references.get(name, ()))
+        new = frozenset(symbols)
+        for sym in old - new:
+            self.users[sym].discard(name)
+            if not self.users[sym]:
+                del self.users[sym]
+        for sym in new - old:
+            self.users.setdefault(sym, set()).add(name)
+        # tuples take a fraction of the memory of small sets
+        self.references[name] = tuple(new)
+
+    def invalidate(self, name, old, new):
+        """Drop what was cached for the old equations of `name`
+
+        Only the solvers and solutions of blocks that contain an equation
+        of `name` are dropped.  Block decompositions are kept if the new
+        equations involve the same symbols as the old ones.
+        """
+        from ._structure import Block
+        if old == new:
+            return
+        for key in self.dependents.pop(name, ()):
+            self.solvers.pop(key, None)
+            self.solutions.pop(key, None)
+            # the other names of a dropped step stop listing it
+            for other in set(eq.lhs for block in key
+                             for eq in block.equations):
+                steps = [step for step in self.dependents.get(other, ())
+                         if step is not key]
+                if steps:
+                    self.dependents[other] = steps
+                else:
+                    self.dependents.pop(other, None)
+        self.plans.clear()
+        if old is None or ([eq.free_symbols for eq in old] !=
+                           [eq.free_symbols for eq in new]):
+            self.decompositions.clear()
+            return
+        replace = dict(zip(old, new))
+        for unknowns, blocks in list(self.decompositions.items()):
+            self.decompositions[unknowns] = tuple(
+                Block(tuple(replace.get(eq, eq) for eq in block.equations),
+                      block.unknowns)
+                for block in blocks)
 
     def assumption(self, *relations, **assumptions):
-        pass
+        """Restrict the values that symbols may take
+
+        `relations` are sympy relations such as ``A.x > 0`` or
+        ``A.x + A.y <= 1``, possibly joined with ``&``.  Keyword arguments
+        give a sign to a symbol, a name or a list of them, as in
+        ``positive=['x', A.y]``; the signs are ``positive``,
+        ``nonnegative``, ``negative`` and ``nonpositive``.
+
+        The assumptions are propagated through the equations to bound the
+        symbols (see ``bounds``).  ``solve`` uses the bounds to drop
+        solution branches, and ``nsolve`` to start inside them and to
+        reject roots outside of them.
+        """
+        from ._intervals import signs
+        relations = list(relations)
+        for keyword, symbols in sorted(assumptions.items()):
+            if not isinstance(symbols, (list, tuple, set, frozenset)):
+                symbols = [symbols]
+            relations.extend(signs(keyword, [
+                sym if isinstance(sym, sympy.Basic) else self.symbol(sym)
+                for sym in symbols]))
+        while relations:
+            relation = relations.pop()
+            if isinstance(relation, sympy.And):
+                relations.extend(relation.args)
+            elif relation is sympy.false:
+                raise ValueError('assumption is always false')
+            elif not isinstance(relation, sympy.Rel):
+                if relation is not sympy.true:
+                    raise ValueError('assumptions must be relations, not %r'
+                                     % (relation,))
+            elif relation not in self.assumptions:
+                with self.lock:
+                    self.assumptions.add(relation)
+                    for sym in relation.free_symbols:
+                        self.restrictions.setdefault(sym, set()).add(
+                            relation)
+
+    def bounds(self, values=None):
+        """Return the bounds on symbols implied by the assumptions
+
+        Interval constraint propagation runs over the assumptions and the
+        equations connected to the assumed symbols (see ``constrained``),
+        with symbols in `values` fixed to their numeric values (or to the
+        range of an array of values), and treats the symbols of these
+        equations as real.  Return a dict mapping the other
+        symbols that have bounds to ``Interval(lo, hi)``.  Raise ValueError
+        if the assumptions cannot hold.
+        """
+        from ._intervals import EVERYTHING, Interval, constraint, propagate
+        if not self.assumptions:
+            return {}
+        values = self.mapping(values)
+        domains = {}
+        for sym, val in values.items():
+            if getattr(val, 'ndim', 0) and val.size:
+                domains[sym] = Interval(float(val.min()), float(val.max()))
+                continue
+            try:
+                domains[sym] = Interval(float(val), float(val))
+            except TypeError:
+                pass
+        constraints = [constraint(rel) for rel in self.assumptions]
+        constraints = [item for item in constraints if item is not None]
+        names = self.constrained(values)
+        constraints.extend((eq.lhs - eq.rhs, Interval(0.0, 0.0))
+                           for name in self.equations if name in names
+                           for eq in nontrivial(self.equations[name]))
+        if not propagate(constraints, domains):
+            raise ValueError('assumptions are inconsistent with the '
+                             'equations and values')
+        return dict((sym, domain) for sym, domain in domains.items()
+                    if sym not in values and domain != EVERYTHING)
+
+    def constrained(self, values=()):
+        """Return the names of the equations that are connected to the
+        assumed symbols through symbols that are not in `values`
+
+        Only these equations can bound symbols or contradict the
+        assumptions, so the others are neither built nor propagated.
+        """
+        names = set()
+        seen = set()
+        pending = [sym for sym in self.restrictions if sym not in values]
+        while pending:
+            sym = pending.pop()
+            if sym in seen:
+                continue
+            seen.add(sym)
+            for name in self.users.get(sym, ()):
+                if name not in names:
+                    names.add(name)
+                    pending.extend(other for other in self.references[name]
+                                   if other not in values)
+        return names
+
+    def admissible(self, solution):
+        """Return whether `solution` satisfies the assumptions
+
+        `solution` maps symbols to numbers or expressions.  Solutions that
+        give a non-real value to a restricted symbol are not admissible.
+        """
+        relations = set()
+        for sym, val in solution.items():
+            if sym in self.restrictions:
+                if sympy.sympify(val).is_real is False:
+                    return False
+                relations.update(self.restrictions[sym])
+        for relation in relations:
+            try:
+                if relation.xreplace(solution) is sympy.false:
+                    return False
+            except TypeError:
+                return False
+        return True
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self.equations.values())
+
+    def freesymbols(self):
+        """Return the sorted free symbols of all equations"""
+        return sorted(self.users, key=sympy.default_sort_key)
+
+    def uses(self, symbol):
+        """Return the names of the equations that involve `symbol`"""
+        if not isinstance(symbol, sympy.Basic):
+            symbol = self.symbol(symbol)
+        return frozenset(self.users.get(symbol, ()))
+
+    def depends_on(self, name):
+        """Return the symbols that the equations of `name` involve
+
+        The defining symbol `name` itself is not included.
+        """
+        if not isinstance(name, sympy.Basic):
+            name = self.symbol(name)
+        return frozenset(self.references.get(name, ())) - set([name])
+
+    def compile(self, symbols=None, cse=None):
+        """Compile the residuals ``lhs - rhs`` of all equations
+
+        Return a ``Kernel`` that takes one NumPy array (or scalar) for each
+        symbol in `symbols` and returns the residuals of all equations
+        stacked along the first axis.  `symbols` defaults to the sorted free
+        symbols of the system, and is available as ``kernel.symbols``.
+        With `cse` (default: the ``cse`` option of the system), common
+        subexpressions are computed once; ``kernel.count_ops()`` tells the
+        operation counts without and with elimination.
+        """
+        from ._compile import kernels
+        if symbols is None:
+            symbols = self.freesymbols()
+        if cse is None:
+            cse = self.cse
+        kernel, = kernels([[eq.lhs - eq.rhs for eq in nontrivial(self)]],
+                          symbols, cse)
+        return kernel
+
+    def count_ops(self, values=None):
+        """Return the operation counts of the solvers without and with CSE
+
+        The counts are summed over the compiled solvers for the unknowns
+        left by `values`, which tells how much the ``cse`` option saves.
+        """
+        unknowns, params = self.unknowns(self.mapping(values))
+        counts = [self.solver(step).count_ops()
+                  for step in self.plan(unknowns)]
+        return (sum(before for before, after in counts),
+                sum(after for before, after in counts))
+
+    def mapping(self, items):
+        """Return a dict of `items` keyed by symbols instead of names"""
+        if not items:
+            return {}
+        return dict((key if isinstance(key, sympy.Basic) else self.symbol(key),
+                     val) for key, val in dict(items).items())
+
+    def unknowns(self, values):
+        """Return the unknowns and the sorted parameters bound in `values`"""
+        params = tuple(sorted(values, key=sympy.default_sort_key))
+        unknowns = tuple(sym for sym in self.freesymbols()
+                         if sym not in values)
+        return unknowns, params
+
+    def blocks(self, values=None):
+        """Return the block-triangular decomposition of the system
+
+        Equations are matched to the unknowns that remain after binding
+        `values`, and grouped into strongly connected blocks.  Return a list
+        of ``Block(equations, unknowns)`` in an order that can be solved one
+        block at a time: each block only involves its own unknowns and the
+        unknowns of earlier blocks.
+        """
+        from ._storage import expand
+        from ._structure import Block
+        unknowns, params = self.unknowns(self.mapping(values))
+        return [Block(tuple(expand(eq) for eq in block.equations),
+                      block.unknowns)
+                for block in self.decompose(unknowns)]
+
+    def decompose(self, unknowns):
+        """Return the cached decomposition of the system for `unknowns`"""
+        from ._structure import Block, decompose
+        if unknowns in self.decompositions:
+            count(self.profiler, 'decompose.hit')
+            return self.decompositions[unknowns]
+        count(self.profiler, 'decompose.miss')
+        with timed(self.profiler, 'decompose'):
+            # equations defined by other threads must not change the
+            # mapping while it is read
+            with self.lock:
+                equations = list(nontrivial(itertools.chain.from_iterable(
+                    self.equations.rows())))
+            column = dict((sym, j) for j, sym in enumerate(unknowns))
+            incidence = [sorted(column[sym] for sym in eq.free_symbols
+                                if sym in column) for eq in equations]
+            self.decompositions[unknowns] = tuple(
+                Block(tuple(equations[i] for i in rows),
+                      tuple(unknowns[j] for j in cols))
+                for rows, cols in decompose(incidence, len(unknowns)))
+        return self.decompositions[unknowns]
+
+    def plan(self, unknowns):
+        """Return the steps that solve the system for `unknowns`, in order
+
+        Every step is a tuple of blocks that is solved by one solver.  Runs
+        of consecutive blocks that each directly define their unknown share
+        a step, and so do runs of blocks of ``LinearBlock`` rows.  Every
+        other block is a step of its own.
+        """
+        from ._numeric import isexplicit
+        from ._storage import LinearRow
+
+        def kind(block):
+            if all(isinstance(eq, LinearRow) for eq in block.equations):
+                return 'linear'
+            return 'explicit' if isexplicit(block) else 'implicit'
+        if unknowns not in self.plans:
+            steps = []
+            blocks = self.decompose(unknowns)
+            for group, run in itertools.groupby(blocks, kind):
+                if group == 'implicit':
+                    steps.extend((block,) for block in run)
+                else:
+                    steps.append(tuple(run))
+            self.plans[unknowns] = tuple(steps)
+        return self.plans[unknowns]
+
+    def solver(self, step):
+        """Return the cached solver for a step of a plan
+
+        Runs of ``LinearBlock`` rows get a ``RowSolver``, and runs of
+        explicit blocks an ``ExplicitSolver``.  A single implicit block gets
+        a ``LinearSolver`` if its equations are linear in its unknowns, and
+        a ``NewtonSolver`` otherwise; their parameters are the free symbols
+        of the block that are not its unknowns.
+        Solvers are kept until one of their equations is redefined.
+        """
+        from ._exact import affine
+        from ._linear import LinearSolver, RowSolver
+        from ._numeric import ExplicitSolver, NewtonSolver, isexplicit
+        from ._storage import LinearRow, expand
+        if step in self.solvers:
+            count(self.profiler, 'solver.hit')
+            return self.solvers[step]
+        count(self.profiler, 'solver.miss')
+        with timed(self.profiler, 'solver'), activate(self.profiler):
+            block = step[0]
+            rows = [eq for block in step for eq in block.equations]
+            if all(isinstance(eq, LinearRow) for eq in rows):
+                unknowns = [sym for block in step for sym in block.unknowns]
+                params = set()
+                for row in rows:
+                    params.update(row.free_symbols)
+                params.difference_update(unknowns)
+                params = sorted(params, key=sympy.default_sort_key)
+                solver = RowSolver(rows, unknowns, params)
+            elif len(step) == 1 and not isexplicit(block):
+                equations = [expand(eq) for eq in block.equations]
+                params = set()
+                for eq in equations:
+                    params.update(eq.free_symbols)
+                params.difference_update(block.unknowns)
+                params = sorted(params, key=sympy.default_sort_key)
+                terms = affine(equations, block.unknowns)
+                if terms is not None:
+                    solver = LinearSolver(equations, block.unknowns,
+                                          params, terms)
+                else:
+                    solver = NewtonSolver(equations, block.unknowns,
+                                          params, self.cse)
+            else:
+                solver = ExplicitSolver([block.equations[0]
+                                         for block in step], self.cse)
+        self.solvers[step] = solver
+        # steps are long tuples that are slow to hash, so they are listed
+        # rather than kept in sets
+        for block in step:
+            for eq in block.equations:
+                self.dependents.setdefault(eq.lhs, []).append(step)
+        return solver
+
+    def solve(self, values=None, unknowns=None, cache=None):
+        """Symbolically solve the system with ``sympy.solve``
+
+        `values` maps symbols (or their names) to numbers or expressions
+        that are substituted first.  The `unknowns` default to all remaining
+        free symbols; other symbols are kept as parameters.  `cache` is a
+        ``SolveCache`` or the path of its directory, and defaults to the
+        ``solve_cache`` option of the system.
+
+        Linear equations with rational coefficients are solved exactly by
+        fraction-free elimination on integers, which is much faster than
+        ``sympy.solve`` for large accounting-style systems.  Symbols bounded
+        by the assumptions are solved as real, and with a sign if it is
+        known, and solutions that violate the assumptions are dropped.
+
+        Return a list of dicts mapping unknowns to solutions.
+        """
+        problem = self.problem(values, unknowns)
+        if problem is None:
+            return []
+        equations, unknowns, finish = problem
+        return finish(self.symbolic(equations, unknowns, cache))
+
+    def problem(self, values, unknowns):
+        """Return the equations and unknowns that ``solve`` passes to
+        sympy, and the function that turns their solutions into the
+        solutions of the system, or None if there are no solutions"""
+        values = self.mapping(values)
+        unknowns = self.arguments(values, unknowns)
+        values = dict((sym, sympy.sympify(val)) for sym, val in values.items())
+        try:
+            restricted, restored = self.restrict(values)
+        except ValueError:
+            return None
+        equations = substitute(self, restricted)
+        if equations is None:
+            return None
+
+        def finish(solutions):
+            solutions = [restore(solution, restored)
+                         for solution in solutions]
+            if not self.assumptions:
+                return solutions
+            return [solution for solution in solutions
+                    if self.admissible(merge(values, solution))]
+        return (equations, tuple(restricted.get(sym, sym) for sym in unknowns),
+                finish)
+
+    def solve_async(self, values=None, unknowns=None, cache=None,
+                    executor=None, timeout=None, loop=None):
+        """Solve the system like ``solve`` without blocking the event loop
+
+        Return an asyncio future of the list of solutions, to be awaited
+        in a coroutine.  The equations are prepared at once, and sympy
+        solves them in a new process, which is terminated if the future is
+        cancelled or if `timeout` seconds pass first, in which case the
+        future raises ``asyncio.TimeoutError``.  A stuck solve therefore
+        costs no thread or memory of the caller after it is abandoned.
+        At most one such process per CPU runs at once, and further solves
+        wait for a free slot (see ``eqpy._tasks.run_process``).
+
+        If `executor` is a ``concurrent.futures`` thread or process pool,
+        the solve runs there instead.  Pool workers cannot be terminated,
+        so cancelling only abandons their result.
+        """
+        import asyncio
+        from ._tasks import chain, run_process
+        if loop is None:
+            loop = current_loop()
+        problem = self.problem(values, unknowns)
+        if problem is None:
+            future = loop.create_future()
+            future.set_result([])
+            return future
+        equations, unknowns, finish = problem
+        cache = cache if cache is not None else self.solve_cache
+        args = (equations, unknowns, cache)
+        if executor is None:
+            future = run_process(loop, cached_solve, args)
+        else:
+            future = loop.run_in_executor(executor, cached_solve, *args)
+        if timeout is not None:
+            future = asyncio.ensure_future(
+                asyncio.wait_for(future, timeout), loop=loop)
+        return chain(loop, future, finish)
+
+    def solve_hybrid(self, values=None, budget=1.0, ops=None, guess=None,
+                     tol=1e-10, maxiter=50, cache=None):
+        """Solve the system symbolically within a budget, or else numerically
+
+        Like ``nsolve``, the unknowns are all free symbols that are not in
+        `values`, and one solution is found.  The blocks of the
+        block-triangular decomposition are solved symbolically in turn, in
+        a new process, keeping the first real solution of every block.  The
+        process is terminated after `budget` seconds, or when a block has
+        more than `ops` operations after substitution.  The blocks that
+        were solved keep their exact values, and ``nsolve`` finds the
+        others, starting from these values and `guess`.
+
+        Return ``(solution, method)``, where `method` is ``'symbolic'`` if
+        all unknowns were solved symbolically, ``'numeric'`` if none were,
+        and ``'mixed'`` otherwise.  Raise ValueError if the assumptions
+        cannot hold.
+        """
+        from ._tasks import stream
+        values = self.mapping(values)
+        known = dict((sym, sympy.sympify(val)) for sym, val in values.items())
+        cache = cache if cache is not None else self.solve_cache
+        blocks = self.blocks(values)
+        restricted, restored = self.restrict(known)
+        exact = {}
+        numbers = {}
+        if blocks and (budget is None or budget > 0):
+            args = (blocks, restricted, restored, ops, cache)
+            with timed(self.profiler, 'symbolic'):
+                for solution in stream(solve_blocks, args, budget):
+                    solution = restore(solution, restored)
+                    if self.assumptions and not self.admissible(
+                            merge(known, exact, solution)):
+                        break
+                    try:
+                        floats = dict((sym, float(val))
+                                      for sym, val in solution.items())
+                    except TypeError:
+                        break
+                    exact.update(solution)
+                    numbers.update(floats)
+        if len(exact) == sum(len(block.unknowns) for block in blocks):
+            return exact, 'symbolic'
+        solution = self.nsolve(values, merge(self.mapping(guess), numbers),
+                               tol, maxiter)
+        return merge(solution, exact), 'mixed' if exact else 'numeric'
+
+    def iter_solutions(self, values=None, unknowns=None, cache=None,
+                       numeric=False, guess=None, tol=1e-10, maxiter=50):
+        """Yield the solutions of the system one at a time
+
+        Symbolic solutions are found one block of the block-triangular
+        decomposition at a time, depth first: each solution of a block is
+        substituted into the later blocks before the next one is tried, and
+        every complete solution is yielded as soon as it is found, so
+        stopping early skips the remaining work.  Systems that have no such
+        decomposition are solved by ``solve``.
+
+        If some of the `values` are sequences or iterators, the system is
+        solved for every point of them, taken together as with ``zip``, and
+        ``(point, solution)`` pairs are yielded, where `point` maps the swept
+        symbols to their values.  Points are only read as they are needed.
+        With `numeric`, every point is solved by ``nsolve`` starting from the
+        solution of the previous point (by ``sweep`` if a single symbol is
+        swept), and otherwise all of its symbolic solutions are yielded.
+        """
+        values = self.mapping(values)
+        swept = dict((sym, val) for sym, val in values.items()
+                     if not isinstance(val, (sympy.Basic, str)) and
+                     isiterable(val))
+        fixed = dict((sym, val) for sym, val in values.items()
+                     if sym not in swept)
+        if not swept:
+            if numeric:
+                yield self.nsolve(values, guess, tol, maxiter)
+            else:
+                for solution in self.iter_symbolic(values, unknowns, cache):
+                    yield solution
+            return
+        symbols = sorted(swept, key=sympy.default_sort_key)
+        if numeric and len(symbols) == 1:
+            symbol, = symbols
+            for target, solution in self.sweep(symbol, swept[symbol], fixed,
+                                               guess, tol, maxiter):
+                yield {symbol: target}, solution
+            return
+        for point in zip(*[swept[sym] for sym in symbols]):
+            point = dict(zip(symbols, point))
+            if numeric:
+                solution = self.nsolve(merge(fixed, point), guess, tol,
+                                       maxiter)
+                guess = solution
+                yield point, solution
+            else:
+                for solution in self.iter_symbolic(merge(fixed, point),
+                                                   unknowns, cache):
+                    yield point, solution
+
+    def iter_symbolic(self, values, unknowns=None, cache=None):
+        """Yield symbolic solutions depth first over the blocks of the
+        system (see ``iter_solutions``)"""
+        from ._storage import expand
+        values = self.mapping(values)
+        unknowns = self.arguments(values, unknowns)
+        values = dict((sym, sympy.sympify(val)) for sym, val in values.items())
+        try:
+            blocks = self.decompose(unknowns)
+            restricted, restored = self.restrict(values)
+        except ValueError:
+            blocks = ()
+        if not blocks:
+            for solution in self.solve(values, unknowns, cache):
+                yield solution
+            return
+
+        def branches(block, partial):
+            equations = substitute([expand(eq) for eq in block.equations],
+                                   merge(restricted, partial))
+            if equations is None:
+                return iter(())
+            solutions = self.symbolic(
+                equations,
+                tuple(restricted.get(sym, sym) for sym in block.unknowns),
+                cache)
+            # keys go back to the symbols of the system, while values keep
+            # the Dummies to be substituted into later blocks
+            return iter([dict((sym.xreplace(restored), val)
+                              for sym, val in solution.items())
+                         for solution in solutions])
+
+        # stack[k] iterates over the solutions of block k given the partial
+        # solution of the blocks before it
+        stack = [(branches(blocks[0], {}), {})]
+        while stack:
+            solutions, partial = stack[-1]
+            solution = next(solutions, None)
+            if solution is None:
+                stack.pop()
+                continue
+            partial = merge(partial, solution)
+            if self.assumptions and not self.admissible(
+                    merge(values, restore(partial, restored))):
+                continue
+            if len(stack) < len(blocks):
+                stack.append((branches(blocks[len(stack)], partial), partial))
+            else:
+                yield restore(dict((sym, partial[sym]) for sym in unknowns
+                                   if sym in partial), restored)
+
+    def arguments(self, values, unknowns):
+        """Return the `unknowns` as symbols, defaulting to all free symbols
+        that are not in `values`"""
+        if unknowns is None:
+            return self.unknowns(values)[0]
+        return tuple(sym if isinstance(sym, sympy.Basic) else self.symbol(sym)
+                     for sym in unknowns)
+
+    def restrict(self, values):
+        """Return replacements of symbols for a symbolic solve
+
+        Symbols in `values` are replaced by their values, and symbols that
+        the assumptions bound are replaced by Dummies that are real and have
+        a sign if it is known, so sympy drops the branches that contradict
+        them.  Return the replacements and the Dummies mapped back to
+        their symbols.  Raise ValueError if the assumptions cannot hold.
+        """
+        from ._intervals import assumptions
+        bounds = self.bounds(values)
+        restricted = dict((sym, sympy.Dummy(sym.name, **assumptions(domain)))
+                          for sym, domain in bounds.items())
+        restored = dict((val, sym) for sym, val in restricted.items())
+        restricted.update(values)
+        return restricted, restored
+
+    def symbolic(self, equations, unknowns, cache=None):
+        """Solve `equations` for `unknowns`, through the solve cache"""
+        cache = cache if cache is not None else self.solve_cache
+        with timed(self.profiler, 'symbolic'), activate(self.profiler):
+            return cached_solve(equations, unknowns, cache)
+
+    def nsolve(self, values=None, guess=None, tol=1e-10, maxiter=50,
+               workers=None, executor=None, precision=None):
+        """Numerically solve the system with damped Newton iterations
+
+        `values` maps symbols (or their names) to numbers, and all remaining
+        free symbols are the unknowns.  `guess` maps unknowns to starting
+        values, which default to 1.0.  The system is solved one block of
+        its block-triangular decomposition at a time.  The symbolic
+        Jacobian of every block is compiled once, and the solution of every
+        block is remembered, until one of its equations changes.
+
+        If `workers` or `executor` is given, independent parts of the system
+        are solved in parallel, in a ``concurrent.futures`` `executor` or in
+        a process pool with `workers` processes.  The pool is kept for
+        later calls with the same `workers`, so its processes reuse the
+        solvers they compiled (see ``pool``).
+
+        Unknowns bounded by the assumptions start inside their bounds, and
+        ValueError is raised as soon as a block has a root outside of them.
+
+        With `precision`, nonlinear blocks whose float iterations do not
+        converge are iterated further with mpmath, with up to `precision`
+        decimal digits that are only raised as far as they are needed (see
+        ``NewtonSolver.refine``).
+
+        Return a dict mapping the unknowns to floats.
+        """
+        import numpy
+        values = self.mapping(values)
+        guess = self.mapping(guess)
+        if workers is not None or executor is not None:
+            return self.nsolve_parallel(values, guess, tol, maxiter,
+                                        workers, executor, precision)
+        unknowns, params = self.unknowns(values)
+        bounds = self.bounds(values)
+        known = dict(values)
+        for step in self.plan(unknowns):
+            solver = self.solver(step)
+            start = tuple(guess.get(sym, bounds[sym].choose() if sym in bounds
+                                    else 1.0) for sym in solver.unknowns)
+            args = tuple(known[sym] for sym in solver.params)
+            # steps whose inputs did not change since the last solve are
+            # not solved again
+            inputs, x = self.solutions.get(step, (None, None))
+            if inputs == (start, args, tol, precision):
+                count(self.profiler, 'solution.hit')
+            else:
+                count(self.profiler, 'solution.miss')
+                with timed(self.profiler, 'iterate'):
+                    x, converged, iterations = solver.solve(
+                        start, args, tol=tol, maxiter=maxiter)
+                count(self.profiler, 'iterations', iterations)
+                if (not converged and precision is not None and
+                        hasattr(solver, 'refine')):
+                    # iterations continue from the stalled float iterate
+                    if not numpy.isfinite(x).all():
+                        x = start
+                    with timed(self.profiler, 'refine'):
+                        x, converged, iterations = solver.refine(
+                            x, args, tol, maxiter, precision)
+                    count(self.profiler, 'refined.iterations', iterations)
+                if not converged:
+                    raise ValueError('Newton iteration did not converge '
+                                     'after %d iterations' % iterations)
+                x = x.tolist()
+                self.solutions[step] = ((start, args, tol, precision), x)
+            for sym, val in zip(solver.unknowns, x):
+                if sym in bounds and not bounds[sym].contains(val, 1e-9):
+                    raise ValueError('solution %s = %r is outside of its '
+                                     'bounds [%r, %r]' % ((sym, val) +
+                                                          bounds[sym]))
+            known.update(zip(solver.unknowns, x))
+        if self.assumptions and not self.admissible(known):
+            raise ValueError('solution does not satisfy the assumptions')
+        return dict((sym, known[sym]) for sym in unknowns)
+
+    def sweep(self, symbol, targets, values=None, guess=None, tol=1e-10,
+              maxiter=10, minstep=1e-9, predictor='secant'):
+        """Solve the system along a path of values for one parameter
+
+        Yield ``(target, solution)`` for each value in `targets`, in order.
+        The first target is solved from `guess`, and each later solve starts
+        from the previous solutions, which keeps it on the same branch.  With
+        the ``'secant'`` `predictor` the starting point is extrapolated from
+        the last two solutions, and with ``'constant'`` the last solution is
+        used as is.  When a corrector solve does not converge in `maxiter`
+        iterations, the step towards the next target is halved and grows
+        again after successful steps.  ValueError is raised if the step
+        becomes smaller than `minstep` (relative to the target).
+        """
+        if predictor not in ('secant', 'constant'):
+            raise ValueError('predictor must be "secant" or "constant"')
+        if not isinstance(symbol, sympy.Basic):
+            symbol = self.symbol(symbol)
+        values = self.mapping(values)
+        history = []
+        for target in targets:
+            values[symbol] = target
+            if not history:
+                solution = self.nsolve(values, guess, tol)
+                history.append((target, solution))
+                yield target, solution
+                continue
+            current = history[-1][0]
+            step = target - current
+            while current != target:
+                if abs(target - current) <= abs(step):
+                    trial = target
+                else:
+                    trial = current + step
+                if predictor == 'secant' and len(history) > 1:
+                    start = extrapolate(history, trial)
+                else:
+                    start = history[-1][1]
+                values[symbol] = trial
+                try:
+                    solution = self.nsolve(values, start, tol, maxiter)
+                except ValueError:
+                    step *= 0.5
+                    if abs(step) < minstep * max(1.0, abs(target)):
+                        raise ValueError('continuation failed at %s = %r'
+                                         % (symbol, current))
+                    continue
+                history = [history[-1], (trial, solution)]
+                current = trial
+                step *= 2
+            yield target, solution
+
+    def continuation(self, symbol, targets, values=None, guess=None,
+                     tol=1e-10, maxiter=10, minstep=1e-9, predictor='secant'):
+        """Solve the system for every value of `symbol` in `targets`
+
+        Return a list of solutions computed by ``sweep``.
+        """
+        return [solution for target, solution in
+                self.sweep(symbol, targets, values, guess, tol, maxiter,
+                           minstep, predictor)]
+
+    def nsolve_parallel(self, values, guess, tol, maxiter, workers=None,
+                        executor=None, precision=None):
+        """Solve the connected components of the system in parallel
+
+        Components share no unknowns, so each is solved independently.
+        They are packed into a few balanced chunks that are sent to the
+        executor, where each process compiles and caches its own solvers.
+        Every chunk takes the assumptions on its symbols, and the whole
+        solution is checked against all of them.
+        """
+        from ._structure import components, partition
+        unknowns, params = self.unknowns(values)
+        equations = list(nontrivial(self))
+        column = dict((sym, j) for j, sym in enumerate(unknowns))
+        incidence = [sorted(column[sym] for sym in eq.free_symbols
+                            if sym in column) for eq in equations]
+        nchunks = 4 * (workers or multiprocessing.cpu_count())
+        if executor is None:
+            executor = self.pool(workers)
+        futures = []
+        for rows in partition(components(incidence, len(unknowns)), nchunks):
+            chunk = tuple(equations[row] for row in rows)
+            symbols = set().union(*(eq.free_symbols for eq in chunk))
+            relations = set().union(*(self.restrictions.get(sym, ())
+                                      for sym in symbols))
+            futures.append(executor.submit(
+                solve_chunk, chunk,
+                dict((sym, values[sym]) for sym in symbols
+                     if sym in values),
+                dict((sym, guess[sym]) for sym in symbols
+                     if sym in guess),
+                tol, maxiter, precision,
+                tuple(sorted(relations, key=sympy.default_sort_key))))
+        solution = {}
+        for future in futures:
+            solution.update(future.result())
+        if self.assumptions and not self.admissible(merge(values, solution)):
+            raise ValueError('solution does not satisfy the assumptions')
+        return solution
+
+    def pool(self, workers=None):
+        """Return the process pool with `workers` processes for ``nsolve``
+
+        The pool is created on the first call and kept, with the systems
+        that its processes rebuilt and compiled for every chunk, until
+        the system is garbage collected.  Forks share the pools.  Like
+        other workers, the processes are not forked from this one where
+        Python allows to choose (see ``eqpy._tasks.context``).
+        """
+        from concurrent.futures import ProcessPoolExecutor
+        from ._tasks import context
+        options = {}
+        if sys.version_info >= (3, 7):
+            # earlier Pythons always fork the workers of pools
+            options['mp_context'] = context()
+        with self.lock:
+            if workers not in self.pools:
+                self.pools[workers] = ProcessPoolExecutor(workers, **options)
+            return self.pools[workers]
+
+    def nsolve_batch(self, values, guess=None, tol=1e-10, maxiter=50):
+        """Numerically solve the system for many parameter sets at once
+
+        Like ``nsolve``, but each value in `values` and `guess` may be a 1-d
+        array, with one entry per instance of the system.  Every instance
+        is solved together by the same compiled solvers.  Unknowns bounded
+        by the assumptions for the range of the values start inside their
+        bounds, and instances with a root outside of them do not converge.
+
+        Return ``(solutions, converged)``: a structured array with one field
+        per unknown (named ``str(symbol)``) and a boolean array telling
+        which instances converged.
+        """
+        import numpy
+        from ._numeric import records
+        values = self.mapping(values)
+        guess = self.mapping(guess)
+        unknowns, params = self.unknowns(values)
+        bounds = self.bounds(dict((sym, numpy.asarray(val, dtype=float))
+                                  for sym, val in values.items()))
+        known = dict(values)
+        shape = numpy.broadcast_shapes(*[numpy.shape(val)
+                                         for val in values.values()])
+        if len(shape) > 1:
+            raise ValueError('batched values must be one-dimensional')
+        converged = numpy.ones(shape[0] if shape else 1, dtype=bool)
+        for step in self.plan(unknowns):
+            solver = self.solver(step)
+            with timed(self.profiler, 'iterate'):
+                x, ok, iterations = solver.solve_batch(
+                    [guess.get(sym, bounds[sym].choose() if sym in bounds
+                               else 1.0) for sym in solver.unknowns],
+                    [known[sym] for sym in solver.params],
+                    tol=tol, maxiter=maxiter)
+            count(self.profiler, 'iterations', iterations)
+            for sym, column in zip(solver.unknowns, x.T):
+                if sym in bounds:
+                    lo, hi = bounds[sym]
+                    scale = 1e-9 * numpy.maximum(1.0, numpy.abs(column))
+                    ok = ok & (column >= lo - scale) & (column <= hi + scale)
+            known.update((sym, x[:, j])
+                         for j, sym in enumerate(solver.unknowns))
+            converged = ok & converged
+        return records(unknowns, [known[sym] for sym in unknowns],
+                       len(converged)), converged
+
+    def profile(self, enable=True, callback=None):
+        """Turn the collection of timings and counters on or off
+
+        When enabled, the time spent in each phase of the work for the
+        system and counters of cache hits and Newton iterations are
+        collected, and ``stats`` returns them.  `callback`, if given, is
+        called with the name and the duration in seconds of every phase
+        as it ends, to export them.  The phases are:
+
+            symbol     creating symbols
+            equation   defining equations and updating the indices
+            decompose  block-triangular decomposition
+            solver     creating a solver for a step, which includes
+            derive     deriving Jacobians,
+            cse        eliminating common subexpressions and
+            compile    compiling kernels
+            iterate    numeric iterations
+            refine     multiprecision iterations of ``nsolve``
+            symbolic   symbolic solves, with their ``exact`` and ``sympy``
+                       solves
+
+        The counters are ``decompose.hit``/``miss``, ``solver.hit``/
+        ``miss``, ``solution.hit``/``miss``, ``iterations``,
+        ``refined.iterations`` of multiprecision iterations, and
+        ``kernel.exprs`` and ``kernel.nodes`` for the number and the size
+        of compiled expressions.  When disabled, the phases cost one check
+        each.  Enabling profiling again starts over.
+        """
+        from ._profile import Profiler
+        if callable(enable) and callback is None:
+            enable, callback = True, enable
+        self.profiler = Profiler(callback) if enable else None
+
+    def stats(self, reset=False):
+        """Return the timings and counters collected since profiling was
+        enabled (see ``profile``)
+
+        The dict has a ``'time'`` dict of seconds per phase, a ``'calls'``
+        dict of calls per phase and a ``'counts'`` dict of counters.  With
+        `reset`, collection starts over.
+        """
+        if self.profiler is None:
+            return {'time': {}, 'calls': {}, 'counts': {}}
+        stats = self.profiler.stats()
+        if reset:
+            self.profiler.reset()
+        return stats
+
+    def fork(self):
+        """Return a ``System`` that starts as a copy of this system
+
+        Nothing is copied up front: the fork and this system share all
+        symbols, equations, user values and cached decompositions, plans
+        and compiled solvers, and each of them keeps only the entries it
+        changes afterwards (see ``Overlay``).  Neither sees the changes of
+        the other, and the fork reuses every cached solver whose equations
+        it did not redefine.  Forking a system that did not change since
+        its last fork adds no layer of lookups.  A profiled system gives
+        the fork its own profiler with the same callback.
+        """
+        import copy
+        from ._storage import Equations, share
+        with self.lock:
+            other = copy.copy(self)
+            other.lock = threading.RLock()
+            for attr in ['symbols', 'symbolnames', 'userdict', 'references',
+                         'decompositions', 'plans', 'solvers', 'solutions']:
+                mine, theirs = share(getattr(self, attr))
+                setattr(self, attr, mine)
+                setattr(other, attr, theirs)
+            for attr, copier in [('users', set), ('restrictions', set),
+                                 ('dependents', list)]:
+                mine, theirs = share(getattr(self, attr), copier)
+                setattr(self, attr, mine)
+                setattr(other, attr, theirs)
+            mine, theirs = share(self.equations.entries)
+            self.equations = Equations(self.symbolnames.__getitem__)
+            self.equations.entries = mine
+            other.equations = Equations(other.symbolnames.__getitem__)
+            other.equations.entries = theirs
+            other.assumptions = set(self.assumptions)
+            if self.profiler is not None:
+                other.profile(True, self.profiler.callback)
+        return wrap(other)
+
+    def save(self, path):
+        """Save the system to the file `path` in a compact binary format
+
+        Symbols are stored once in a table, and all equations and
+        assumptions as one graph of flat arrays in which equal
+        subexpressions are shared.  ``load`` maps the file into memory and
+        builds symbols, equations and indices only when they are used, so a
+        large system loads much faster than it is built or unpickled.
+        `Dummy` symbols keep their identity within the loaded system.  The
+        options and the user dict are pickled, and template definitions are
+        saved as the equations they give.
+        """
+        from ._serialize import save
+        with self.lock:
+            save(self, path)
+
+
+def wrap(base):
+    """Return a ``System`` for the ``BaseSystem`` `base`"""
+    system = System.__new__(System)
+    system.__dict__[...] = base
+    return system
+
+
+def load(path):
+    """Load a ``System`` saved with ``System[...].save``"""
+    from ._serialize import load
+    return wrap(load(path))
 
 
 class System(object):
@@ -106,8 +1216,8 @@ class System(object):
         elif isinstance(key, slice):
             if key.stop is None:
                 raise ValueError('slice must include stop index')
-            indices = range(key.start or 0, key.stop, key.step or 1)
-            return tuple(self[...].symbol(index) for index in indices)
+            return self[...].symbol_range(key.start or 0, key.stop,
+                                          key.step or 1)
         else:
             return self[...].userdict[key]
 
@@ -121,8 +1231,25 @@ class System(object):
             if key.stop is None:
                 raise ValueError('slice must include stop index')
             indices = range(key.start or 0, key.stop, key.step or 1)
+            if isinstance(value, Linear):
+                self[...].linear(indices, value.coeffs, value.symbols,
+                                 value.offsets)
+                return
+            # arrays only exist once numpy was imported, which eqpy does
+            # not need otherwise
+            numpy = sys.modules.get('numpy')
+            if (numpy is not None and isinstance(value, numpy.ndarray) and
+                    value.dtype != object):
+                # constants are a linear block without symbols
+                self[...].linear(indices, numpy.zeros((len(value), 0)), (),
+                                 value)
+                return
+            if callable(value) and not isinstance(value, sympy.Basic):
+                self[...].template(indices, value)
+                return
             if len(indices) != len(value):
                 raise ValueError('slice and values must have same length')
+            self[...].allocate(indices)
             for i, index in enumerate(indices):
                 symbol = self[...].symbol(index)
                 self[...].equation(symbol, value[i])
@@ -133,7 +1260,140 @@ class System(object):
         self[...].assumption(*relations, **assumptions)
 
     def __iter__(self):
-        return itertools.chain.from_iterable(self[...].equations.values())
+        return iter(self[...])
 
     def __contains__(self, item):
         return item in self[...].equations or item in self[...].userdict
+
+
+def extrapolate(history, target):
+    """Linearly extrapolate the last two solutions in `history`"""
+    (p0, x0), (p1, x1) = history[-2:]
+    ratio = (target - p1) / float(p1 - p0)
+    return dict((sym, x1[sym] + (x1[sym] - x0[sym]) * ratio) for sym in x1)
+
+
+chunksystems = {}
+
+
+def solve_chunk(equations, values, guess, tol, maxiter, precision=None,
+                relations=()):
+    """Solve independent equations in a worker process
+
+    A system is rebuilt from the equations and the assumption `relations`
+    once per process and kept, so repeated solves of the same chunk reuse
+    its compiled solvers.
+    """
+    key = (equations, relations)
+    if key not in chunksystems:
+        if len(chunksystems) >= 64:
+            chunksystems.clear()
+        system = BaseSystem()
+        for name, eqs in itertools.groupby(equations, lambda eq: eq.lhs):
+            eqs = system.equations.get(name, []) + list(eqs)
+            system.equations[name] = eqs
+            system.index(name, eqs)
+        system.assumption(*relations)
+        chunksystems[key] = system
+    return chunksystems[key].nsolve(values, guess, tol, maxiter,
+                                    precision=precision)
+
+
+def nontrivial(equations):
+    """Yield the `equations` that are not ``sympy.true``, and raise
+    ValueError for ``sympy.false``, which no values satisfy"""
+    for eq in equations:
+        if eq is sympy.false:
+            raise ValueError('the system has an equation that is always '
+                             'false')
+        if eq is not sympy.true:
+            yield eq
+
+
+def substitute(equations, replacements):
+    """Return `equations` after `replacements`, without those that became
+    true, or None if any became false"""
+    out = []
+    for eq in equations:
+        eq = eq.xreplace(replacements)
+        if eq is sympy.false:
+            return None
+        elif eq is not sympy.true:
+            out.append(eq)
+    return out
+
+
+def merge(*dicts):
+    out = {}
+    for d in dicts:
+        out.update(d)
+    return out
+
+
+def restore(solution, restored):
+    """Replace the Dummies of ``BaseSystem.restrict`` in a solution"""
+    if not restored:
+        return solution
+    return dict((sym.xreplace(restored), sympy.sympify(val).xreplace(restored))
+                for sym, val in solution.items())
+
+
+def cached_solve(equations, unknowns, cache):
+    """Solve symbolically through `cache`, a ``SolveCache``, its path or
+    None"""
+    from ._cache import SolveCache
+    if cache is None:
+        return symbolic_solve(equations, unknowns)
+    if not isinstance(cache, SolveCache):
+        cache = SolveCache(cache)
+    return cache.solve(equations, unknowns, symbolic_solve)
+
+
+def solve_blocks(blocks, restricted, restored, ops, cache):
+    """Yield a real solution of every block in turn, given the solutions
+    before it, and stop at a block without one or with more than `ops`
+    operations (see ``BaseSystem.solve_hybrid``)"""
+    partial = {}
+    for block in blocks:
+        equations = substitute(block.equations, merge(restricted, partial))
+        if equations is None:
+            return
+        if ops is not None and sympy.count_ops(equations) > ops:
+            return
+        try:
+            solutions = cached_solve(
+                equations,
+                tuple(restricted.get(sym, sym) for sym in block.unknowns),
+                cache)
+        except NotImplementedError:
+            return
+        for solution in solutions:
+            if all(sympy.sympify(val).is_real is not False
+                   for val in solution.values()):
+                break
+        else:
+            return
+        solution = dict((sym.xreplace(restored), val)
+                        for sym, val in solution.items())
+        partial.update(solution)
+        yield solution
+
+
+def current_loop():
+    """Return the running event loop, or the loop of this thread"""
+    import asyncio
+    try:
+        return asyncio.get_running_loop()
+    except (AttributeError, RuntimeError):
+        return asyncio.get_event_loop()
+
+
+def symbolic_solve(equations, unknowns):
+    from ._exact import exact_solve
+    # exact linear systems are solved without sympy's generic machinery
+    with timed(active(), 'exact'):
+        solution = exact_solve(equations, unknowns)
+    if solution is not None:
+        return [solution]
+    with timed(active(), 'sympy'):
+        return sympy.solve(equations, unknowns, dict=True)
@@ -0,0 +1,184 @@
+import multiprocessing
+import threading
+
+from ._profile import clock
+
+# the context that starts worker processes and the threads that wait for
+# them, created when they are first needed
+processes = {'context': None, 'waiters': None}
+lock = threading.Lock()
+
+
+def context():
+    """Return the multiprocessing context that starts worker processes
+
+    Workers are forked from a single-threaded server, or spawned where that
+    is not available, since forking a process that runs threads, such as
+    the executor threads of an asyncio server, can deadlock.  Pythons
+    before 3.4 can only fork.
+    """
+    if processes['context'] is None:
+        if not hasattr(multiprocessing, 'get_context'):  # pragma: no cover
+            processes['context'] = multiprocessing
+        elif 'forkserver' in multiprocessing.get_all_start_methods():
+            processes['context'] = multiprocessing.get_context('forkserver')
+        else:  # pragma: no cover
+            processes['context'] = multiprocessing.get_context('spawn')
+    return processes['context']
+
+
+def waiters():
+    """Return the thread pool that starts and waits for the processes of
+    ``run_process``, which bounds how many of them run at once"""
+    with lock:
+        if processes['waiters'] is None:
+            from concurrent.futures import ThreadPoolExecutor
+            processes['waiters'] = ThreadPoolExecutor(
+                multiprocessing.cpu_count())
+        return processes['waiters']
+
+
+def work(sender, func, args):
+    """Send the result of ``func(*args)`` through `sender` (in a child)"""
+    try:
+        result = (True, func(*args))
+    except Exception as exc:
+        result = (False, exc)
+    try:
+        sender.send(result)
+    except Exception as exc:
+        # the result or the exception could not be pickled
+        sender.send((False, RuntimeError(repr(exc))))
+    finally:
+        sender.close()
+
+
+def produce(sender, func, args):
+    """Send every item of ``func(*args)`` through `sender` (in a child)"""
+    try:
+        for item in func(*args):
+            sender.send((True, item))
+    except Exception as exc:
+        try:
+            sender.send((False, exc))
+        except Exception:
+            sender.send((False, RuntimeError(repr(exc))))
+    finally:
+        sender.close()
+
+
+def receive(process, receiver):
+    """Wait for the result of the `process` that runs ``work``
+
+    The process is joined in any case, and raises RuntimeError if it ends
+    without a result, like when it is terminated.
+    """
+    try:
+        ok, value = receiver.recv()
+    except EOFError:
+        ok = None
+    finally:
+        receiver.close()
+        process.join()
+    if ok is None:
+        raise RuntimeError('worker process ended with exit code %s'
+                           % process.exitcode)
+    if not ok:
+        raise value
+    return value
+
+
+def run_process(loop, func, args):
+    """Run ``func(*args)`` in a new process without blocking `loop`
+
+    Return an asyncio future of the result.  At most one process per CPU
+    runs at once (see ``waiters``), and later calls wait for a free slot
+    before their process starts.  Cancelling the future terminates the
+    process, or keeps it from starting.
+    """
+    started = {}
+
+    def start():
+        receiver, sender = context().Pipe(duplex=False)
+        process = context().Process(target=work, args=(sender, func, args))
+        process.daemon = True
+        with lock:
+            if started.get('cancelled'):
+                raise RuntimeError('cancelled before the worker started')
+            started['process'] = process
+            process.start()
+        sender.close()
+        return receive(process, receiver)
+    future = loop.run_in_executor(waiters(), start)
+
+    def done(future):
+        if future.cancelled():
+            with lock:
+                started['cancelled'] = True
+                process = started.get('process')
+            if process is not None and process.is_alive():
+                process.terminate()
+    future.add_done_callback(done)
+    return future
+
+
+def stream(func, args, timeout=None):
+    """Yield the items of ``func(*args)`` as a new process produces them
+
+    Stop after `timeout` seconds, even while waiting for an item.  The
+    process is terminated when the generator stops or is closed, and
+    exceptions raised by `func` are raised here.
+    """
+    receiver, sender = context().Pipe(duplex=False)
+    process = context().Process(target=produce, args=(sender, func, args))
+    process.daemon = True
+    process.start()
+    sender.close()
+    deadline = None if timeout is None else clock() + timeout
+    try:
+        while True:
+            if deadline is not None:
+                remaining = deadline - clock()
+                if remaining <= 0 or not receiver.poll(remaining):
+                    return
+            try:
+                ok, item = receiver.recv()
+            except EOFError:
+                return
+            if not ok:
+                raise item
+            yield item
+    finally:
+        receiver.close()
+        if process.is_alive():
+            process.terminate()
+        process.join()
+
+
+def chain(loop, future, func):
+    """Return a future of ``func(result)`` for the result of `future`
+
+    Exceptions are passed on, and cancelling either future cancels the
+    other.
+    """
+    out = loop.create_future()
+
+    def forward(future):
+        if out.done():
+            return
+        if future.cancelled():
+            out.cancel()
+        elif future.exception() is not None:
+            out.set_exception(future.exception())
+        else:
+            try:
+                out.set_result(func(future.result()))
+            except Exception as exc:
+                out.set_exception(exc)
+
+    def backward(out):
+        if out.cancelled():
+            future.cancel()
+    future.add_done_callback(forward)
+    out.add_done_callback(backward)
+    return out
@@ -0,0 +1,77 @@
+import os
+import sympy
+from eqpy._cache import SolveCache
+
+
+def test_canonical(tmpdir):
+    cache = SolveCache(str(tmpdir))
+    x, y = sympy.symbols('x y')
+    d0, d1 = sympy.Dummy('0'), sympy.Dummy('1')
+    e0, e1 = sympy.Dummy('0'), sympy.Dummy('1')
+    key1, replace1 = cache.canonical([sympy.Eq(d0, x * d1),
+                                      sympy.Eq(d1, y)], [d0, d1])
+    key2, replace2 = cache.canonical([sympy.Eq(e1, y),
+                                      sympy.Eq(e0, x * e1)], [e1, e0])
+    assert key1 == key2
+    assert replace1[d0] == replace2[e0]
+    key3, _ = cache.canonical([sympy.Eq(d0, x * d1),
+                               sympy.Eq(d1, 2 * y)], [d0, d1])
+    assert key3 != key1
+    key4, _ = cache.canonical([sympy.Eq(d0, x * d1),
+                               sympy.Eq(d1, y)], [d0, d1, x])
+    assert key4 != key1
+
+
+def test_solve(tmpdir):
+    cache = SolveCache(str(tmpdir))
+    calls = []
+
+    def solve(equations, unknowns):
+        calls.append(unknowns)
+        return sympy.solve(equations, unknowns, dict=True)
+
+    d, x = sympy.Dummy('0'), sympy.Symbol('x')
+    first = cache.solve([sympy.Eq(d**2, x)], [d], solve)
+    assert len(calls) == 1
+    e = sympy.Dummy('0')
+    second = cache.solve([sympy.Eq(e**2, x)], [e], solve)
+    assert len(calls) == 1
+    assert sorted(second, key=str) == sorted(
+        [dict((e, val.xreplace({d: e})) for val in s.values())
+         for s in first], key=str)
+    assert second[0][e] in (sympy.sqrt(x), -sympy.sqrt(x))
+
+
+def test_evict(tmpdir):
+    cache = SolveCache(str(tmpdir), maxsize=1000)
+    for i in range(20):
+        cache.set('key%d' % i, [{'value': 'x' * 100}])
+        os.utime(cache.filename('key%d' % i), (i, i))
+    names = sorted(os.listdir(str(tmpdir)))
+    assert 0 < len(names) < 20
+    assert 'key19.pickle' in names
+    assert 'key0.pickle' not in names
+    assert cache.get('key19') == [{'value': 'x' * 100}]
+    assert cache.get('key0') is None
+
+
+def test_races(tmpdir, monkeypatch):
+    # entries that other processes remove meanwhile are skipped
+    cache = SolveCache(str(tmpdir), maxsize=0)
+    tmpdir.join('other.tmp').write('')
+
+    def missing(*args):
+        raise OSError('removed')
+    cache.set('key', [1])
+    assert os.listdir(str(tmpdir)) == ['other.tmp']
+    cache.maxsize = 1000
+    cache.set('key', [1])
+    monkeypatch.setattr(os, 'utime', missing)
+    assert cache.get('key') == [1]
+    monkeypatch.setattr(os, 'remove', missing)
+    cache.maxsize = 0
+    cache.evict()
+    monkeypatch.setattr(os, 'stat', missing)
+    cache.evict()
+    monkeypatch.undo()
+    assert sorted(os.listdir(str(tmpdir))) == ['key.pickle', 'other.tmp']
@@ -0,0 +1,50 @@
+import numpy
+import sympy
+from eqpy._compile import Kernel, kernels, newton_kernels
+from eqpy._utils import isnear
+
+x, y, a = sympy.symbols('x y a')
+
+
+def test_kernel():
+    f = Kernel([x + y, x * a, sympy.S(2)], [x, y, a])
+    assert isnear(f(1.0, 2.0, 3.0), [3.0, 3.0, 2.0])
+    res = f(numpy.arange(3.0), 1.0, numpy.ones((2, 1)))
+    assert res.shape == (3, 2, 3)
+    assert isnear(res[2].ravel(), [2.0] * 6)
+    assert f(1j, 0.0, 1.0).dtype == complex
+
+
+def test_jacobian():
+    exprs = [x**2 + y, a * y]
+    f, J = newton_kernels(exprs, [x, y], [x, y, a])
+    assert isnear(f(3.0, 1.0, 5.0), [10.0, 5.0])
+    assert J.shape == (2, 2)
+    assert len(J.kernel) == 3
+    assert isnear(J(3.0, 1.0, 5.0).ravel(), [6.0, 1.0, 0.0, 5.0])
+    batch = J(numpy.array([1.0, 2.0]), 1.0, 5.0)
+    assert batch.shape == (2, 2, 2)
+    assert isnear(batch[1].ravel(), [4.0, 1.0, 0.0, 5.0])
+
+
+def test_kernel_assignments():
+    d0, d1 = sympy.Dummy('0'), sympy.Dummy('1')
+    f = Kernel([d1, x + d1], [x, a], [(d0, 2 * x), (d1, d0 + a)])
+    assert isnear(f(1.0, 3.0), [5.0, 6.0])
+    assert isnear(f(numpy.array([0.0, 1.0]), 3.0)[1], [3.0, 6.0])
+
+
+def test_cse():
+    common = sympy.exp(x * y) + sympy.sin(x * y)
+    exprs = [common * a, common + a, y]
+    f, g = kernels([exprs, [common]], [x, y, a], cse=True)
+    assert f.assignments
+    before, after = f.count_ops()
+    assert after < before
+    value = numpy.e + numpy.sin(1.0)
+    assert isnear(f(0.5, 2.0, 3.0), [3 * value, value + 3, 2.0])
+    assert isnear(g(0.5, 2.0, 3.0), [value])
+    f, J = newton_kernels(exprs, [x, y], [x, y, a], cse=True)
+    plain = newton_kernels(exprs, [x, y], [x, y, a])[1]
+    assert isnear(J(0.5, 2.0, 3.0).ravel(), plain(0.5, 2.0, 3.0).ravel())
+    assert J.kernel.count_ops()[1] < J.kernel.count_ops()[0]
@@ -0,0 +1,93 @@
+import sympy
+from eqpy._intervals import (EVERYTHING, Interval, assumptions, constraint,
+                             div, integer_power, log, mul, outward, power,
+                             propagate, real_power, signed_root, signs)
+from eqpy._utils import isnear, raises
+
+inf = float('inf')
+x, y, z = sympy.symbols('x y z')
+
+
+def test_arithmetic():
+    assert isnear(mul(Interval(0, 0), EVERYTHING), (0, 0))
+    assert mul(Interval(-1, 2), Interval(3, inf)) == (-inf, inf)
+    assert div(Interval(1, 2), Interval(-1, 1)) == EVERYTHING
+    assert isnear(div(Interval(1, 2), Interval(2, 4)), (0.25, 1))
+    assert isnear(integer_power(Interval(-2, 1), 2), (0, 4))
+    assert isnear(integer_power(Interval(-2, 1), 3), (-8, 1))
+    assert isnear(integer_power(Interval(1, 2), -1), (0.5, 1))
+    assert Interval(0, inf).choose() == 1.0
+    assert Interval(2, inf).choose() == 4.0
+    assert Interval(-3, -1).choose() == -2.0
+    assert Interval(-inf, -3).choose() == -6.0
+    assert outward(inf - inf, inf - inf) == EVERYTHING
+    assert power(10.0, 1000) == inf and power(-10.0, 1001) == -inf
+    assert power(0.0, -1) == inf
+    assert isnear(integer_power(Interval(-3, -1), 2), (1, 9))
+    assert real_power(Interval(-2, -1), 0.5).isempty()
+    assert isnear(real_power(Interval(1, 4), -0.5), (0.5, 1))
+    assert isnear(signed_root(-8.0, 3), -2.0)
+    assert log(Interval(-2, -1)).isempty()
+
+
+def test_constraint():
+    assert constraint(x > y) == (x - y, (0, inf))
+    assert constraint(x <= 1) == (x - 1, (-inf, 0))
+    assert constraint(sympy.Eq(x, 2)) == (x - 2, (0, 0))
+    assert constraint(sympy.Ne(x, 2)) is None
+
+
+def test_propagate():
+    domains = {x: Interval(0, inf)}
+    assert propagate([(x**2 + y - 4, Interval(0, 0)),
+                      (y - 3, Interval(0, inf))], domains)
+    assert isnear(domains[y], (3, 4))
+    assert isnear(domains[x], (0, 1))
+    domains = {}
+    assert propagate([(x - 2*y, Interval(0, 0)), (x + y - 3, Interval(0, 0)),
+                      (y, Interval(0, inf))], domains)
+    assert isnear(domains[x], (2, 2)) and isnear(domains[y], (1, 1))
+    # converges onto the root without rounding errors excluding it
+    domains = {y: Interval(0, inf)}
+    assert propagate([(x - y**2, Interval(0, 0)),
+                      (x + y - 4, Interval(0, 0))], domains)
+    assert domains[y].lo <= (17**0.5 - 1) / 2 <= domains[y].hi
+    assert domains[y].hi - domains[y].lo < 1e-12
+    domains = {z: Interval(1, 2)}
+    assert not propagate([(sympy.exp(x) + z, Interval(0, 0))], domains)
+    assert not propagate([(sympy.sqrt(x) + 1, Interval(0, 0))], {})
+
+
+def test_propagate_functions():
+    def solved(expr, domains):
+        assert propagate([(expr, Interval(0, 0))], domains)
+        return domains[x]
+    assert isnear(solved(x**3 - 8, {}), (2, 2))
+    assert isnear(solved(x**2 - 4, {x: Interval(-inf, 0)}), (-2, -2))
+    assert isnear(solved(x**sympy.Rational(3, 2) - 8, {x: Interval(0, inf)}),
+                  (4, 4))
+    assert isnear(solved(sympy.exp(x) - 1, {x: Interval(-10, 10)}), (0, 0))
+    assert isnear(solved(sympy.log(x), {}), (1, 1))
+    assert isnear(solved(x**2 - 4, {}), (-2, 2))
+    # shared subexpressions are evaluated once
+    assert isnear(solved((x + 1)**2 + (x + 1) - 2, {x: Interval(0, 2)}),
+                  (0, 0))
+    # functions without interval rules bound nothing
+    domains = {}
+    assert propagate([(sympy.sin(x) - y, Interval(0, 0))], domains)
+    assert x not in domains
+    # tiny narrowings do not revise the other constraints again
+    domains = {x: Interval(0, 1 + 1e-9)}
+    assert propagate([(x - y, Interval(0, 0)), (y, Interval(0, 1))], domains)
+
+
+def test_assumptions():
+    assert assumptions(Interval(1, 2)) == {'positive': True}
+    assert assumptions(Interval(0, 2)) == {'nonnegative': True}
+    assert assumptions(Interval(-2, -1)) == {'negative': True}
+    assert assumptions(Interval(-2, 0)) == {'nonpositive': True}
+    assert assumptions(Interval(-1, 1)) == {'real': True}
+    assert signs('negative', [x]) == [x < 0]
+    assert raises(ValueError, lambda: signs('even', [x]))
+    assert Interval(0, 1).contains(1 + 1e-12, 1e-9)
+    assert not Interval(0, 1).contains(2, 1e-9)
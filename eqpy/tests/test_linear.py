@@ -0,0 +1,112 @@
+import numpy
+import sympy
+from fractions import Fraction
+from eqpy._exact import affine, bareiss, exact_solve
+from eqpy._linear import LinearSolver, RowSolver, sparse_solve
+from eqpy._storage import LinearBlock, LinearRow
+from eqpy._utils import isnear, raises
+
+x, y, z, a = sympy.symbols('x y z a')
+
+
+def test_affine():
+    rows, cols, coeffs, constants = affine(
+        [2*x + a*y - 3, a*(x + 1) - z/a, sympy.sin(a) * y], [x, y, z])
+    assert rows == [0, 0, 1, 1, 2]
+    assert cols == [0, 1, 0, 2, 1]
+    assert coeffs == [2, a, a, -1/a, sympy.sin(a)]
+    assert constants == [-3, a, 0]
+    assert affine([x*y], [x, y]) is None
+    assert affine([x**2 + y], [x, y]) is None
+    assert affine([sympy.sin(x)], [x]) is None
+    assert affine([(x + 1)*(y + 1)], [x, y]) is None
+    assert affine([(x + 1)*(a + 1)], [x, y]) is not None
+    # equations are lhs - rhs, and sums are not expanded
+    rows, cols, coeffs, constants = affine(
+        [sympy.Eq(x, (y + a*z + a) / (2 + a))], [x, y, z])
+    assert coeffs == [1, -1/(2 + a), -a/(2 + a)]
+    assert constants == [-a/(2 + a)]
+
+
+def test_linear_solver():
+    eqs = [sympy.Eq(x, y + a), sympy.Eq(y, 2*x - z), sympy.Eq(z, x + y + 1)]
+    exprs = [eq.lhs - eq.rhs for eq in eqs]
+    solver = LinearSolver(eqs, [x, y, z], [a], affine(exprs, [x, y, z]))
+    sol, converged, iterations = solver.solve(None, [2.0])
+    assert converged
+    assert isnear(sol, numpy.linalg.solve([[1, -1, 0], [-2, 1, 1],
+                                           [-1, -1, 1]], [2.0, 0.0, 1.0]))
+    sols, converged, iterations = solver.solve_batch(None, [[2.0, 3.0]])
+    assert converged.all()
+    assert isnear(sols[0], sol)
+    singular = LinearSolver(eqs[:2], [x, y], [a, z],
+                            affine([x - y, 2*x - 2*y], [x, y]))
+    assert not singular.solve(None, [1.0, 1.0])[1]
+    assert not singular.solve_batch(None, [[1.0, 2.0], 1.0])[1].any()
+    assert solver.count_ops() == (0, 0)
+    assert raises(ValueError, lambda: solver.solve_batch(None, [[[2.0]]]))
+    assert raises(ValueError, lambda: LinearSolver(
+        eqs, [x, y], [a, z], affine(exprs[:2], [x, y])))
+
+
+def test_row_solver():
+    b = sympy.Symbol('b')
+    # names given by the parameters determine the symbols of the block
+    block = LinearBlock(0, 1, [[1.0, 1.0], [1.0, -1.0]], [x, y], [0.0, 0.0])
+    rows = [LinearRow(block, 0, a), LinearRow(block, 1, b)]
+    solver = RowSolver(rows, [x, y], [a, b])
+    sol, converged, iterations = solver.solve(None, [3.0, 1.0])
+    assert converged and isnear(sol, [2.0, 1.0])
+    assert solver.count_ops() == (0, 0)
+    assert raises(ValueError, lambda: RowSolver(rows, [x], [a, b]))
+
+
+def test_sparse_solve(monkeypatch):
+    import eqpy._linear
+    numpy.random.seed(0)
+    n = 200
+    matrix = numpy.random.rand(n, n) * (numpy.random.rand(n, n) < 0.03)
+    matrix = matrix[numpy.random.permutation(n)] + 0.01 * numpy.eye(n)
+    rows, cols = numpy.nonzero(matrix)
+    rhs = numpy.random.rand(n)
+    sol = sparse_solve(n, rows, cols, matrix[rows, cols], rhs)
+    assert isnear(sol, numpy.linalg.solve(matrix, rhs))
+    column = numpy.array([0, 0])
+    sol = sparse_solve(2, numpy.array([0, 1]), column,
+                       numpy.array([1.0, 2.0]), numpy.ones(2))
+    assert numpy.isnan(sol).all()
+    # large systems without SciPy do not allocate dense matrices
+    monkeypatch.setattr(eqpy._linear, 'scipy', None)
+    monkeypatch.setattr(eqpy._linear, 'DENSE', 4)
+    eqs = [sympy.Eq(x, y + a), sympy.Eq(y, 2*x - z), sympy.Eq(z, x + y + 1)]
+    exprs = [eq.lhs - eq.rhs for eq in eqs]
+    solver = LinearSolver(eqs, [x, y, z], [a], affine(exprs, [x, y, z]))
+    sol, converged, iterations = solver.solve(None, [2.0])
+    assert converged
+    assert isnear(sol, numpy.linalg.solve([[1, -1, 0], [-2, 1, 1],
+                                           [-1, -1, 1]], [2.0, 0.0, 1.0]))
+
+
+def test_bareiss():
+    assert bareiss([[2, 1, 3], [1, 3, 4]]) == [1, 1]
+    assert bareiss([[0, 2, 1], [3, 0, 1]]) == [Fraction(1, 3), Fraction(1, 2)]
+    assert bareiss([[1, 2, 3], [2, 4, 5]]) is None
+    numpy.random.seed(0)
+    matrix = numpy.random.randint(-9, 10, size=(12, 13))
+    expected = sympy.Matrix(matrix[:, :-1]).LUsolve(
+        sympy.Matrix(matrix[:, -1]))
+    result = bareiss([[int(val) for val in row] for row in matrix])
+    assert [sympy.Rational(val.numerator, val.denominator)
+            for val in result] == list(expected)
+
+
+def test_exact_solve():
+    eqs = [sympy.Eq(x, y / 3 + 1), sympy.Eq(y, 2*x - z),
+           sympy.Eq(z, sympy.Rational(1, 7))]
+    assert exact_solve(eqs, [x, y, z]) == sympy.solve(eqs, [x, y, z])
+    assert exact_solve(eqs, [x, y]) is None
+    assert exact_solve([sympy.Eq(x, a*y), sympy.Eq(y, 1)], [x, y]) is None
+    assert exact_solve([sympy.Eq(x, 0.5*y), sympy.Eq(y, 1)], [x, y]) is None
+    assert exact_solve([sympy.Eq(x, y**2), sympy.Eq(y, 1)], [x, y]) is None
+    assert exact_solve([sympy.Eq(x, y), sympy.Eq(2*x, 2*y)], [x, y]) is None
+    assert exact_solve([sympy.Eq(x, 1), sympy.Eq(x, 2)], [x, y]) is None
@@ -0,0 +1,42 @@
+import numpy
+import sympy
+from eqpy._numeric import ExplicitSolver, NewtonSolver
+from eqpy._utils import isnear, raises
+
+x, y, a = sympy.symbols('x y a')
+
+
+def test_newton_solver():
+    solver = NewtonSolver([sympy.Eq(x**3, a)], [x], [a])
+    sol, converged, iterations = solver.solve([1.0], [2.0])
+    assert converged and isnear(sol, [2.0**(1.0 / 3)])
+    sols, converged, iterations = solver.solve_batch([1.0], [[2.0, 8.0]])
+    assert converged.all() and isnear(sols[:, 0], [2.0**(1.0 / 3), 2.0])
+    assert raises(ValueError, lambda: solver.solve_batch([1.0], [[[2.0]]]))
+    assert raises(ValueError, lambda: NewtonSolver([sympy.Eq(x, a)], [x, y]))
+    # a singular Jacobian takes a least-squares step
+    solver = NewtonSolver([sympy.Eq(x**2, 1)], [x])
+    sols, converged, iterations = solver.solve_batch([[0.0, 2.0]])
+    assert not converged[0] and converged[1] and isnear(sols[1], [1.0])
+
+
+def test_refine():
+    solver = NewtonSolver([sympy.Eq(x**3, a)], [x], [a])
+    sol, converged, iterations = solver.refine([1.0], [2.0], tol=1e-30)
+    assert converged and isnear(sol, [2.0**(1.0 / 3)])
+    # the precision limits the digits, and maxiter the iterations
+    sol, converged, iterations = solver.refine([5.0], [2.0], precision=16)
+    assert converged and isnear(sol, [2.0**(1.0 / 3)])
+    sol, converged, iterations = solver.refine([5.0], [2.0], maxiter=1)
+    assert not converged and iterations == 1
+    # singular Jacobians
+    solver = NewtonSolver([sympy.Eq(x**2, 1)], [x])
+    assert not solver.refine([0.0])[1]
+    assert not solver.refine([numpy.nan])[1]
+
+
+def test_explicit_solver():
+    solver = ExplicitSolver([sympy.Eq(x, 2 * a), sympy.Eq(y, x + 1)])
+    sols, converged, iterations = solver.solve_batch([], [[1.0, 2.0]])
+    assert converged.all() and isnear(sols, [[2.0, 3.0], [4.0, 5.0]])
+    assert raises(ValueError, lambda: solver.solve_batch([], [[[2.0]]]))
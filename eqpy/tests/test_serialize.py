@@ -0,0 +1,109 @@
+import numpy
+import sympy
+from eqpy._serialize import Graph, Writer, compact
+from eqpy._storage import Linear, Stored
+from eqpy._systems import System, load
+from eqpy._utils import isnear, raises
+
+
+def test_compact():
+    assert compact([1, -2]).dtype == numpy.int8
+    assert compact([300]).dtype == numpy.int16
+    assert compact([2**40]).dtype == numpy.int64
+    assert compact([]).dtype == numpy.int8
+
+
+def test_graph():
+    x, y = sympy.symbols('x y')
+    d = sympy.Dummy('x', positive=True)
+    f = sympy.Function('f')
+    exprs = [x + 2*y + sympy.sin(x + 2*y),
+             sympy.Eq(d, x**sympy.Rational(1, 3)),
+             f(x) + sympy.pi + 2**70 + sympy.Float('0.1', 30) + 1.5,
+             sympy.Piecewise((x, x > 0), (y, True)), sympy.true,
+             2**70 * x, sympy.Interval(0, x)]
+    writer = Writer()
+    roots = [writer.add(expr) for expr in exprs]
+    # x + 2*y is stored once
+    assert len(writer.head) < sum(len(list(sympy.preorder_traversal(expr)))
+                                  for expr in exprs)
+    arrays = writer.arrays()
+    graph = Graph(writer.heads, arrays['head'], arrays['data'],
+                  arrays['nargs'], arrays['indices'], arrays['floats'],
+                  writer.texts, writer.symbols)
+    assert [graph.build(root) for root in roots] == exprs
+    assert graph.build(roots[1]).lhs is d
+
+
+def test_save_load(tmpdir):
+    path = str(tmpdir.join('system.eqpy'))
+    A = System(prefix='p_')
+    for i in range(10):
+        A[i] = A[i + 1] * A.r / 2 + sympy.Rational(1, 3)
+    A[10] = A.x**2
+    A.x = 1.5
+    A.y = sympy.Eq(A.x + A.z, 3)
+    A[20:23] = Linear(numpy.eye(3) / 2, A[20:23], 1.0)
+    A(A.r > 0)
+    A['note'] = 'kept'
+    A[...].save(path)
+    B = load(path)
+    assert B[3] is B[3]
+    assert str(B[3]) == str(A[3])
+    assert B['note'] == 'kept'
+    assert B[...].assumptions == set([B.r > 0])
+    assert isinstance(B[...].equations.entries[B[3]], Stored)
+    assert [str(eq) for eqs in B[...].equations.values() for eq in eqs] == \
+        [str(eq) for eqs in A[...].equations.values() for eq in eqs]
+    assert B[...].users[B.r] == set(B[i] for i in range(10))
+    expected = A[...].nsolve({A.r: 0.5})
+    sol = B[...].nsolve({B.r: 0.5})
+    assert isnear(sol[B[0]], expected[A[0]])
+    assert isnear(sol[B[21]], 2.0)
+    # loaded systems can be changed and saved again
+    B[10] = 4
+    B[...].save(path)
+    C = load(path)
+    assert isnear(C[...].nsolve({C.r: 1.0})[C[9]], 7 / 3.0)
+    tmpdir.join('other').write('not a system')
+    assert raises(ValueError, lambda: load(str(tmpdir.join('other'))))
+
+
+def test_lazy_load(tmpdir):
+    path = str(tmpdir.join('system.eqpy'))
+    A = System()
+    A[1:50] = lambda i: A[i - 1] / 2 + A.x
+    A[50:52] = Linear(numpy.eye(2) / 2, A[50:52], 1.0)
+    A.y = sympy.Symbol('q')
+    A[...].save(path)
+    B = load(path)
+    base = B[...]
+    table = base.symbols.base.value.__self__
+    # nothing is created until it is used
+    assert table.created.count(None) == len(table)
+    assert base.users.get(sympy.Symbol('x')) is not None
+    assert sympy.Symbol('x') in table.positions
+    assert sympy.Symbol('q') not in base.symbolnames
+    assert raises(KeyError, lambda: base.symbols['z'])
+    assert sympy.Dummy('x') not in base.users
+    assert sympy.Symbol('x', positive=True) not in base.users
+    assert sympy.Symbol('x') + 1 not in base.equations
+    assert 'z' not in base.symbols
+    assert len(base.users[B.x]) == 49
+    assert table.created.count(None) > len(table) - 60
+    assert len(base.equations) == 52
+    assert len(base.symbols) == 54
+    assert base.symbolnames[B[3]] == 3
+    assert B.x not in base.equations
+    assert base.symbolnames[B.x] == 'x'
+    assert set(base.references[B[3]]) == set([B[3], B.x, B[2]])
+    assert base.equations.entries[B[50]] is base.equations.entries[B[51]]
+    assert sorted(base.symbols, key=str) == sorted(A[...].symbols, key=str)
+    # changes stay in the system and forks see the loaded entries
+    B[3] = 1
+    assert B[2] not in base.references[B[3]]
+    assert B[3] not in base.users[B[2]]
+    C = base.fork()
+    assert C[...].users[C.x] == base.users[B.x]
+    sol = C[...].nsolve({C[0]: 0, C.x: 1, sympy.Symbol('q'): 2})
+    assert isnear(sol[C[4]], 1.5)
@@ -0,0 +1,105 @@
+import numpy
+import sympy
+from eqpy._storage import (Equations, LinearBlock, LinearRow, Overlay,
+                           SymbolRange, Template, build, equality, expand,
+                           involved, share)
+from eqpy._utils import raises
+
+x, y = sympy.symbols('x y')
+
+
+def test_equality():
+    assert equality(x, 2*y) == sympy.Eq(x, 2*y)
+    assert equality(x, x) is sympy.true
+    assert equality(x, x + 1) is sympy.false
+    assert equality(x + 1, x) is sympy.false
+    assert equality(sympy.S(1), 2) is sympy.false
+    assert isinstance(equality(x, x*y), sympy.Equality)
+
+
+def test_build():
+    assert build(x, y) == [sympy.Eq(x, y)]
+    assert build(x, sympy.Eq(y, 1)) == [sympy.Eq(x, y), sympy.Eq(x, 1)]
+    assert build(x, [y, 2]) == [sympy.Eq(x, y), sympy.Eq(x, 2)]
+    assert involved(x, sympy.Eq(y, 1)) == set([x, y])
+    assert involved(x, [x, x + 1]) == set()
+
+
+def test_equations():
+    a, b, c = sympy.symbols('a b c')
+    keys = {a: 1, b: 2, c: 3}
+    eqs = Equations(keys.__getitem__)
+    eqs.define(a, y + 1)
+    eqs.define(b, Template(lambda i: i * y))
+    eqs.define(c, sympy.Eq(y, 3))
+    assert eqs.entries[a] == y + 1
+    assert eqs[a] == [sympy.Eq(a, y + 1)]
+    assert eqs[b] == [sympy.Eq(b, 2*y)]
+    assert eqs[c] == [sympy.Eq(c, y), sympy.Eq(c, 3)]
+    assert list(eqs) == [a, b, c]
+    assert list(eqs.values()) == [eqs[a], eqs[b], eqs[c]]
+    eqs[a] = [sympy.Eq(a, 1)]
+    assert eqs.get(a) == [sympy.Eq(a, 1)]
+    assert eqs.get(x) is None
+    assert eqs.pop(b) == [sympy.Eq(b, 2*y)]
+    assert b not in eqs and len(eqs) == 2
+    assert eqs.pop(b, None) is None
+    assert raises(KeyError, lambda: eqs.pop(b))
+    assert list(eqs.keys()) == [a, c]
+    assert list(eqs.items()) == [(a, eqs[a]), (c, eqs[c])]
+
+
+def test_linear_block():
+    a, b = sympy.symbols('a b')
+    block = LinearBlock(4, 2, [[1.0, 0.0], [0.5, -2.0]], [x, y], [3.0, 0.0])
+    assert len(block) == 2 and block.row(6) == 1
+    assert block.columns(0).tolist() == [0]
+    assert block.expr(0) == 1.0*x + 3.0
+    assert block.expr(1).subs({x: 4, y: 1}) == 0
+    row = LinearRow(block, 1, b)
+    assert row == LinearRow(block, 1, b) and row != LinearRow(block, 0, a)
+    assert row.free_symbols == frozenset([x, y, b])
+    assert expand(row) == sympy.Eq(b, block.expr(1))
+    eqs = Equations({a: 4, b: 6}.__getitem__)
+    eqs.define(a, block)
+    eqs.define(b, block)
+    assert eqs[b] == [expand(row)]
+    assert list(eqs.rows()) == [[LinearRow(block, 0, a)], [row]]
+    assert LinearBlock(0, 1, numpy.ones(3, int), x, 0).expr(2) == x
+    assert raises(ValueError, lambda: LinearBlock(0, 1, [[1.0]], [x, y], 0))
+    assert raises(ValueError, lambda: LinearBlock(0, 1, [1.0], [x, y], 0))
+
+
+def test_symbol_range():
+    assert repr(SymbolRange(None, 0, 5, 2)) == 'SymbolRange(0, 6, 2)'
+    assert len(SymbolRange(None, 5, 0, -2)) == 3
+    assert raises(ValueError, lambda: SymbolRange(None, 0, 5, 0))
+
+
+def test_overlay():
+    base = {'a': 1, 'b': 2, 'c': 3}
+    first, second = share(base)
+    first['b'] = 20
+    first['d'] = 4
+    del first['a']
+    assert dict(first) == {'b': 20, 'c': 3, 'd': 4}
+    assert list(first) == ['b', 'c', 'd'] and len(first) == 3
+    assert 'a' not in first and first.get('a') is None
+    assert dict(second) == base == {'a': 1, 'b': 2, 'c': 3}
+    assert raises(KeyError, lambda: first['a'])
+
+    def remove():
+        del first['a']
+    assert raises(KeyError, remove)
+    first['a'] = 0
+    assert list(first) == ['a', 'b', 'c', 'd']
+    # unchanged overlays share their base, changed ones are flattened
+    assert share(second)[0].base is base
+    assert share(first)[0].base == {'a': 0, 'b': 20, 'c': 3, 'd': 4}
+    sets = Overlay({'a': set([1])}, set)
+    sets['a'].add(2)
+    sets.setdefault('b', set()).add(3)
+    assert sets.base == {'a': set([1])}
+    assert dict(sets) == {'a': set([1, 2]), 'b': set([3])}
+    sets.clear()
+    assert len(sets) == 0 and 'a' not in sets
@@ -0,0 +1,50 @@
+from eqpy._structure import components, decompose, match, partition, tarjan
+from eqpy._utils import raises
+
+
+def test_match():
+    # greedy matching takes column 0 for row 0, so row 1 needs to augment
+    assert match([[0, 1], [0], [1, 2]], 3) == [1, 0, 2]
+    assert match([[0, 1, 2], [0], [0, 1]], 3) == [2, 0, 1]
+    assert match([[0], [0], [1]], 3) == [0, None, 1]
+    # long chain that requires a deep augmenting path
+    n = 5000
+    incidence = [[i, i + 1] for i in range(n - 1)] + [[0]]
+    colof = match(incidence, n)
+    assert sorted(colof) == list(range(n))
+    assert all(col in incidence[row] for row, col in enumerate(colof))
+
+
+def test_tarjan():
+    graph = [[1], [2], [0], [2, 4, 5], [], [3]]
+    components = tarjan(graph)
+    assert components == [[0, 1, 2], [4], [3, 5]]
+    n = 5000
+    assert tarjan([[i + 1] for i in range(n - 1)] + [[]])[0] == [n - 1]
+    assert tarjan([[i + 1] for i in range(n - 1)] + [[0]]) == [list(range(n))]
+
+
+def test_decompose():
+    # x0 = f(x1), x1 = g(x0), x2 = h(x1, x3), x3 = k()
+    incidence = [[0, 1], [0, 1], [1, 2, 3], [3]]
+    blocks = decompose(incidence, 4)
+    assert blocks == [([0, 1], [0, 1]), ([3], [3]), ([2], [2])] or \
+        blocks == [([0, 1], [1, 0]), ([3], [3]), ([2], [2])]
+    assert raises(ValueError, lambda: decompose([[0], [0]], 2))
+    assert raises(ValueError, lambda: decompose([[0]], 2))
+
+
+def test_components():
+    incidence = [[0, 1], [2], [1], [3, 2], [], [4]]
+    assert components(incidence, 5) == [[0, 2], [1, 3], [5], [4]]
+    assert components([[i, i + 1] for i in range(99)], 100) == \
+        [list(range(99))]
+
+
+def test_partition():
+    groups = [[0, 1, 2], [3], [4, 5], [6], [7]]
+    bins = partition(groups, 2)
+    assert len(bins) == 2
+    assert sorted(sum(bins, [])) == list(range(8))
+    assert sorted(len(b) for b in bins) == [4, 4]
+    assert len(partition(groups, 10)) == 5
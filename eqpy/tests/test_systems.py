@@ -1,6 +1,10 @@
+import itertools
+import time
+import numpy
 import sympy
+from eqpy._storage import Linear
 from eqpy._systems import BaseSystem, System
-from eqpy._utils import raises
+from eqpy._utils import isnear, raises
 
 
 def test_symbol_types():
@@ -44,6 +48,12 @@ def test_prefix():
     assert str(D[2]) == '_D_2'
     assert raises(ValueError, lambda: System(prefix='A_', prefix_include=['x'],
                                              prefix_exclude=['y']))
+    # any container lists the names
+    E = System(prefix='E_', prefix_include=('x', 1))
+    E[0:3] = [1, 2, 3]
+    assert [str(sym) for sym in E[0:3]] == ['_0', '_E_1', '_2']
+    F = System(suffix='_F', suffix_exclude=set([2]))
+    assert [str(sym) for sym in F[1:3]] == ['_1_F', '_2']
 
 
 def test_suffix():
@@ -81,6 +91,14 @@ def test_slice_get():
     assert z2 is y2
     z2, z1 = A[2:0:-1]
     assert z2 is y2
+    # slices behave like the tuples of their symbols
+    assert A[0:2] == (x0, x1) and A[0:2] == [x0, x1] and A[0:2] == A[:2]
+    assert A[0:2] != (x0,) and A[0:2] != A[1:3] and A[0:2] != 'x'
+    assert not A[0:2] != (x0, x1)
+    assert hash(A[0:2]) == hash((x0, x1))
+    assert A[0:2] + A[2:3] == (x0, x1, y2) == (x0,) + A[1:3]
+    assert raises(TypeError, lambda: A[0:2] + [y2])
+    assert raises(TypeError, lambda: [x0] + A[1:3])
     assert raises(ValueError, lambda: A[0::2])
     assert raises(ValueError, lambda: A[::2])
     assert raises(ValueError, lambda: A[0::])
@@ -106,6 +124,22 @@ def test_equations():
     assert A[A[1]] == [sympy.Eq(A[1], 20*A.x)]
 
 
+def test_slice_view():
+    A = System(prefix='p', suffix='s', suffix_exclude=[3])
+    view = A[0:1000000]
+    assert len(view) == 1000000 and not A[...].symbols
+    assert view[5] is A[5]
+    assert view[-1] is A[999999]
+    assert raises(IndexError, lambda: view[1000000])
+    sub = view[2:8:2]
+    assert list(sub) == [A[2], A[4], A[6]]
+    assert list(view[7:1:-3]) == [A[7], A[4]]
+    assert [sym.name for sym in A[2:5]] == ['p2s', 'p3', 'p4s']
+    assert len(A[...].symbols) == 7
+    array = numpy.arange(3) * numpy.asarray(A[0:3])
+    assert list(array) == [0, A[1], 2*A[2]]
+
+
 def test_equations_slice():
     A = System()
     A[0:3] = (2*A.x, 3*A.y, 4*A.z)
@@ -180,6 +214,862 @@ def test_contains():
     assert 'three' not in A
 
 
+def test_template():
+    A = System()
+    n = 1000
+    A[1:n] = lambda i: A[i - 1] / 2 + i
+    assert A[...].equations[A[3]] == [sympy.Eq(A[3], A[2] / 2 + 3)]
+    assert A[...].uses(A[5]) == frozenset([A[5], A[6]])
+    assert len(list(A)) == n - 1
+    solution = A[...].nsolve({A[0]: 0})
+    assert isnear(solution[A[2]], 2.5)
+    A[2] = 7
+    assert A[...].equations[A[2]] == [sympy.Eq(A[2], 7)]
+    assert isnear(A[...].nsolve({A[0]: 0})[A[3]], 6.5)
+    # redefined names drop their solvers, and new names are indexed
+    # like the equations they give
+    A[2:4] = lambda i: A[i - 1] + 1
+    assert isnear(A[...].nsolve({A[0]: 0})[A[3]], 3.0)
+    A[2:4] = lambda i: A[i - 1] - 1
+    assert isnear(A[...].nsolve({A[0]: 0})[A[3]], -1.0)
+    A[n:n + 3] = lambda i: [A[i], A[i] + 1, sympy.Eq(A.y, A.z)][i - n]
+    for i in range(n, n + 3):
+        assert set(A[...].references[A[i]]) == set().union(
+            *(eq.free_symbols for eq in A[...].equations[A[i]]))
+
+
 def test_assumptions():
+    from concurrent.futures import ThreadPoolExecutor
+    A = System()
+    A(A.x > 0)
+    A.y = A.x**2
+    assert A[...].assumptions == set([A.x > 0])
+    assert A[...].bounds() == {A.x: (0, float('inf')),
+                               A.y: (0, float('inf'))}
+    assert A[...].solve({A.y: 4}) == [{A.x: 2}]
+    assert A[...].solve({A.y: -4}) == []
+    assert isnear(A[...].nsolve({A.y: 4}, {A.x: 3.0})[A.x], 2.0)
+    assert raises(ValueError, lambda: A[...].nsolve({A.y: 4}, {A.x: -3.0}))
+    # parallel and batched solves respect the assumptions too
+    with ThreadPoolExecutor(2) as executor:
+        assert raises(ValueError, lambda: A[...].nsolve(
+            {A.y: 4}, {A.x: -3.0}, executor=executor))
+        assert isnear(A[...].nsolve({A.y: 4}, executor=executor)[A.x], 2.0)
+    y = numpy.array([1.0, 4.0, 9.0])
+    sol, converged = A[...].nsolve_batch({A.y: y})
+    assert converged.all() and isnear(sol['x'], [1.0, 2.0, 3.0])
+    sol, converged = A[...].nsolve_batch({A.y: y}, {A.x: -3.0})
+    assert not converged.any()
+    A(A.x < 10, nonpositive=['z'])
+    assert isnear(A[...].bounds({A.z: -1})[A.y], (0, 100))
+    assert raises(ValueError, lambda: A[...].bounds({A.z: 1}))
+    assert raises(ValueError, lambda: A(bogus='x'))
+    assert raises(ValueError, lambda: A(A.x + 1))
+    assert raises(ValueError, lambda: A(sympy.false))
+    A((A.z > -5) & (A.w < 5))
+    assert isnear(A[...].bounds({A.z: A.w})[A.y], (0, 100))
+    assert not A[...].admissible({A.x: sympy.I})
+    assert not A[...].admissible({A.x: sympy.nan})
+
+    B = System()
+    B(B.y > 0)
+    B.x = B.y**2
+    B.y = 4 - B.x
+    y = (sympy.sqrt(17) - 1) / 2
+    assert B[...].solve() == [{B.x: 4 - y, B.y: y}]
+    bounds = B[...].bounds()
+    assert bounds[B.y].lo <= float(y) <= bounds[B.y].hi
+    assert isnear(B[...].nsolve()[B.y], float(y))
+
+    C = System()
+    C(C.x > 2)
+    C.y = sympy.log(C.x - 2)
+    assert isnear(C[...].nsolve({C.y: 0.5})[C.x], 2 + numpy.exp(0.5))
+    C(C.y < 0)
+    assert C[...].solve({C.y: 1}) == []
+
+    # assumptions do not restrict the symbols they are not connected to
+    E = System()
+    E.y = E.x**2 + 1
+    solutions = E[...].solve({E.y: -3})
+    assert len(solutions) == 2
+    E(E.z > 0)
+    assert E[...].solve({E.y: -3}) == solutions
+    assert E[...].constrained() == set()
+    E.w = E.z + E.y
+    assert E[...].constrained() == set([E.w, E.y])
+    assert E[...].constrained({E.y: -3}) == set([E.w])
+    assert isnear(E[...].bounds({E.y: -3, E.w: 1})[E.z], (4, 4))
+
+    # relations without interval bounds are checked on the solutions
+    D = System()
+    D(sympy.sin(D.x) > 0)
+    D.y = D.x**2
+    assert isnear(D[...].nsolve({D.y: 16}, {D.x: -3.0})[D.x], -4.0)
+    assert raises(ValueError, lambda: D[...].nsolve({D.y: 16}, {D.x: 3.0}))
+    with ThreadPoolExecutor(2) as executor:
+        assert raises(ValueError, lambda: D[...].nsolve(
+            {D.y: 16}, {D.x: 3.0}, executor=executor))
+        # relations across components are checked on the whole solution
+        D(sympy.sin(D.x + D.z) > 0)
+        D.w = D.z**2
+        values = {D.y: 16, D.w: 1}
+        assert raises(ValueError, lambda: D[...].nsolve(
+            values, {D.x: -4.0, D.z: 1.0}, executor=executor))
+        solution = D[...].nsolve(values, {D.x: -4.0, D.z: -1.0},
+                                 executor=executor)
+        assert isnear(solution[D.x], -4.0) and isnear(solution[D.z], -1.0)
+
+
+def test_compile():
+    A = System()
+    A.x = 2*A.y + A.z
+    A[1] = A.x * A.y
+    A[2] = 3
+    f = A[...].compile()
+    assert f.symbols == (A[1], A[2], A.x, A.y, A.z)
+    assert len(f) == 3
+    res = f(1.0, 3.0, 5.0, 2.0, 1.0)
+    assert res.shape == (3,)
+    assert isnear(res, [0.0, -9.0, 0.0])
+
+    y = numpy.linspace(0, 1, 5)
+    res = f(0.0, 3.0, 1.0, y, 1.0)
+    assert res.shape == (3, 5)
+    assert isnear(res[0], 1.0 - 2*y - 1.0)
+    assert isnear(res[1], -y)
+    assert isnear(res[2], [0.0] * 5)
+
+    g = A[...].compile([A.y, A.x, A.z, A[1], A[2]])
+    assert isnear(g(2.0, 5.0, 1.0, 1.0, 3.0), [0.0, -9.0, 0.0])
+    assert raises(TypeError, lambda: g(1.0))
+
+    # an equality gives a true equation, which constrains nothing
+    B = System()
+    B.x = sympy.Eq(B.x, 2*B.y)
+    assert len(B[...].compile()) == 1
+    B.y = 3
+    assert len(B[...].blocks()) == 2
+    assert B[...].nsolve() == {B.x: 6.0, B.y: 3.0}
+    B.z = B.z + 1
+    assert raises(ValueError, lambda: B[...].compile())
+    assert raises(ValueError, lambda: B[...].nsolve())
+
+
+def test_nsolve():
+    A = System()
+    A.x = 2*A.y
+    A.y = A.y**2 + A.y - 4
+    sol = A[...].nsolve()
+    assert isnear(sol[A.x], 4.0)
+    assert isnear(sol[A.y], 2.0)
+    sol = A[...].nsolve(guess={A.y: -1.5})
+    assert isnear(sol[A.y], -2.0)
+    assert len(A[...].solvers) == 2
+
+    B = System()
+    B.x = B.a * B.y
+    B.y = sympy.exp(-B.x)
+    for a in [0.5, 1.0, 2.0]:
+        sol = B[...].nsolve({'a': a})
+        assert isnear(sol[B.x], a * numpy.exp(-sol[B.x]))
+        assert B.a not in sol
+    assert len(B[...].solvers) == 1
+    B.x = B.a * B.y + 1
+    assert not B[...].solvers
+    sol = B[...].nsolve({B.a: 1.0})
+    assert isnear(sol[B.x], numpy.exp(-sol[B.x]) + 1)
+
+    C = System()
+    C.x = C.y + C.z
+    assert raises(ValueError, lambda: C[...].nsolve())
+    C.y = C.y**2 + 1
+    C.z = 1
+    assert raises(ValueError, lambda: C[...].nsolve())
+
+
+def test_nsolve_batch():
+    A = System()
+    A.x = A.a * A.y
+    A.y = A.y**2 + A.y - A.b
+    a = numpy.linspace(0.5, 2.0, 7)
+    b = numpy.array([4.0, 9.0, 1.0, 2.0, 16.0, 0.25, 4.0])
+    sol, converged = A[...].nsolve_batch({A.a: a, A.b: b})
+    assert converged.all()
+    assert sol.dtype.names == ('x', 'y')
+    assert isnear(sol['y'], numpy.sqrt(b))
+    assert isnear(sol['x'], a * numpy.sqrt(b))
+    for i in [0, 3, 6]:
+        row = A[...].nsolve({A.a: a[i], A.b: b[i]})
+        assert isnear(row[A.x], sol['x'][i])
+    assert len(A[...].solvers) == 2
+
+    sol, converged = A[...].nsolve_batch({A.a: 1.0, A.b: b},
+                                         guess={A.y: -numpy.ones(7)})
+    assert isnear(sol['y'], -numpy.sqrt(b))
+
+    sol, converged = A[...].nsolve_batch({A.a: a, A.b: [4.0, -4.0] * 3 + [1]},
+                                         maxiter=30)
+    assert list(converged) == [True, False] * 3 + [True]
+    assert isnear(sol['y'][::2], [2.0, 2.0, 2.0, 1.0])
+    assert raises(ValueError,
+                  lambda: A[...].nsolve_batch({A.a: numpy.ones((2, 2)),
+                                               A.b: 1.0}))
+    # nothing left to solve still gives one result per instance
+    B = System()
+    sol, converged = B[...].nsolve_batch({B.a: a, B.b: 1.0})
+    assert converged.dtype == bool and list(converged) == [True] * 7
+    assert len(sol) == 7 and sol.dtype.names == ()
+
+
+def test_blocks():
+    A = System()
+    A.x = A.y + A.z
+    A.y = sympy.cos(A.z) * A.a
+    A.z = A.w**2 - A.z
+    A.w = A.v + 1
+    A.v = 2 - A.w
+    blocks = A[...].blocks({'a': 1.0})
+    assert [set(block.unknowns) for block in blocks] == [
+        set([A.v, A.w]), set([A.z]), set([A.y]), set([A.x])]
+    assert all(len(block.equations) == len(block.unknowns)
+               for block in blocks)
+    assert set(A) == set(eq for block in blocks for eq in block.equations)
+    assert raises(ValueError, lambda: A[...].blocks())
+    assert raises(ValueError, lambda: A[...].blocks({A.x: 1.0, A.a: 1.0}))
+
+    sol = A[...].nsolve({A.a: 1.0})
+    assert isnear([sol[A.w], sol[A.z]], [1.5, 1.125])
+    assert isnear(sol[A.x], sol[A.y] + sol[A.z])
+    # the explicit blocks for y and x are evaluated by one solver
+    assert len(A[...].solvers) == 3
+    step = A[...].plan((A.v, A.w, A.x, A.y, A.z))[-1]
+    assert [block.unknowns for block in step] == [(A.y,), (A.x,)]
+
+    B = System()
+    n = 300
+    B[0] = 1
+    B[1:n] = [B[i - 1] + i for i in range(1, n)]
+    assert len(B[...].blocks()) == n
+    sol = B[...].nsolve()
+    assert isnear(sol[B[n - 1]], 1 + n * (n - 1) / 2)
+
+
+def test_incremental():
+    A = System()
+    A.w = A.v + 1
+    A.v = 2 - A.w
+    A.z = A.w**2 - A.z
+    A.y = sympy.cos(A.z) * A.a
+    A.x = A.y + A.z
+    base = A[...]
+    sol = base.nsolve({A.a: 1.0})
+    solvers = dict(base.solvers)
+    solutions = dict(base.solutions)
+    assert len(solvers) == len(solutions) == 3
+
+    # same structure: only the last step is recompiled and solved again
+    A.x = A.y - A.z
+    assert len(base.solvers) == 2
+    assert base.decompositions
+    sol2 = base.nsolve({A.a: 1.0})
+    assert isnear(sol2[A.x], sol[A.y] - sol[A.z])
+    for key in base.solvers:
+        if A.x not in key[-1].unknowns:
+            assert base.solvers[key] is solvers[key]
+            assert base.solutions[key] is solutions[key]
+
+    # a new parameter value only solves the steps that depend on it
+    base.nsolve({A.a: 2.0})
+    assert base.solutions[(base.blocks({A.a: 1})[0],)] is \
+        solutions[(base.blocks({A.a: 1})[0],)]
+
+    # changing the structure recomputes the decomposition
+    A.z = A.w - A.a
+    assert not base.decompositions
+    sol3 = base.nsolve({A.a: 1.0})
+    assert isnear(sol3[A.z], 0.5)
+    assert len(base.plan((A.v, A.w, A.x, A.y, A.z))) == 2
+
+    # redefining an equation with the same value keeps everything
+    solvers = dict(base.solvers)
+    A.z = A.w - A.a
+    assert base.solvers == solvers
+    assert base.plans
+
+    # repeated edits of one equation of a run leave no stale steps behind
+    B = System()
+    for i in range(10):
+        B[i] = B[i + 1] + B.r
+    B[10] = B.r
+    for r in range(5):
+        B[3] = B[4] + r
+        B[...].nsolve({B.r: 1.0})
+    assert len(B[...].solvers) == 1
+    steps = [step for steps in B[...].dependents.values() for step in steps]
+    assert len(steps) == 11
+    assert all(step in B[...].solvers for step in steps)
+
+
+def test_uses():
+    A = System()
+    A.x = 2*A.y
+    A.z = (A.x + A.y, A.w)
+    A[1] = A.w * A[2]
+    base = A[...]
+    assert base.uses(A.y) == set([A.x, A.z])
+    assert base.uses('w') == set([A.z, A[1]])
+    assert base.uses(A.x) == set([A.x, A.z])
+    assert base.uses(A[2]) == set([A[1]])
+    assert base.uses(A.v) == set()
+    assert base.depends_on(A.z) == set([A.x, A.y, A.w])
+    assert base.depends_on('x') == set([A.y])
+    assert base.depends_on(1) == set([A.w, A[2]])
+    assert base.depends_on(A.y) == set()
+    assert base.freesymbols() == sorted([A[1], A[2], A.w, A.x, A.y, A.z],
+                                        key=sympy.default_sort_key)
+
+    A.z = A.w
+    assert base.uses(A.y) == set([A.x])
+    assert base.uses(A.w) == set([A.z, A[1]])
+    assert base.depends_on(A.z) == set([A.w])
+    A.x = 3
+    assert base.uses(A.y) == set()
+    assert A.y not in base.freesymbols()
+
+
+def test_nsolve_parallel():
+    from concurrent.futures import ThreadPoolExecutor
+    A = System()
+    for i in range(6):
+        A[2*i] = A[2*i]**2 + A[2*i] - A[2*i + 1] - A.a
+        A[2*i + 1] = A[2*i] * (i + 1)
+    A.x = A.a + 1
+    expected = A[...].nsolve({A.a: 3.0})
+    sol = A[...].nsolve({A.a: 3.0}, workers=2)
+    assert set(sol) == set(expected)
+    assert all(isnear(sol[sym], expected[sym]) for sym in sol)
+    # the pool and the solvers compiled in its processes are kept
+    pool = A[...].pool(2)
+    assert A[...].pools == {2: pool}
+    sol = A[...].nsolve({A.a: 3.0}, workers=2)
+    assert all(isnear(sol[sym], expected[sym]) for sym in sol)
+    assert A[...].pool(2) is pool and A[...].fork()[...].pool(2) is pool
+    with ThreadPoolExecutor(3) as executor:
+        sol = A[...].nsolve({A.a: 3.0}, guess={A[0]: 10.0},
+                            executor=executor)
+    assert all(isnear(sol[sym], expected[sym]) for sym in sol)
+
+
+def test_solve_chunk(monkeypatch):
+    import eqpy._systems
+    from eqpy._systems import solve_chunk
+    x, y = sympy.symbols('x y')
+    # the systems kept by a worker are bounded
+    monkeypatch.setattr(eqpy._systems, 'chunksystems',
+                        dict.fromkeys(range(64)))
+    assert solve_chunk((sympy.Eq(x, 2*y),), {y: 1.0}, {}, 1e-10, 50) == {
+        x: 2.0}
+    assert len(eqpy._systems.chunksystems) == 1
+
+
+def test_solve():
     A = System()
+    A.x = 2*A.y
+    A.y = A.a**2 - 1
+    assert A[...].solve(unknowns=['x', A.y]) == [{A.x: 2*A.a**2 - 2,
+                                                  A.y: A.a**2 - 1}]
+    assert A[...].solve({'a': 2}) == [{A.x: 6, A.y: 3}]
+    assert A[...].solve({A.a: 2, A.y: 4}) == []
+    B = System()
+    B[1] = B[1]**2 - 4 + B[1]
+    assert sorted(sol[B[1]] for sol in B[...].solve()) == [-2, 2]
+
+
+def test_iter_solutions(monkeypatch):
+    import eqpy._systems
+    A = System()
+    A.x = A.x**2 - 4 + A.x
+    A.y = A.y**2 - A.x + A.y
+    A.z = A.y + 1
+    solutions = A[...].iter_solutions()
+    calls = []
+    solve = eqpy._systems.symbolic_solve
+    monkeypatch.setattr(eqpy._systems, 'symbolic_solve',
+                        lambda *args: calls.append(args) or solve(*args))
+    first = next(solutions)
+    assert len(calls) == 3
+    assert first[A.x]**2 == 4 and first[A.y]**2 == first[A.x]
+    assert first[A.z] == first[A.y] + 1
+    rest = list(solutions)
+    assert len(rest) == 3
+    assert sorted([first] + rest, key=str) == sorted(A[...].solve(), key=str)
+    A(A.y > 0)
+    assert list(A[...].iter_solutions()) == [
+        {A.x: 2, A.y: sympy.sqrt(2), A.z: sympy.sqrt(2) + 1}]
+
+    B = System()
+    B.y = B.a * B.x
+    B.x = B.x**2 - B.a + B.x
+    sweep = B[...].iter_solutions({'a': itertools.count(1)}, numeric=True)
+    for (point, solution), _ in zip(sweep, range(3)):
+        pass
+    assert point == {B.a: 3}
+    assert isnear(solution[B.x], 3**0.5)
+    assert list(B[...].iter_solutions({'a': [1, 4], 'b': 2})) == [
+        ({B.a: 1}, {B.x: -1, B.y: -1}), ({B.a: 1}, {B.x: 1, B.y: 1}),
+        ({B.a: 4}, {B.x: -2, B.y: -8}), ({B.a: 4}, {B.x: 2, B.y: 8})]
+    points = list(B[...].iter_solutions({'a': [4, 9], 'c': (0, 1)},
+                                        numeric=True))
+    assert [point for point, _ in points] == [
+        {B.a: 4, B.c: 0}, {B.a: 9, B.c: 1}]
+    assert isnear(points[1][1][B.y], 27.0)
+    assert [point for point, _ in B[...].iter_solutions(
+        {'a': [1, 4]}, numeric=True)] == [{B.a: 1}, {B.a: 4}]
+    solution, = B[...].iter_solutions({'a': 4}, numeric=True, guess={B.x: 1})
+    assert isnear(solution[B.y], 8.0)
+
+    C = System()
+    C.x = C.x**2 - 4 + C.x
+    C.y = C.x + 1
+    C(sympy.sin(C.x) > 0)
+    assert list(C[...].iter_solutions()) == [{C.x: 2, C.y: 3}]
+    # systems without a block decomposition are solved at once
+    C(C.y > 0)
+    assert list(C[...].iter_solutions({C.y: -1})) == []
+    C.y = sympy.Eq(C.x + 1, 3)
+    assert list(C[...].iter_solutions()) == [{C.x: 2, C.y: 3}]
+
+
+def test_solve_exact(monkeypatch):
+    n = 40
+    A = System()
+    for i in range(1, n):
+        A[i] = A[i - 1] * sympy.Rational(3, 2) - A[i + 1] / 3 + i
+    A[n] = A[1] + A[n - 1] / 7
+
+    def fail(*args, **kwargs):
+        raise AssertionError('sympy.solve should not be called')
+    monkeypatch.setattr(sympy, 'solve', fail)
+    solution, = A[...].solve({A[0]: 1})
+    assert len(solution) == n
+    assert all(val.is_Rational for val in solution.values())
+    for eq in A:
+        assert eq.xreplace(solution).xreplace({A[0]: 1}) is sympy.true
+
+
+def test_solve_cache(tmpdir, monkeypatch):
+    def build(**kwargs):
+        A = System(**kwargs)
+        A[0] = A[1]**2 - A.a
+        A[1] = A[0] - 2*A[1]
+        return A
+
+    path = str(tmpdir.join('cache'))
+    A = build()
+    expected = A[...].solve({A.a: 3}, cache=path)
+    assert len(tmpdir.join('cache').listdir()) == 1
+
+    def fail(equations, unknowns):
+        raise AssertionError('solved again')
+    monkeypatch.setattr('eqpy._systems.symbolic_solve', fail)
+    B = build(solve_cache=path)
+    assert B[1] is not A[1]
+    sol = B[...].solve({B.a: 3})
+    assert sol == [{B[0]: s[A[0]], B[1]: s[A[1]]} for s in expected]
+
+
+def test_continuation():
+    A = System()
+    A.x = A.a * A.y
+    A.y = A.y**2 + A.y - A.a
+    targets = numpy.linspace(1.0, 50.0, 25)
+    sols = A[...].continuation(A.a, targets, guess={A.y: -0.5})
+    assert len(sols) == 25
+    assert isnear([sol[A.y] for sol in sols], -numpy.sqrt(targets))
+    assert isnear([sol[A.x] for sol in sols], -targets * numpy.sqrt(targets))
+
+    # large jumps are split into smaller steps
+    sols = list(A[...].sweep('a', [1.0, 1e6], maxiter=3,
+                             predictor='constant'))
+    assert [target for target, sol in sols] == [1.0, 1e6]
+    assert isnear(sols[1][1][A.y], 1000.0)
+
+    B = System()
+    B.y = B.y**2 + B.y - B.a
+    assert raises(ValueError, lambda: B[...].continuation('a', [1.0, -1.0]))
+    assert raises(ValueError,
+                  lambda: B[...].continuation('a', [1.0], predictor='x'))
+
+
+def test_cse():
+    def build(**kwargs):
+        A = System(**kwargs)
+        poly = 1 + A.t + A.t**2 / 2 + A.t**3 / 6
+        A.t = A.a + 1
+        A.x = poly * A.y + sympy.sqrt(poly)
+        A.y = poly - A.x / 10 + sympy.cos(A.y)
+        A.z = poly * A.x + sympy.exp(A.t + A.x)
+        A.w = sympy.exp(A.t + A.x) * A.z
+        return A
+    A = build()
+    B = build(cse=True)
+    expected = A[...].nsolve({A.a: 0.5})
+    sol = B[...].nsolve({B.a: 0.5})
+    assert all(isnear(sol[sym], expected[sym]) for sym in expected)
+    before, after = B[...].count_ops({B.a: 0.5})
+    assert after < before
+    assert A[...].count_ops({A.a: 0.5}) == (before, before)
+    f = B[...].compile()
+    assert f.count_ops()[1] < f.count_ops()[0]
+    assert A[...].compile(cse=True).count_ops() == f.count_ops()
+    args = [1.0, 2.0, 3.0, 4.0, 5.0, 6.0]
+    assert isnear(f(*args), A[...].compile()(*args))
+
+
+def test_nsolve_linear():
+    from eqpy._linear import LinearSolver
+    # a ring of resistors, all of which are coupled in one block
+    n = 200
+    A = System()
+    for i in range(n):
+        A[i] = (A[(i - 1) % n] + A[(i + 1) % n] + A.s * (i % 7)) / (2 + A.g)
+    sol = A[...].nsolve({A.s: 1.0, A.g: 0.5})
+    assert len(A[...].blocks({A.s: 1.0, A.g: 0.5})) == 1
+    assert isinstance(list(A[...].solvers.values())[0], LinearSolver)
+    v = numpy.array([sol[A[i]] for i in range(n)])
+    assert isnear(2.5 * v, numpy.roll(v, 1) + numpy.roll(v, -1) +
+                  numpy.arange(n) % 7)
+    sols, converged = A[...].nsolve_batch({A.s: [1.0, 2.0], A.g: 0.5})
+    assert converged.all()
+    assert isnear(sols[str(A[5])], [v[5], 2 * v[5]])
+
+
+def test_linear():
+    numpy.random.seed(0)
+    n = 50
+    coeffs = numpy.random.rand(n, n) / n
+    offsets = numpy.random.rand(n)
+    A = System()
+    A[0:n] = Linear(coeffs, A[0:n], offsets)
+    expected = numpy.linalg.solve(numpy.eye(n) - coeffs, offsets)
+    sol = A[...].nsolve({})
+    assert isnear([sol[A[i]] for i in range(n)], expected)
+    assert A[A[3]][0].lhs is A[3]
+    assert isinstance(A[A[3]][0].rhs, sympy.Add)
+    # rows that are redefined leave the block
+    A[3] = A.p
+    sol = A[...].nsolve({A.p: 2.0})
+    assert isnear(sol[A[3]], 2.0)
+    assert isnear(sol[A[0]], offsets[0] + coeffs[0].dot(
+        [sol[A[i]] for i in range(n)]))
+    # constant arrays and rows that feed nonlinear equations
+    B = System()
+    B[0:3] = numpy.array([1.0, 2.0, 3.0])
+    B[3:5] = Linear(numpy.array([[1.0, 1.0], [0.0, 2.0]]), [B[2], B.y], 1.0)
+    B.y = B[4]**2 / 100 + B.q
+    sols, converged = B[...].nsolve_batch({B.q: [0.0, 1.0]})
+    assert converged.all()
+    assert isnear(sols[str(B[3])], sols[str(B.y)] + 4.0)
+    assert isnear(sols[str(B[4])], 2*sols[str(B.y)] + 1.0)
+    assert raises(ValueError, lambda: B[...].linear(
+        range(2), numpy.ones((3, 1)), [B.y]))
+    for keys in [[0, 2, 3], [1, 1]]:
+        assert raises(ValueError, lambda: B[...].linear(
+            keys, numpy.zeros((len(keys), 0)), (), 1.0))
+    B[...].linear([30, 20, 10], numpy.zeros((3, 0)), (), [1., 2., 3.])
+    assert B[...].equations[B[10]] == [sympy.Eq(B[10], 3.0)]
+
+
+def test_fork():
+    A = System()
+    for i in range(5):
+        A[i] = A[i + 1] / 2 + A.r
+    A[5] = A.x**2 + A.y
+    A.y = 3 * A.r
+    A['k'] = 1
+    A(A.r >= 0)
+    expected = A[...].nsolve({A.r: 0.5, A.x: 1.0})
+    B = A[...].fork()
+    C = A[...].fork()
+    assert B[2] is A[2] and C.x is A.x
+    assert A[...].symbols.base is B[...].symbols.base
+    # unchanged forks reuse the compiled solvers
+    step = A[...].plan((A[0], A[1], A[2], A[3], A[4], A[5], A.y))[0]
+    assert B[...].solver(step) is A[...].solver(step)
+    B.y = 4 * B.r
+    B['k'] = 2
+    B(B.x <= 5)
+    C.z = 1
+    assert A[A.y] == [sympy.Eq(A.y, 3 * A.r)]
+    assert B[B.y] == [sympy.Eq(B.y, 4 * B.r)]
+    assert A['k'] == 1 and B['k'] == 2
+    assert len(A[...].assumptions) == 1 and len(B[...].assumptions) == 2
+    assert A.z not in A[...].equations and C.z in C[...].equations
+    assert A[...].uses(A.r) == C[...].uses(A.r) == B[...].uses(B.r)
+    assert isnear(A[...].nsolve({A.r: 0.5, A.x: 1.0})[A[5]],
+                  expected[A[5]])
+    assert isnear(B[...].nsolve({B.r: 0.5, B.x: 1.0})[B[5]], 3.0)
+    assert isnear(C[...].nsolve({C.r: 0.5, C.x: 1.0})[C[5]], 2.5)
+    D = B[...].fork()
+    D[5] = D.y
+    assert isnear(D[...].nsolve({D.r: 0.5, D.x: 1.0})[D[5]], 2.0)
+    assert isnear(B[...].nsolve({B.r: 0.5, B.x: 1.0})[B[5]], 3.0)
+
+
+def test_profile():
+    A = System()
+    A.y = A.x**3 + A.r
+    A.x = sympy.exp(-A.y)
+    assert A[...].profiler is None
+    A[...].nsolve({A.r: 0.5})
+    assert A[...].stats() == {'time': {}, 'calls': {}, 'counts': {}}
+    events = []
+    A[...].profile(callback=lambda phase, seconds: events.append(phase))
+    A.x = sympy.exp(-A.y) / 2
+    A.w = A.x + 1
+    A[...].nsolve({A.r: 0.5})
+    A[...].nsolve({A.r: 0.5})
+    stats = A[...].stats(reset=True)
+    assert set(['symbol', 'equation', 'decompose', 'solver', 'derive',
+                'compile', 'iterate']) <= set(stats['time'])
+    assert stats['calls']['equation'] == 2
+    assert sorted(events) == sorted(
+        phase for phase, calls in stats['calls'].items()
+        for _ in range(calls))
+    counts = stats['counts']
+    assert counts['solution.hit'] == counts['solution.miss'] == 2
+    assert counts['iterations'] > 0 and counts['kernel.nodes'] > 0
+    assert A[...].stats()['counts'] == {}
+    A.z = 2 * A.r
+    A[...].solve({A.r: 1}, [A.z])
+    assert 'symbolic' in A[...].stats()['time']
+    A[...].profile(False)
+    assert A[...].profiler is None
+    A[...].profile(lambda phase, seconds: events.append(phase))
+    assert A[...].profiler is not None
+    A[...].profile(False)
+    B = System(profile=True)
+    B.x = 1
+    assert B[...].stats()['calls']['equation'] == 1
+    # forks count their own work
+    C = B[...].fork()
+    C.y = 2
+    assert B[...].stats()['calls']['equation'] == 1
+    assert C[...].stats()['calls']['equation'] == 1
+
+
+def test_threads():
+    import sys
+    import threading
+    interval = getattr(sys, 'getswitchinterval', lambda: None)()
+    if interval is not None:
+        # switch threads as often as possible to provoke races
+        sys.setswitchinterval(1e-6)
+    A = System()
+    nthreads = 8
+    n = 300
+    start = threading.Event()
+    seen = [None] * nthreads
+    errors = []
+
+    def work(k):
+        try:
+            start.wait()
+            symbols = []
+            for i in range(n):
+                symbols.append(A[i])
+                symbols.append(getattr(A, 'x%d' % (i % 50)))
+            symbols.extend(A[n:2 * n])
+            for i in range(k, n, nthreads):
+                A[i] = A[i + 1] / 2 + A.r
+            seen[k] = symbols
+        except Exception as exc:
+            errors.append(exc)
+    threads = [threading.Thread(target=work, args=(k,))
+               for k in range(nthreads)]
+    try:
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+    finally:
+        if interval is not None:
+            sys.setswitchinterval(interval)
+    assert not errors
+    for symbols in seen[1:]:
+        assert all(a is b for a, b in zip(symbols, seen[0]))
+    assert A[1] is A[1] and A[1] is seen[0][2]
+    assert len(A[...].symbols) == 2 * n + 50 + 1
+    assert all(A[...].symbolnames[A[i]] == i for i in range(2 * n))
+    assert len(A[...].equations) == n
+    assert A[...].uses(A.r) == frozenset(A[i] for i in range(n))
+    sol = A[...].nsolve({A.r: 1.0, A[n]: 2.0})
+    assert isnear(sol[A[n - 1]], 2.0)
+
+    # a symbol created by another thread between the two lookups is kept
+    other = sympy.Symbol('other')
+
+    class Racing(dict):
+        def get(self, key, default=None):
+            if key not in self:
+                self[key] = other
+                return default
+            return dict.get(self, key, default)
+    B = System()
+    B[...].symbols = Racing()
+    assert B.z is other
+
+
+def test_solve_async():
+    import asyncio
+    import multiprocessing
+    from concurrent.futures import ThreadPoolExecutor
+    from eqpy._systems import current_loop
+    from eqpy._tasks import run_process
+    A = System()
+    A.y = A.x**2 - 2
     A(A.x > 0)
+    loop = asyncio.new_event_loop()
+    try:
+        future = A[...].solve_async({A.y: 0}, loop=loop)
+        assert loop.run_until_complete(future) == [{A.x: sympy.sqrt(2)}]
+        with ThreadPoolExecutor(2) as executor:
+            futures = [A[...].solve_async({A.y: y}, executor=executor,
+                                          timeout=60, loop=loop)
+                       for y in [-2, 2]]
+            assert loop.run_until_complete(asyncio.gather(*futures)) == [
+                [], [{A.x: 2}]]
+        # stuck workers are terminated on timeout and on cancellation
+        future = asyncio.wait_for(run_process(loop, time.sleep, (60,)), 0.2)
+        assert raises(asyncio.TimeoutError,
+                      lambda: loop.run_until_complete(future))
+        future = A[...].solve_async({A.y: 0}, loop=loop)
+        future.cancel()
+        assert raises(asyncio.CancelledError,
+                      lambda: loop.run_until_complete(future))
+        for _ in range(100):
+            if not multiprocessing.active_children():
+                break
+            time.sleep(0.05)
+        assert not multiprocessing.active_children()
+        # the loop of this thread is used by default
+        asyncio.set_event_loop(loop)
+        future = A[...].solve_async({A.y: -3})
+        assert loop.run_until_complete(future) == []
+        found = []
+        loop.call_soon(lambda: found.append(current_loop()))
+        loop.run_until_complete(asyncio.sleep(0))
+        assert found == [loop]
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+def slow(seconds):
+    yield 1
+    time.sleep(seconds)
+    yield 2
+
+
+def test_solve_hybrid(monkeypatch):
+    import multiprocessing
+    import eqpy._tasks
+    from eqpy._systems import solve_blocks
+    from eqpy._tasks import stream
+    A = System()
+    A.x = A.r**2 + 1
+    A.y = sympy.exp(-A.y) / 3 + sympy.cos(A.y * A.x)
+    B = System()
+    B.x = B.r**2 + 1
+    B.y = 2 * B.x + B.r
+    assert B[...].solve_hybrid({B.r: 2}) == ({B.x: 5, B.y: 12}, 'symbolic')
+    solution, method = A[...].solve_hybrid({A.r: 1}, ops=3, guess={A.y: 0.5})
+    assert method == 'mixed'
+    assert solution[A.x] == 2 and isinstance(solution[A.x], sympy.Integer)
+    assert abs(solution[A.y] - 0.581976523001) < 1e-9
+    solution, method = A[...].solve_hybrid({A.r: 1}, budget=0,
+                                           guess={A.y: 0.5})
+    assert method == 'numeric' and isinstance(solution[A.x], float)
+    C = System()
+    C.y = C.x**2
+    C.x = C.z + 1
+    C(C.x > 0)
+    C(C.y < -1)
+    assert raises(ValueError, lambda: C[...].solve_hybrid({C.z: 1}))
+    # inadmissible and non-numeric block solutions are left to nsolve
+    D = System()
+    D.x = D.r + 3
+    D.y = D.x**2
+    D(sympy.sin(D.x) > 0)
+    assert raises(ValueError, lambda: D[...].solve_hybrid({D.r: 1}))
+    assert D[...].solve_hybrid({D.r: 0}) == ({D.x: 3, D.y: 9}, 'symbolic')
+    monkeypatch.setattr(eqpy._tasks, 'stream',
+                        lambda func, args, budget: iter([{D.x: D.t}]))
+    solution, method = D[...].solve_hybrid({D.r: 0})
+    assert method == 'numeric' and solution == {D.x: 3.0, D.y: 9.0}
+    monkeypatch.undo()
+
+    # blocks are solved in turn until one cannot be
+    def blocks(system, values, ops=None):
+        restricted, restored = system[...].restrict(values)
+        return list(solve_blocks(system[...].blocks(values), restricted,
+                                 restored, ops, None))
+    assert blocks(B, {B.r: 2}) == [{B.x: 5}, {B.y: 12}]
+    assert blocks(A, {A.r: 1}, ops=3) == [{A.x: 2}]
+    E = System()
+    E.z = E.z * (E.r + 1) + 1
+    assert blocks(E, {E.r: 0}) == []
+    assert list(E[...].iter_solutions({E.r: 0})) == []
+    F = System()
+    F.x = F.x**2 + 1
+    F.y = F.x**F.x - 3
+    assert blocks(F, {}) == []
+    F.x = F.x**2 - 1 + F.x
+    F.y = sympy.cos(F.y) + F.x
+    assert blocks(F, {}) == [{F.x: -1}]
+    # the worker is terminated when the budget runs out
+    start = time.time()
+    assert list(stream(slow, (60,), 0.5)) == [1]
+    assert time.time() - start < 30
+    for _ in range(100):
+        if not multiprocessing.active_children():
+            break
+        time.sleep(0.05)
+    assert not multiprocessing.active_children()
+
+
+def test_nsolve_precision():
+    A = System(profile=True)
+    big = sympy.Float(10**6)
+    # cancellation leaves x**3 = c, with rounding errors in floats that are
+    # much larger than the tolerance
+    A.c = (A.x + big)**3 - big**3 - 3 * big**2 * A.x - 3 * big * A.x**2
+    assert raises(ValueError, lambda: A[...].nsolve({A.c: 2}))
+    solution = A[...].nsolve({A.c: 2}, precision=60)
+    assert isnear(solution[A.x], 2**(1.0 / 3))
+    assert A[...].stats()['counts']['refined.iterations'] > 0
+    # blocks that converge in floats are not refined
+    B = System(profile=True)
+    B.y = sympy.exp(B.x) / 3 - B.r
+    B.z = B.x**2 + B.y
+    solution = B[...].nsolve({B.r: 0.1, B.z: 3}, precision=60)
+    assert isnear(solution[B.y], numpy.exp(solution[B.x]) / 3 - 0.1)
+    assert 'refined.iterations' not in B[...].stats()['counts']
+    # iterates that overflow in floats restart from the guess
+    C = System()
+    C.c = sympy.exp(C.x) * sympy.Float(1e-300) - 2
+    with numpy.errstate(all='ignore'):
+        solution = C[...].nsolve({C.c: 0}, {C.x: 720.0}, precision=40)
+    assert isnear(solution[C.x], numpy.log(2e300))
+
+
+def test_import_without_numpy():
+    import subprocess
+    import sys
+    code = ("import sys; sys.modules['numpy'] = None; import eqpy; "
+            "A = eqpy.System(); A.x = 2 * A.y; A.y = 3; "
+            "assert A[...].solve() == [{A.x: 6, A.y: 3}]; "
+            "assert len(list(A[0:3])) == 3")
+    subprocess.check_call([sys.executable, '-c', code])
@@ -0,0 +1,144 @@
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import Executor, Future
+from eqpy._tasks import (chain, context, produce, receive, run_process,
+                         stream, waiters, work)
+from eqpy._utils import raises
+
+
+class Unpicklable(Exception):
+    def __init__(self):
+        Exception.__init__(self)
+        self.func = lambda: None
+
+
+class Finished(object):
+    """Stands in for a process that already ended"""
+    exitcode = 0
+
+    def join(self):
+        pass
+
+
+def fail(*args):
+    raise ValueError('fail')
+
+
+def unpicklable():
+    raise Unpicklable()
+
+
+def items(n, error=None):
+    for i in range(n):
+        yield i
+    if error is not None:
+        raise error
+
+
+def results(target, func, args):
+    """Run `target` in this process and return what it sends"""
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    target(sender, func, args)
+    out = []
+    try:
+        while True:
+            out.append(receiver.recv())
+    except EOFError:
+        return out
+    finally:
+        receiver.close()
+
+
+def test_work():
+    assert results(work, sum, ([1, 2],)) == [(True, 3)]
+    (ok, exc), = results(work, fail, ())
+    assert not ok and isinstance(exc, ValueError)
+    (ok, exc), = results(work, lambda: lambda: None, ())
+    assert not ok and isinstance(exc, RuntimeError)
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    work(sender, fail, ())
+    assert raises(ValueError, lambda: receive(Finished(), receiver))
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    sender.close()
+    assert raises(RuntimeError, lambda: receive(Finished(), receiver))
+
+
+def test_produce():
+    assert results(produce, items, (2,)) == [(True, 0), (True, 1)]
+    out = results(produce, items, (1, ValueError('stop')))
+    assert out[0] == (True, 0)
+    assert not out[1][0] and isinstance(out[1][1], ValueError)
+    (ok, exc), = results(produce, unpicklable, ())
+    assert not ok and isinstance(exc, RuntimeError)
+
+
+def test_stream():
+    assert list(stream(items, (3,))) == [0, 1, 2]
+    found = []
+
+    def collect():
+        for item in stream(items, (2, ValueError('stop'))):
+            found.append(item)
+    assert raises(ValueError, collect)
+    assert found == [0, 1]
+
+
+def test_chain():
+    loop = asyncio.new_event_loop()
+    try:
+        def run(future, func=lambda value: value + 1):
+            out = chain(loop, future, func)
+            return loop.run_until_complete(asyncio.wait([out])) and out
+
+        future = loop.create_future()
+        future.set_result(1)
+        assert run(future).result() == 2
+        future = loop.create_future()
+        future.set_exception(ValueError('fail'))
+        assert isinstance(run(future).exception(), ValueError)
+        future = loop.create_future()
+        future.set_result(1)
+        assert isinstance(run(future, fail).exception(), ValueError)
+        future = loop.create_future()
+        future.cancel()
+        assert run(future).cancelled()
+        # cancelling the chained future cancels the original one
+        future = loop.create_future()
+        out = chain(loop, future, fail)
+        out.cancel()
+        loop.run_until_complete(asyncio.sleep(0))
+        assert future.cancelled()
+    finally:
+        loop.close()
+
+
+class Later(Executor):
+    """Executor that only runs what is submitted when asked to"""
+    def __init__(self):
+        self.calls = []
+
+    def submit(self, func, *args):
+        self.calls.append((func, args))
+        return Future()
+
+
+def test_run_process(monkeypatch):
+    import eqpy._tasks
+    # forking a process with threads can deadlock
+    assert context().get_start_method() != 'fork'
+    assert waiters() is waiters()
+    loop = asyncio.new_event_loop()
+    try:
+        future = run_process(loop, sum, ([1, 2],))
+        assert loop.run_until_complete(future) == 3
+        # processes of cancelled calls do not start
+        later = Later()
+        monkeypatch.setattr(eqpy._tasks, 'waiters', lambda: later)
+        future = run_process(loop, time.sleep, (60,))
+        future.cancel()
+        loop.run_until_complete(asyncio.sleep(0))
+        (func, args), = later.calls
+        assert raises(RuntimeError, lambda: func(*args))
+    finally:
+        loop.close()